@@ -0,0 +1,533 @@
+"""Benchmarks of transfer methods and workflow orchestration.
+
+make_synth_tree : write synthetic MRIQC output tree
+bench_transfer : time rsync and tar stream transfers of synthetic tree
+make_synth_bids : write synthetic BIDS rawdata of many subjects
+bench_orchestration : time mriqc_subj end-to-end against local stand-ins
+
+"""
+
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import shlex
+import struct
+import shutil
+import subprocess
+import importlib.util
+from typing import Union
+from func_mriqc import runner
+
+# mriqc_subj options of each scheduling mode, {limit} is replaced by
+# the concurrency of the benchmark.
+ORCH_MODES = {
+    "subj": [],
+    "array": ["--array", "--array-limit", "{limit}"],
+    "stages": ["--stage-dag", "--array", "--array-limit", "{limit}"],
+    "pipeline": ["--pipeline", "--pipeline-workers", "{limit}"],
+}
+
+# Run mriqc_subj main, bypassing the DCC host check
+_CLI_DRIVER = """\
+import sys
+import types
+from func_mriqc.cli import mriqc_subj
+
+mriqc_subj.platform = types.SimpleNamespace(
+    uname=lambda: types.SimpleNamespace(node="dcc-bench")
+)
+sys.argv[0] = "mriqc_subj"
+mriqc_subj.main()
+"""
+
+
+def make_synth_tree(
+    out_dir: Union[str, os.PathLike],
+    subj: str = "sub-ER0009",
+    sess: str = "ses-day2",
+    num_files: int = 2000,
+    file_kb: int = 8,
+) -> str:
+    """Write synthetic tree of many small MRIQC-like output files.
+
+    Parameters
+    ----------
+    out_dir : str, os.PathLike
+        Location for writing tree
+    subj : str, optional
+        BIDS subject identifier
+    sess : str, optional
+        BIDS session identifier
+    num_files : int, optional
+        Number of files to write
+    file_kb : int, optional
+        Size of each file (KB)
+
+    Returns
+    -------
+    str
+        Location of subject directory
+
+    """
+    subj_dir = os.path.join(out_dir, subj)
+    fig_dir = os.path.join(subj_dir, "figures")
+    sess_dir = os.path.join(subj_dir, sess, "func")
+    for h_dir in [fig_dir, sess_dir]:
+        if not os.path.exists(h_dir):
+            os.makedirs(h_dir)
+
+    content = os.urandom(file_kb * 512) * 2
+    for idx in range(num_files):
+        h_ext = ["svg", "html", "json"][idx % 3]
+        h_dir = fig_dir if h_ext == "svg" else sess_dir
+        with open(
+            os.path.join(h_dir, f"{subj}_{sess}_run-{idx:05d}_bold.{h_ext}"),
+            "wb",
+        ) as hf:
+            hf.write(content)
+    return subj_dir
+
+
+def _time_cmd(bash_cmd: str) -> float:
+    """Return seconds taken by bash command, raise on failure."""
+    start = time.monotonic()
+    h_sp = subprocess.run(bash_cmd, shell=True, capture_output=True)
+    if h_sp.returncode != 0:
+        raise RuntimeError(h_sp.stderr.decode("utf-8"))
+    return time.monotonic() - start
+
+
+def bench_transfer(
+    out_dir: Union[str, os.PathLike],
+    num_files: int = 2000,
+    file_kb: int = 8,
+    ssh_cmd: str = None,
+    remote_addr: str = None,
+    remote_dir: str = None,
+) -> dict:
+    """Time rsync and tar stream transfers of a synthetic output tree.
+
+    Mirrors the push commands of process.PushPull. Transfers are local
+    unless ssh_cmd, remote_addr, and remote_dir are specified, allowing
+    the methods to be compared over a high-latency link.
+
+    Parameters
+    ----------
+    out_dir : str, os.PathLike
+        Location for writing synthetic tree and local destinations
+    num_files : int, optional
+        Number of files in synthetic tree
+    file_kb : int, optional
+        Size of each file (KB)
+    ssh_cmd : str, optional
+        SSH command, e.g. "ssh -i ~/.ssh/id_rsa"
+    remote_addr : str, optional
+        Remote user@host
+    remote_dir : str, optional
+        Remote destination parent directory, removed after each method
+
+    Returns
+    -------
+    dict
+        {method: seconds}, None when required tools are not available
+
+    Example
+    -------
+    bench_transfer("/tmp/bench", num_files=5000)
+
+    """
+    src_dir = os.path.join(out_dir, "src")
+    subj_dir = make_synth_tree(src_dir, num_files=num_files, file_kb=file_kb)
+    subj = os.path.basename(subj_dir)
+    remote = ssh_cmd and remote_addr and remote_dir
+
+    out_dict = {}
+    for method in ["rsync", "tar", "tar.gz"]:
+        tool = "rsync" if method == "rsync" else "tar"
+        if not shutil.which(tool):
+            out_dict[method] = None
+            continue
+
+        # Build transfer command
+        z_opt = "z" if method == "tar.gz" else ""
+        dst = (
+            os.path.join(remote_dir, f"dst_{method}")
+            if remote
+            else os.path.join(out_dir, f"dst_{method}")
+        )
+        if method == "rsync" and remote:
+            bash_cmd = (
+                f'{ssh_cmd} {remote_addr} "mkdir -p {dst}" && '
+                + f'rsync -e "{ssh_cmd}" -rau {subj_dir} {remote_addr}:{dst}'
+            )
+        elif method == "rsync":
+            bash_cmd = f"mkdir -p {dst} && rsync -rau {subj_dir} {dst}"
+        elif remote:
+            bash_cmd = (
+                f"cd {src_dir} && tar -c{z_opt}f - {subj} | "
+                + f"{ssh_cmd} {remote_addr} "
+                + f'"mkdir -p {dst} && tar -C {dst} -x{z_opt}f -"'
+            )
+        else:
+            bash_cmd = (
+                f"mkdir -p {dst} && cd {src_dir} && "
+                + f"tar -c{z_opt}f - {subj} | tar -C {dst} -x{z_opt}f -"
+            )
+        out_dict[method] = _time_cmd(bash_cmd)
+
+        # Clean destination
+        if remote:
+            _ = _time_cmd(f'{ssh_cmd} {remote_addr} "rm -r {dst}"')
+        else:
+            shutil.rmtree(dst)
+
+    for method, seconds in out_dict.items():
+        msg = "unavailable" if seconds is None else f"{seconds:.2f}s"
+        print(f"\t{method:7s} : {msg}")
+    return out_dict
+
+
+def _synth_nifti(num_vols: int, file_kb: int) -> bytes:
+    """Return gzipped NIfTI-1 image of random uint8 voxels.
+
+    The header is valid and reports num_vols volumes (dim[4]), see
+    resources.nifti_volumes, with voxels totalling about file_kb.
+
+    """
+    vol_vox = max(file_kb * 1024 // max(num_vols, 1), 1)
+    dim_x = min(vol_vox, 64)
+    dim_y = min(-(-vol_vox // dim_x), 64)
+    dim_z = -(-vol_vox // (dim_x * dim_y))
+    dims = [4 if num_vols > 1 else 3, dim_x, dim_y, dim_z]
+    dims += [max(num_vols, 1), 1, 1, 1]
+    hdr = bytearray(352)
+    struct.pack_into("<i", hdr, 0, 348)
+    struct.pack_into("<8h", hdr, 40, *dims)
+    struct.pack_into("<2h", hdr, 70, 2, 8)
+    struct.pack_into("<8f", hdr, 76, 1.0, 1.0, 1.0, 1.0, 2.0, 0, 0, 0)
+    struct.pack_into("<f", hdr, 108, 352.0)
+    hdr[344:348] = b"n+1\0"
+    num_vox = dims[1] * dims[2] * dims[3] * dims[4]
+    return gzip.compress(bytes(hdr) + os.urandom(num_vox), compresslevel=1)
+
+
+def make_synth_bids(
+    raw_dir: Union[str, os.PathLike],
+    subj_list: list,
+    sess: str = "ses-day2",
+    num_runs: int = 2,
+    file_kb: int = 64,
+    num_vols: int = 100,
+):
+    """Write synthetic BIDS rawdata of many subjects.
+
+    Each session holds a T1w image and num_runs BOLD runs, with
+    JSON sidecars. Images are gzipped NIfTI-1 with valid headers and
+    about file_kb of random voxels, so features such as BOLD volumes
+    can be read (see resources.subj_features).
+
+    Parameters
+    ----------
+    raw_dir : str, os.PathLike
+        Location of rawdata directory
+    subj_list : list
+        BIDS subject identifiers
+    sess : str, optional
+        BIDS session identifier
+    num_runs : int, optional
+        Number of BOLD runs of each subject
+    file_kb : int, optional
+        Size of each image (KB)
+    num_vols : int, optional
+        Number of volumes of each BOLD run
+
+    """
+    os.makedirs(raw_dir, exist_ok=True)
+    with open(os.path.join(raw_dir, "dataset_description.json"), "w") as df:
+        json.dump({"Name": "synthetic", "BIDSVersion": "1.8.0"}, df)
+    content = {
+        "anat": _synth_nifti(1, file_kb),
+        "func": _synth_nifti(num_vols, file_kb),
+    }
+    for subj in subj_list:
+        stem_list = [("anat", f"{subj}_{sess}_T1w")] + [
+            ("func", f"{subj}_{sess}_task-movie_run-{x:02d}_bold")
+            for x in range(1, num_runs + 1)
+        ]
+        for modality, stem in stem_list:
+            h_dir = os.path.join(raw_dir, subj, sess, modality)
+            os.makedirs(h_dir, exist_ok=True)
+            with open(os.path.join(h_dir, f"{stem}.nii.gz"), "wb") as hf:
+                hf.write(content[modality])
+            with open(os.path.join(h_dir, f"{stem}.json"), "w") as jf:
+                json.dump({"RepetitionTime": 2.0}, jf)
+
+
+def _read_calls(state_dir: str) -> dict:
+    """Return call counts and transfer totals of stand-ins."""
+    out_dict = {"connects": 0, "files": 0, "bytes": 0}
+    calls_path = os.path.join(state_dir, "calls.jsonl")
+    if not os.path.exists(calls_path):
+        return out_dict
+    with open(calls_path) as cf:
+        for line in cf:
+            rec = json.loads(line)
+            key = f"{rec['tool']}_calls"
+            out_dict[key] = out_dict.get(key, 0) + 1
+            out_dict["connects"] += int(rec.get("connect", False))
+            out_dict["files"] += rec.get("files", 0)
+            out_dict["bytes"] += rec.get("bytes", 0)
+    return out_dict
+
+
+def _stage_seconds(log_dir: str) -> dict:
+    """Return total seconds of each stage in run telemetry."""
+    out_dict = {}
+    for tel_path in glob.glob(os.path.join(log_dir, "telemetry.jsonl")):
+        with open(tel_path) as tf:
+            for line in tf:
+                rec = json.loads(line)
+                if rec.get("event") == "stage":
+                    out_dict[rec["name"]] = (
+                        out_dict.get(rec["name"], 0.0) + rec["seconds"]
+                    )
+    return out_dict
+
+
+def _load_stand_ins():
+    """Return stand-ins module of the source checkout, tests/stand_ins.py."""
+    src_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "tests",
+        "stand_ins.py",
+    )
+    if not os.path.exists(src_path):
+        raise FileNotFoundError(
+            f"Missing stand-ins {src_path}, bench_orchestration requires "
+            + "a source checkout"
+        )
+    spec = importlib.util.spec_from_file_location("stand_ins", src_path)
+    stand_ins = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(stand_ins)
+    return stand_ins
+
+
+def bench_orchestration(
+    out_dir: Union[str, os.PathLike],
+    num_subj: tuple = (10, 100, 1000),
+    modes: tuple = ("subj", "array"),
+    concurrency: int = 10,
+    queue_latency: float = 0.5,
+    connect_latency: float = 0.1,
+    file_latency: float = 0.0,
+    mriqc_seconds: float = 1.0,
+    num_runs: int = 2,
+    file_kb: int = 64,
+    sess: str = "ses-day2",
+    cli_args: list = None,
+    timeout: float = None,
+) -> dict:
+    """Time mriqc_subj end-to-end against local stand-ins.
+
+    For each cohort size and scheduling mode (see ORCH_MODES), write
+    synthetic rawdata to a local Keoki directory and run mriqc_subj
+    with sbatch, sacct, squeue, ssh, rsync, singularity, and docker
+    replaced by the executables of tests/stand_ins.py, so a source
+    checkout is required. The DCC, Keoki, and /work
+    locations are redirected to out_dir via the FMQ_DCC_PROJ,
+    FMQ_KEOKI_PROJ, and FMQ_WORK_ROOT environment variables. The run
+    completes once all fake jobs finished.
+
+    Reported per run are the time spent in mriqc_subj itself, which
+    includes any submission throttling, the makespan until the last
+    job finished, and the orchestration time per subject, i.e. the
+    summed workflow stage time (telemetry.jsonl) less the fake MRIQC
+    runtime. File operations are counted via the stand-ins (sbatch,
+    ssh, and rsync calls, new SSH connections, and files and bytes
+    transferred by rsync), and peak memory as the maximum RSS of
+    mriqc_subj and of all jobs.
+
+    Parameters
+    ----------
+    out_dir : str, os.PathLike
+        Location for writing runs, replaced for each mode and size
+    num_subj : tuple, optional
+        Cohort sizes
+    modes : tuple, optional
+        Scheduling modes, keys of ORCH_MODES
+    concurrency : int, optional
+        Array limit or pipeline workers, and maximum number of
+        simultaneously running top-level jobs
+    queue_latency : float, optional
+        Seconds each job waits in the fake queue
+    connect_latency : float, optional
+        Seconds taken to establish a new SSH connection
+    file_latency : float, optional
+        Seconds taken by rsync for each transferred file
+    mriqc_seconds : float, optional
+        Seconds taken by each fake MRIQC run
+    num_runs : int, optional
+        Number of BOLD runs of each subject
+    file_kb : int, optional
+        Size of each rawdata image (KB)
+    sess : str, optional
+        BIDS session identifier
+    cli_args : list, optional
+        Additional mriqc_subj options, e.g. ["--push-mode", "tar"]
+    timeout : float, optional
+        Seconds to wait for jobs of each run
+
+    Returns
+    -------
+    dict
+        {mode: {num_subj: results}}
+
+    Raises
+    ------
+    FileNotFoundError
+        Stand-ins of the source checkout are missing
+    ValueError
+        Unexpected mode
+
+    Example
+    -------
+    bench_orchestration("/tmp/bench_orch", num_subj=(10,), modes=("array",))
+
+    """
+    stand_ins = _load_stand_ins()
+    out_dict = {}
+    for mode in modes:
+        if mode not in ORCH_MODES:
+            raise ValueError(f"Unexpected mode : {mode}")
+        for num in num_subj:
+            run_dir = os.path.join(os.path.abspath(out_dir), f"{mode}_{num}")
+            if os.path.exists(run_dir):
+                shutil.rmtree(run_dir)
+            fake_dir = os.path.join(run_dir, "fake")
+            state_dir = os.path.join(fake_dir, "state")
+            bin_dir = stand_ins.write_fake_slurm(
+                fake_dir, latency=queue_latency, max_running=concurrency
+            )
+            _ = stand_ins.write_fake_remote(
+                fake_dir,
+                connect_latency=connect_latency,
+                file_latency=file_latency,
+            )
+            _ = stand_ins.write_fake_containers(
+                fake_dir, mriqc_seconds=mriqc_seconds
+            )
+
+            # Setup Keoki rawdata, DCC project, and work locations
+            subj_list = [f"sub-ER{x:04d}" for x in range(1, num + 1)]
+            keoki_proj = os.path.join(run_dir, "keoki")
+            dcc_proj = os.path.join(run_dir, "dcc")
+            work_root = os.path.join(run_dir, "work")
+            make_synth_bids(
+                os.path.join(keoki_proj, "rawdata"),
+                subj_list,
+                sess=sess,
+                num_runs=num_runs,
+                file_kb=file_kb,
+            )
+            for h_dir in [work_root, os.path.join(run_dir, "research")]:
+                os.makedirs(h_dir)
+            sing_mriqc = os.path.join(run_dir, "mriqc.simg")
+            rsa_key = os.path.join(run_dir, "id_rsa")
+            for h_path in [sing_mriqc, rsa_key]:
+                open(h_path, "w").close()
+
+            # Run CLI with stand-ins first on PATH
+            pkg_parent = os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__))
+            )
+            env_dict = {
+                "PATH": f"{bin_dir}:{os.environ['PATH']}",
+                "PYTHONPATH": pkg_parent,
+                "USER": os.environ.get("USER", "bench"),
+                "FMQ_DCC_PROJ": dcc_proj,
+                "FMQ_KEOKI_PROJ": keoki_proj,
+                "FMQ_WORK_ROOT": work_root,
+                "SING_MRIQC": sing_mriqc,
+                "RSA_LS2": rsa_key,
+            }
+            mode_args = [
+                x.replace("{limit}", str(concurrency))
+                for x in ORCH_MODES[mode]
+            ]
+            cli_cmd = (
+                "env "
+                + " ".join(
+                    f"{k}={shlex.quote(v)}" for k, v in env_dict.items()
+                )
+                + f" {sys.executable} -c {shlex.quote(_CLI_DRIVER)} "
+                + " ".join(
+                    shlex.quote(x)
+                    for x in ["-s"]
+                    + subj_list
+                    + ["-e", sess, "--proj-dir", dcc_proj]
+                    + ["--proj-research", os.path.join(run_dir, "research")]
+                    + mode_args
+                    + (cli_args or [])
+                )
+            )
+            print(f"\tRunning {mode} for {num} subjects")
+            start = time.time()
+            res = runner.run_cmd(
+                cli_cmd,
+                log_path=os.path.join(run_dir, "mriqc_subj.log"),
+                stage="bench_cli",
+            )
+            res.check()
+            job_list = stand_ins.wait_idle(state_dir, timeout=timeout)
+            end = max([x.get("End", start) for x in job_list] + [time.time()])
+
+            # Gather results
+            user_name = env_dict["USER"]
+            log_dir = glob.glob(
+                os.path.join(work_root, user_name, "EmoRep/logs/mriqc_*")
+            )[0]
+            stage_s = _stage_seconds(log_dir)
+            work_s = sum(y for x, y in stage_s.items() if x != "workflow")
+            done = glob.glob(
+                os.path.join(
+                    keoki_proj, "derivatives/mriqc", f"*_{sess}_T1w.html"
+                )
+            )
+            out_dict.setdefault(mode, {})[num] = {
+                "cli_s": res.seconds,
+                "makespan_s": end - start,
+                "orch_per_subj_s": (work_s - num * mriqc_seconds) / num,
+                "jobs": len(job_list),
+                "jobs_failed": sum(
+                    x["State"] != "COMPLETED" for x in job_list
+                ),
+                "subj_done": len(done),
+                "cli_max_rss_kb": res.max_rss_kb,
+                "job_max_rss_kb": max(
+                    [x.get("MaxRSS", 0) for x in job_list] + [0]
+                ),
+                **_read_calls(state_dir),
+            }
+
+    # Report
+    print(
+        f"\t{'mode':9s} {'subj':>5s} {'cli_s':>8s} {'span_s':>8s} "
+        + f"{'orch/subj':>9s} {'jobs':>5s} {'done':>5s} {'sbatch':>6s} "
+        + f"{'ssh':>5s} {'conn':>5s} {'files':>7s} {'rss_mb':>7s}"
+    )
+    for mode, num_dict in out_dict.items():
+        for num, info in num_dict.items():
+            print(
+                f"\t{mode:9s} {num:5d} {info['cli_s']:8.1f} "
+                + f"{info['makespan_s']:8.1f} "
+                + f"{info['orch_per_subj_s']:9.2f} {info['jobs']:5d} "
+                + f"{info['subj_done']:5d} "
+                + f"{info.get('sbatch_calls', 0):6d} "
+                + f"{info.get('ssh_calls', 0):5d} {info['connects']:5d} "
+                + f"{info['files']:7d} "
+                + f"{info['job_max_rss_kb'] / 1024:7.1f}"
+            )
+    return out_dict
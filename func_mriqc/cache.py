@@ -0,0 +1,383 @@
+"""Node-local caches of MRIQC resources.
+
+cache_image : copy MRIQC singularity image to node-local storage
+mriqc_version : identify MRIQC version of singularity image
+work_cache : lease persistent MRIQC work directory, evicting LRU entries
+cache_lock : hold exclusive lock of cache directory
+load_index : return JSON index of cache directory
+write_index : atomically write JSON index of cache directory
+
+"""
+
+import os
+import json
+import fcntl
+import hashlib
+import time
+import shutil
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from typing import Union
+
+# Default location and size budget (GB) of node-local image cache
+IMAGE_CACHE_DIR = os.path.join(
+    "/tmp", f"func_mriqc_{os.environ.get('USER', 'user')}"
+)
+IMAGE_CACHE_GB = 30
+
+# Default size budget (GB) of persistent MRIQC work directories
+WORK_CACHE_GB = 200
+
+
+@contextmanager
+def cache_lock(cache_dir: Union[str, os.PathLike]):
+    """Hold exclusive lock of cache directory.
+
+    Serializes updates of a directory across processes and nodes via
+    flock of <cache_dir>/.lock, also used by group, iqm_store, and
+    online_stats.
+
+    Example
+    -------
+    with cache_lock(idx_dir):
+        index = load_index(idx_dir)
+        index["key"] = "value"
+        write_index(idx_dir, index)
+
+    """
+    with open(os.path.join(cache_dir, ".lock"), "w") as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def load_index(cache_dir: Union[str, os.PathLike]) -> dict:
+    """Return index.json of cache directory, empty when missing."""
+    idx_path = os.path.join(cache_dir, "index.json")
+    if not os.path.exists(idx_path):
+        return {}
+    try:
+        with open(idx_path) as jf:
+            return json.load(jf)
+    except ValueError:
+        return {}
+
+
+def write_index(cache_dir: Union[str, os.PathLike], index: dict):
+    """Atomically write index.json of cache directory."""
+    idx_path = os.path.join(cache_dir, "index.json")
+    with open(idx_path + ".tmp", "w") as jf:
+        json.dump(index, jf)
+    os.replace(idx_path + ".tmp", idx_path)
+
+
+def _copy_hash(
+    src: Union[str, os.PathLike],
+    cache_dir: Union[str, os.PathLike],
+    chunk_mb: int = 16,
+) -> str:
+    """Copy image into cache while hashing, return content hash.
+
+    The source is read a single time, the copy is only renamed to
+    <sha256>.sif once complete.
+
+    """
+    h_sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".part")
+    try:
+        with open(src, "rb") as sf, os.fdopen(fd, "wb") as df:
+            while True:
+                chunk = sf.read(chunk_mb * 1024**2)
+                if not chunk:
+                    break
+                h_sha.update(chunk)
+                df.write(chunk)
+        digest = h_sha.hexdigest()
+        os.replace(tmp_path, os.path.join(cache_dir, f"{digest}.sif"))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest
+
+
+def _evict(
+    cache_dir: Union[str, os.PathLike], max_bytes: int, keep: str = None
+) -> int:
+    """Remove least recently used images until within max_bytes.
+
+    Returns number of bytes removed.
+
+    """
+    img_list = []
+    for h_name in os.listdir(cache_dir):
+        h_path = os.path.join(cache_dir, h_name)
+        if h_name.endswith(".sif"):
+            h_stat = os.stat(h_path)
+            img_list.append((h_stat.st_mtime, h_stat.st_size, h_path))
+    img_list.sort()
+
+    total = sum(x[1] for x in img_list)
+    removed = 0
+    for _, h_size, h_path in img_list:
+        if total <= max_bytes:
+            break
+        if h_path == keep:
+            continue
+        os.remove(h_path)
+        total -= h_size
+        removed += h_size
+    return removed
+
+
+def cache_image(
+    sing_mriqc: Union[str, os.PathLike],
+    cache_dir: Union[str, os.PathLike] = None,
+    max_gb: float = IMAGE_CACHE_GB,
+) -> str:
+    """Copy MRIQC singularity image to node-local storage.
+
+    Cached images are stored by content hash, so renamed or re-copied
+    images share one cached copy. Source images are recognized via
+    their path, size, and modification time, avoiding a re-read of
+    the shared image once cached. Concurrent jobs on a node hold a
+    file lock of the cache, so only one job copies the image while
+    the others wait and reuse the copy. Least recently used images
+    are removed once the cache exceeds max_gb.
+
+    Parameters
+    ----------
+    sing_mriqc : str, os.PathLike
+        Location of MRIQC singularity image
+    cache_dir : str, os.PathLike, optional
+        Location of node-local cache, defaults to IMAGE_CACHE_DIR
+    max_gb : float, optional
+        Size budget of cache (GB)
+
+    Returns
+    -------
+    str
+        Location of cached image, or sing_mriqc when the image
+        cannot be cached
+
+    Example
+    -------
+    sing_mriqc = cache_image(os.environ["SING_MRIQC"])
+
+    """
+    cache_dir = cache_dir or IMAGE_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    max_bytes = int(max_gb * 1024**3)
+    src_stat = os.stat(sing_mriqc)
+    if src_stat.st_size > max_bytes:
+        print(f"\tImage larger than cache budget, using {sing_mriqc}")
+        return str(sing_mriqc)
+
+    src_key = (
+        f"{os.path.abspath(sing_mriqc)}|{src_stat.st_size}|"
+        + f"{src_stat.st_mtime_ns}"
+    )
+    with cache_lock(cache_dir):
+        index = load_index(cache_dir)
+        digest = index.get(src_key)
+        if not digest or not os.path.exists(
+            os.path.join(cache_dir, f"{digest}.sif")
+        ):
+            # Make room then copy, fall back to shared image
+            _ = _evict(cache_dir, max_bytes - src_stat.st_size)
+            try:
+                print(f"\tCaching {sing_mriqc} in {cache_dir}")
+                digest = _copy_hash(sing_mriqc, cache_dir)
+            except OSError as e:
+                print(f"\tFailed to cache image, using {sing_mriqc} : {e}")
+                return str(sing_mriqc)
+
+        # Mark as recently used, drop index entries of evicted images
+        cache_path = os.path.join(cache_dir, f"{digest}.sif")
+        os.utime(cache_path)
+        _ = _evict(cache_dir, max_bytes, keep=cache_path)
+        index[src_key] = digest
+        index = {
+            k: v
+            for k, v in index.items()
+            if os.path.exists(os.path.join(cache_dir, f"{v}.sif"))
+        }
+        write_index(cache_dir, index)
+    return cache_path
+
+
+def mriqc_version(sing_mriqc: Union[str, os.PathLike]) -> str:
+    """Identify MRIQC version of singularity image.
+
+    The version is read from the image labels, falling back to
+    a fingerprint of the image path, size, and modification time
+    when labels are unavailable.
+
+    """
+    h_sp = subprocess.run(
+        f"singularity inspect --labels {sing_mriqc}",
+        shell=True,
+        capture_output=True,
+    )
+    for line in h_sp.stdout.decode("utf-8").splitlines():
+        key, _, value = line.partition(":")
+        if key.strip() == "org.label-schema.version" and value.strip():
+            return f"mriqc-{value.strip()}"
+    src_stat = os.stat(sing_mriqc)
+    src_key = (
+        f"{os.path.abspath(sing_mriqc)}|{src_stat.st_size}|"
+        + f"{src_stat.st_mtime_ns}"
+    )
+    return f"img-{hashlib.sha1(src_key.encode()).hexdigest()[:12]}"
+
+
+def _try_lease(entry_path: str):
+    """Return open lease file of unused work cache entry, else None.
+
+    The exclusive lock is held until the file is closed, and is only
+    granted when no job holds a lease (see work_cache).
+
+    """
+    lf = open(os.path.join(entry_path, ".in_use"), "a")
+    try:
+        fcntl.flock(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lf.close()
+        return None
+    return lf
+
+
+@contextmanager
+def work_cache(
+    work_mriqc: Union[str, os.PathLike],
+    sing_mriqc: Union[str, os.PathLike],
+    subj: str,
+    sess: str,
+    max_gb: float = WORK_CACHE_GB,
+):
+    """Lease persistent MRIQC work directory, evicting LRU entries.
+
+    MRIQC work directories are kept in
+    <work_mriqc>/work_cache/<version>/<subj>/<sess>, so reruns after
+    a crash or with changed parameters reuse the cached nipype nodes.
+    The entry is leased via a shared lock of <entry>/.in_use while
+    the context is held, i.e. for the whole MRIQC run. Before
+    yielding, least recently used entries of other subjects,
+    sessions, or MRIQC versions are removed until the cache is within
+    max_gb, skipping leased entries. Entry sizes are stored in an
+    index and only re-measured once the entry has been used since its
+    last measurement and is no longer leased. The entry is marked as
+    used again when the lease is released.
+
+    Parameters
+    ----------
+    work_mriqc : str, os.PathLike
+        Location of work derivatives/mriqc
+    sing_mriqc : str, os.PathLike
+        Location of MRIQC singularity image
+    subj : str
+        BIDS subject identifier
+    sess : str
+        BIDS session identifier
+    max_gb : float, optional
+        Size budget of cache (GB)
+
+    Yields
+    ------
+    str
+        Location of MRIQC work directory
+
+    Example
+    -------
+    with work_cache(
+        "/work/user/EmoRep/mriqc", sing_mriqc, "sub-ER0009", "ses-day2"
+    ) as work_mriqc_tmp:
+        mriqc_run(..., work_mriqc_tmp, ...)
+
+    """
+    cache_dir = os.path.join(work_mriqc, "work_cache")
+    entry = os.path.join(mriqc_version(sing_mriqc), subj, sess)
+    entry_path = os.path.join(cache_dir, entry)
+    os.makedirs(cache_dir, exist_ok=True)
+    with cache_lock(cache_dir):
+        # Lease entry before releasing the cache lock
+        os.makedirs(entry_path, exist_ok=True)
+        lease = open(os.path.join(entry_path, ".in_use"), "a")
+        fcntl.flock(lease, fcntl.LOCK_SH)
+        try:
+            _evict_work(cache_dir, entry, max_gb)
+        except BaseException:
+            lease.close()
+            raise
+
+    try:
+        yield entry_path
+    finally:
+        # Mark as used once finished, so the entry is measured by the
+        # next job and ranks by when it was last written.
+        with cache_lock(cache_dir):
+            index = load_index(cache_dir)
+            if entry in index:
+                index[entry]["used"] = time.time()
+                write_index(cache_dir, index)
+        lease.close()
+
+
+def _evict_work(cache_dir: Union[str, os.PathLike], entry: str, max_gb: float):
+    """Mark entry as used, then remove unleased LRU entries.
+
+    Entries are removed until the cache is within max_gb, requires the
+    lock of cache_dir.
+
+    """
+    # Avoid circular import, process uses cache
+    from func_mriqc.process import dir_size
+
+    index = load_index(cache_dir)
+
+    # Mark entry as used
+    index.setdefault(entry, {"size": 0, "measured": 0.0})
+    index[entry]["used"] = time.time()
+
+    # Update sizes of unleased entries used since last measured,
+    # leased entries are still being written.
+    for h_entry in list(index):
+        h_path = os.path.join(cache_dir, h_entry)
+        if not os.path.exists(h_path):
+            del index[h_entry]
+            continue
+        if h_entry == entry:
+            continue
+        if index[h_entry]["used"] < index[h_entry]["measured"]:
+            continue
+        h_lease = _try_lease(h_path)
+        if h_lease is None:
+            continue
+        with h_lease:
+            index[h_entry]["size"] = dir_size(h_path)
+            index[h_entry]["measured"] = time.time()
+
+    # Remove least recently used entries which are not leased
+    total = sum(x["size"] for x in index.values())
+    max_bytes = int(max_gb * 1024**3)
+    for h_entry in sorted(index, key=lambda x: index[x]["used"]):
+        if total <= max_bytes:
+            break
+        if h_entry == entry:
+            continue
+        h_path = os.path.join(cache_dir, h_entry)
+        h_lease = _try_lease(h_path)
+        if h_lease is None:
+            continue
+        with h_lease:
+            print(f"\tEvicting MRIQC work cache : {h_entry}")
+            shutil.rmtree(h_path)
+        try:
+            os.removedirs(os.path.dirname(h_path))
+        except OSError:
+            pass
+        total -= index.pop(h_entry)["size"]
+    write_index(cache_dir, index)
@@ -0,0 +1,174 @@
+"""Stage checkpoints of the subject MRIQC workflow.
+
+tree_fingerprint : fingerprint files matching a glob pattern
+Checkpoint : record and verify completed workflow stages
+
+"""
+
+import os
+import glob
+import json
+import time
+import hashlib
+from typing import Union
+
+# Ordered stages of workflows.wf_mriqc_subj
+STAGES = ["pulled", "mriqc_done", "copied", "pushed", "cleaned"]
+
+
+def tree_fingerprint(path_glob: Union[str, os.PathLike]) -> Union[str, None]:
+    """Fingerprint files matching a glob pattern.
+
+    The fingerprint is a hash of the relative path, size, and
+    modification time of all files within matching files and
+    directories, so contents are not read.
+
+    Parameters
+    ----------
+    path_glob : str, os.PathLike
+        Glob pattern of files or directories
+
+    Returns
+    -------
+    str, None
+        SHA-1 hex digest, None when nothing matches
+
+    """
+    match_list = sorted(glob.glob(str(path_glob)))
+    if not match_list:
+        return None
+    h_sha = hashlib.sha1()
+    for match in match_list:
+        root_dir = os.path.dirname(match)
+        walk_list = (
+            os.walk(match)
+            if os.path.isdir(match)
+            else [(root_dir, [], [match])]
+        )
+        for root, dirs, files in walk_list:
+            dirs.sort()
+            for file_name in sorted(files):
+                file_path = os.path.join(root, file_name)
+                try:
+                    f_stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                h_sha.update(
+                    f"{os.path.relpath(file_path, root_dir)}|"
+                    f"{f_stat.st_size}|{f_stat.st_mtime_ns}\n".encode()
+                )
+    return h_sha.hexdigest()
+
+
+class Checkpoint:
+    """Record and verify completed stages of the subject workflow.
+
+    Each completed stage writes a marker file holding fingerprints of
+    its inputs or outputs to <work_mriqc>/checkpoints/<subj>_<sess>.
+    A stage is verified when its marker exists and the recorded
+    fingerprints match the current ones. Marking a stage removes the
+    markers of all later stages, as their inputs may have changed.
+
+    Parameters
+    ----------
+    work_mriqc : str, os.PathLike
+        Location of work derivatives/mriqc
+    subj : str
+        BIDS subject identifier
+    sess : str
+        BIDS session identifier
+
+    Methods
+    -------
+    clear()
+        Remove markers of all stages
+    mark(stage, **fingerprint)
+        Record completion of stage
+    verified(stage, **fingerprint)
+        Check whether stage completed with matching fingerprints
+
+    Example
+    -------
+    ckpt = Checkpoint("/work/user/EmoRep/mriqc", "sub-ER0009", "ses-day2")
+    raw_fp = tree_fingerprint(f"{proj_raw}/sub-ER0009/ses-day2")
+    if not ckpt.verified("pulled", raw=raw_fp):
+        ...
+        ckpt.mark("pulled", raw=tree_fingerprint(...))
+
+    """
+
+    def __init__(
+        self, work_mriqc: Union[str, os.PathLike], subj: str, sess: str
+    ):
+        """Initialize."""
+        self._ckpt_dir = os.path.join(
+            work_mriqc, "checkpoints", f"{subj}_{sess}"
+        )
+        if not os.path.exists(self._ckpt_dir):
+            os.makedirs(self._ckpt_dir)
+
+    def _marker(self, stage: str) -> str:
+        """Return location of stage marker."""
+        if stage not in STAGES:
+            raise ValueError(f"Unexpected stage : {stage}")
+        return os.path.join(self._ckpt_dir, f"{stage}.json")
+
+    def clear(self):
+        """Remove markers of all stages, the next run starts over."""
+        for stage in STAGES:
+            if os.path.exists(self._marker(stage)):
+                os.remove(self._marker(stage))
+
+    def mark(self, stage: str, **fingerprint):
+        """Record completion of stage, invalidating later stages.
+
+        Parameters
+        ----------
+        stage : str
+            {"pulled", "mriqc_done", "copied", "pushed", "cleaned"}
+        **fingerprint
+            Fingerprints of stage inputs or outputs
+
+        """
+        later_list = [
+            x for x in STAGES if STAGES.index(x) > STAGES.index(stage)
+        ]
+        for later in later_list:
+            if os.path.exists(self._marker(later)):
+                os.remove(self._marker(later))
+
+        # Write durably, marker is only visible once complete
+        marker = self._marker(stage)
+        with open(marker + ".tmp", "w") as mf:
+            json.dump({"stage": stage, "time": time.time(), **fingerprint}, mf)
+            mf.flush()
+            os.fsync(mf.fileno())
+        os.replace(marker + ".tmp", marker)
+
+    def verified(self, stage: str, **fingerprint) -> bool:
+        """Check whether stage completed with matching fingerprints.
+
+        Parameters
+        ----------
+        stage : str
+            {"pulled", "mriqc_done", "copied", "pushed", "cleaned"}
+        **fingerprint
+            Current fingerprints, compared to those recorded
+
+        Returns
+        -------
+        bool
+
+        """
+        marker = self._marker(stage)
+        if not os.path.exists(marker):
+            return False
+        try:
+            with open(marker) as mf:
+                rec = json.load(mf)
+        except ValueError:
+            return False
+        return all(
+            value is not None and rec.get(key) == value
+            for key, value in fingerprint.items()
+        )
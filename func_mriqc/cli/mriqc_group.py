@@ -7,6 +7,13 @@ Notes
 -----
 - Written to be executed on the local VM labarserv2
 - Requires the docker container nipreps/mriqc
+- Use --native to update group_T1w.tsv and group_bold.tsv in-package,
+    only parsing new or changed subject IQM files. Does not require
+    docker or labarserv2, and does not write HTML reports
+- Use --parallel to run MRIQC group concurrently for each modality
+- Use --backend singularity to run MRIQC group via the singularity
+    image of SING_MRIQC (or --sing-mriqc), e.g. on DCC, rather
+    than docker on labarserv2
 
 Example
 -------
@@ -16,11 +23,12 @@ mriqc_group \
 """
 
 # %%
+import os
 import sys
 import textwrap
 import platform
 from argparse import ArgumentParser, RawTextHelpFormatter
-from func_mriqc import workflows
+from func_mriqc import workflows, process
 
 
 def _get_args():
@@ -28,6 +36,33 @@ def _get_args():
     parser = ArgumentParser(
         description=__doc__, formatter_class=RawTextHelpFormatter
     )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=process.GROUP_BACKENDS,
+        default="docker",
+        help=textwrap.dedent(
+            """\
+            Container runtime of MRIQC group
+            (default : %(default)s)
+            """
+        ),
+    )
+    parser.add_argument(
+        "--native",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Incrementally update group IQM tables in-package rather
+            than running MRIQC group via docker
+            """
+        ),
+    )
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="Run MRIQC group concurrently for each modality",
+    )
     parser.add_argument(
         "--proj-raw",
         type=str,
@@ -39,6 +74,17 @@ def _get_args():
             """
         ),
     )
+    parser.add_argument(
+        "--sing-mriqc",
+        type=str,
+        default=os.environ.get("SING_MRIQC"),
+        help=textwrap.dedent(
+            """\
+            Path to MRIQC singularity image, used with
+            --backend singularity (default : $SING_MRIQC)
+            """
+        ),
+    )
 
     required_args = parser.add_argument_group("Required Arguments")
     required_args.add_argument(
@@ -59,18 +105,29 @@ def _get_args():
 # %%
 def main():
     """Setup, run group MRIQC."""
-    # Check env
-    if "labarserv2" not in platform.uname().node:
-        print("mriqc_group is required to run on labarserv2.")
-        sys.exit(1)
-
     # Capture CLI arguments
     args = _get_args().parse_args()
     proj_raw = args.proj_raw
     proj_mriqc = args.deriv_dir
 
+    # Check env, docker is only available on labarserv2
+    use_docker = not args.native and args.backend == "docker"
+    if use_docker and "labarserv2" not in platform.uname().node:
+        print("mriqc_group is required to run on labarserv2.")
+        sys.exit(1)
+    if args.backend == "singularity" and not args.sing_mriqc:
+        print("--backend singularity requires --sing-mriqc or SING_MRIQC.")
+        sys.exit(1)
+
     # Run
-    workflows.wf_mriqc_group(proj_raw, proj_mriqc)
+    workflows.wf_mriqc_group(
+        proj_raw,
+        proj_mriqc,
+        native=args.native,
+        backend=args.backend,
+        parallel=args.parallel,
+        sing_mriqc=args.sing_mriqc,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,245 @@
+r"""Query IQMs of an MRIQC cohort.
+
+Filter runs of a modality by subject, session, task, run, and IQM
+values, optionally adding cohort z-scores and IQR outlier flags.
+Results are written as TSV to stdout or --out-tsv.
+
+Notes
+-----
+- Queries read the columnar IQM store in
+    <deriv-dir>/.iqm_store, which is built on first use
+- Use --update to add new or changed subject IQM files to the
+    store, only those files are parsed
+- Z-scores and outlier flags are relative to all runs of the
+    modality, not only the selected runs
+- Use --running to print the running group statistics folded in
+    by mriqc_subj as each subject finishes, without the store
+
+Example
+-------
+mriqc_iqms \
+    -d /mnt/keoki/experiments2/EmoRep/.../derivatives/mriqc \
+    -m bold \
+    --sess ses-day3 \
+    --where "fd_mean>0.3" \
+    --columns fd_mean tsnr \
+    --zscore \
+    --outliers
+
+mriqc_iqms -d /path/to/derivatives/mriqc --update
+
+"""
+
+# %%
+import os
+import sys
+import textwrap
+from argparse import ArgumentParser, RawTextHelpFormatter
+import numpy as np
+from func_mriqc import group
+from func_mriqc import iqm_store
+from func_mriqc import online_stats
+
+
+def _get_args():
+    """Get and parse arguments."""
+    parser = ArgumentParser(
+        description=__doc__, formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--columns",
+        nargs="+",
+        type=str,
+        default=None,
+        help="IQMs to report, defaults to all",
+    )
+    parser.add_argument(
+        "--iqr-k",
+        type=float,
+        default=1.5,
+        help=textwrap.dedent(
+            """\
+            IQR multiplier of outlier flags
+            (default : %(default)s)
+            """
+        ),
+    )
+    parser.add_argument(
+        "-m",
+        "--modality",
+        type=str,
+        choices=list(group.MODALITIES),
+        default=None,
+        help="Modality to query, e.g. bold",
+    )
+    parser.add_argument(
+        "--out-tsv",
+        type=str,
+        default=None,
+        help="Path to TSV file for writing results, instead of stdout",
+    )
+    parser.add_argument(
+        "--outliers",
+        action="store_true",
+        help="Add <IQM>_outlier columns flagging cohort IQR outliers",
+    )
+    parser.add_argument(
+        "--run",
+        nargs="+",
+        type=int,
+        default=None,
+        help="Run numbers, e.g. 1 2",
+    )
+    parser.add_argument(
+        "--running",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Print running group statistics (count, mean, standard
+            deviation, approximate quartiles) of each IQM
+            """
+        ),
+    )
+    parser.add_argument(
+        "--sess",
+        nargs="+",
+        type=str,
+        default=None,
+        help="BIDS session IDs, e.g. ses-day3",
+    )
+    parser.add_argument(
+        "--subj",
+        nargs="+",
+        type=str,
+        default=None,
+        help="BIDS subject IDs, e.g. sub-ER0009",
+    )
+    parser.add_argument(
+        "--task",
+        nargs="+",
+        type=str,
+        default=None,
+        help="BIDS task names, e.g. task-movies",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Update IQM store from subject IQM files before querying",
+    )
+    parser.add_argument(
+        "--where",
+        nargs="+",
+        type=str,
+        default=None,
+        help=textwrap.dedent(
+            """\
+            IQM filters as <IQM><op><value>, op in >, >=, <, <=, ==, !=,
+            e.g. "fd_mean>0.3" "tsnr<40"
+            """
+        ),
+    )
+    parser.add_argument(
+        "--zscore",
+        action="store_true",
+        help="Add <IQM>_z columns of cohort z-scores",
+    )
+
+    required_args = parser.add_argument_group("Required Arguments")
+    required_args.add_argument(
+        "-d",
+        "--deriv-dir",
+        type=str,
+        help="Path to MRIQC derivatives directory",
+        required=True,
+    )
+
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        sys.exit(0)
+
+    return parser
+
+
+def _format(value) -> str:
+    """Return TSV field of value, empty for missing IQMs."""
+    if isinstance(value, np.bool_):
+        return str(int(value))
+    if isinstance(value, np.floating):
+        return "" if np.isnan(value) else f"{value:.6g}"
+    return str(value)
+
+
+def _write_results(res: dict, h_out):
+    """Write query results as TSV."""
+    h_out.write("\t".join(res) + "\n")
+    for row in zip(*res.values()):
+        h_out.write("\t".join(_format(x) for x in row) + "\n")
+
+
+def _print_running(proj_mriqc: str, modality: str = None):
+    """Print running group statistics of modality, or all."""
+    summ = online_stats.load(proj_mriqc).summary()
+    for mod, iqm_summ in summ.items():
+        if modality and mod != modality:
+            continue
+        print(
+            f"{mod}\n  {'iqm':20s} {'n':>6s} {'mean':>10s} {'std':>10s} "
+            + f"{'p25':>10s} {'p50':>10s} {'p75':>10s}"
+        )
+        for name, info in iqm_summ.items():
+            print(
+                f"  {name:20s} {info['n']:6d} "
+                + " ".join(
+                    f"{info[x]:10.4g}"
+                    for x in ["mean", "std", "p25", "p50", "p75"]
+                )
+            )
+
+
+# %%
+def main():
+    """Update and query IQM store."""
+    args = _get_args().parse_args()
+    proj_mriqc = args.deriv_dir
+    if not os.path.isdir(proj_mriqc):
+        print(f"Missing derivatives directory : {proj_mriqc}")
+        sys.exit(1)
+
+    if args.running:
+        _print_running(proj_mriqc, args.modality)
+        return
+
+    store = iqm_store.IqmStore(proj_mriqc)
+    if args.update or not store.modalities():
+        store.update()
+    if not args.modality:
+        for modality in store.modalities():
+            num_rows = len(store.column(modality, "bids_name"))
+            print(f"{modality} : {num_rows} runs")
+        return
+
+    try:
+        res = store.query(
+            args.modality,
+            columns=args.columns,
+            subject=args.subj,
+            session=args.sess,
+            task=args.task,
+            run=args.run,
+            where=args.where,
+            zscore=args.zscore,
+            outliers=args.outliers,
+            k=args.iqr_k,
+        )
+    except (KeyError, ValueError) as err:
+        print(err.args[0] if err.args else err)
+        sys.exit(1)
+    if args.out_tsv:
+        with open(args.out_tsv, "w") as tf:
+            _write_results(res, tf)
+    else:
+        _write_results(res, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+r"""Summarize an MRIQC run.
+
+Read the log directory of a mriqc_subj run and report subjects
+per hour, per-stage latency percentiles, queue wait vs run time,
+core-hours used vs requested, and the slowest subjects.
+
+Notes
+-----
+- Stage timing is read from <log-dir>/telemetry.jsonl
+- Job accounting is queried via sacct, when available
+- Logs are streamed, so large cohorts are summarized in
+    constant memory
+
+Example
+-------
+mriqc_report -l /work/user/EmoRep/logs/mriqc_2305101230
+
+mriqc_report \
+    -l /work/user/EmoRep/logs/mriqc_2305101230 \
+    --top 20 \
+    --json-out /work/user/EmoRep/logs/mriqc_2305101230/report.json
+
+"""
+
+# %%
+import os
+import sys
+import json
+import textwrap
+from argparse import ArgumentParser, RawTextHelpFormatter
+from func_mriqc import report
+
+
+def _get_args():
+    """Get and parse arguments."""
+    parser = ArgumentParser(
+        description=__doc__, formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--json-out",
+        type=str,
+        default=None,
+        help="Path to JSON file for writing summary",
+    )
+    parser.add_argument(
+        "--no-sacct",
+        action="store_true",
+        help="Skip querying SLURM accounting",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help=textwrap.dedent(
+            """\
+            Number of slowest subjects to report
+            (default : %(default)s)
+            """
+        ),
+    )
+
+    required_args = parser.add_argument_group("Required Arguments")
+    required_args.add_argument(
+        "-l",
+        "--log-dir",
+        type=str,
+        help="Path to log directory of run, e.g. logs/mriqc_<timestamp>",
+        required=True,
+    )
+
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        sys.exit(0)
+
+    return parser
+
+
+# %%
+def main():
+    """Summarize run logs."""
+    args = _get_args().parse_args()
+    log_dir = args.log_dir
+    if not os.path.isdir(log_dir):
+        print(f"Missing log directory : {log_dir}")
+        sys.exit(1)
+
+    summ = report.summarize(
+        log_dir, use_sacct=not args.no_sacct, num_slow=args.top
+    )
+    print(report.format_summary(summ))
+    if args.json_out:
+        with open(args.json_out, "w") as jf:
+            json.dump(summ, jf, indent=2)
+
+
+if __name__ == "__main__":
+    main()
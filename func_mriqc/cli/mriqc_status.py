@@ -0,0 +1,156 @@
+r"""Report workflow states of mriqc_subj runs.
+
+Read the run ledger, which mriqc_subj and its workflows update as
+each subject and session is submitted, runs, and moves through the
+pull, mriqc, copy, push, and clean stages. Print the number of
+subjects in each state, or list subjects matching filters.
+
+Notes
+-----
+- The ledger is <work>/$USER/EmoRep/mriqc/ledger.sqlite by default
+- Filters combine, e.g. failed subjects of ses-day2
+- Use --history to print every state transition of the subjects
+
+Example
+-------
+mriqc_status
+
+mriqc_status -e ses-day2 --state failed running
+
+mriqc_status -e ses-day2 -s sub-ER0009 --history
+
+"""
+
+# %%
+import os
+import sys
+import time
+import textwrap
+from argparse import ArgumentParser, RawTextHelpFormatter
+from func_mriqc import ledger
+from func_mriqc.cli.mriqc_subj import WORK_ROOT
+
+
+def _get_args():
+    """Get and parse arguments."""
+    parser = ArgumentParser(
+        description=__doc__, formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "-e",
+        "--sess",
+        type=str,
+        default=None,
+        help="BIDS session ID, e.g. ses-day2",
+    )
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="Print state transitions of matching subjects",
+    )
+    parser.add_argument(
+        "--ledger",
+        type=str,
+        default=None,
+        help=textwrap.dedent(
+            """\
+            Path to run ledger, defaults to
+            <work>/$USER/EmoRep/mriqc/ledger.sqlite
+            """
+        ),
+    )
+    parser.add_argument(
+        "-s",
+        "--sub-list",
+        nargs="+",
+        type=str,
+        default=None,
+        help="BIDS subject IDs, e.g. sub-ER0009",
+    )
+    parser.add_argument(
+        "--state",
+        nargs="+",
+        type=str,
+        choices=ledger.STATES,
+        default=None,
+        help="Workflow states, e.g. failed",
+    )
+    return parser
+
+
+def _print_counts(run_ledger: ledger.Ledger, sess: str = None):
+    """Print number of subjects in each state, by session."""
+    counts = run_ledger.counts(sess)
+    if not counts:
+        print("No subjects in ledger")
+        return
+    for h_sess, state_counts in sorted(counts.items()):
+        print(f"{h_sess} : {sum(state_counts.values())} subjects")
+        for state in ledger.STATES:
+            if state in state_counts:
+                print(f"  {state:12s} {state_counts[state]:6d}")
+
+
+def _print_rows(rows: list):
+    """Print current state of subjects."""
+    if not rows:
+        print("No matching subjects")
+        return
+    print(
+        f"{'subj':12s} {'sess':10s} {'state':12s} {'job_id':14s} "
+        + f"{'updated':19s} message"
+    )
+    for row in rows:
+        updated = time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(row["updated"])
+        )
+        print(
+            f"{row['subj']:12s} {row['sess']:10s} {row['state']:12s} "
+            + f"{row['job_id'] or '':14s} {updated:19s} "
+            + f"{row['message'] or ''}"
+        )
+
+
+def _print_history(run_ledger: ledger.Ledger, rows: list):
+    """Print state transitions of subjects."""
+    for row in rows:
+        print(f"{row['subj']} {row['sess']} : {row['log_dir'] or ''}")
+        for event in run_ledger.history(row["subj"], row["sess"]):
+            stamp = time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(event["time"])
+            )
+            print(
+                f"  {stamp} {event['state']:12s} {event['job_id'] or '':14s}"
+                + f" {event['host'] or '':12s} {event['message'] or ''}"
+            )
+
+
+# %%
+def main():
+    """Report states of run ledger."""
+    args = _get_args().parse_args()
+    db_path = args.ledger or os.path.join(
+        WORK_ROOT,
+        os.environ.get("USER", ""),
+        "EmoRep/mriqc",
+        ledger.LEDGER_FILE,
+    )
+    if not os.path.exists(db_path):
+        print(f"Missing run ledger : {db_path}")
+        sys.exit(1)
+    run_ledger = ledger.Ledger(db_path)
+
+    if not args.state and not args.sub_list and not args.history:
+        _print_counts(run_ledger, args.sess)
+        return
+    rows = run_ledger.status(
+        sess=args.sess, state=args.state, subj=args.sub_list
+    )
+    if args.history:
+        _print_history(run_ledger, rows)
+    else:
+        _print_rows(rows)
+
+
+if __name__ == "__main__":
+    main()
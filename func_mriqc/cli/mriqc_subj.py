@@ -7,6 +7,32 @@ from Keoki, MRIQC execution, output upload to Keoki, and clean up.
 Notes
 -----
 - Only supports single session at one time
+- Use --array to schedule all subjects as a single SLURM job array
+- Use --stage-dag to schedule the pull, MRIQC, clean, and push stages
+    as separate jobs chained via dependencies rather than a parent
+    job waiting on a child job, combine with --array to schedule
+    each stage as a job array
+- Use --pipeline to run all subjects from a single controller job,
+    which prefetches rawdata within --disk-budget while MRIQC runs
+- Use --skip-done to only schedule subjects missing MRIQC output
+    on Keoki, determined via a single listing of Keoki
+- Use --split-modality to run MRIQC as concurrent jobs for each
+    modality and BOLD run
+- Use --right-size to request MRIQC resources predicted from previous
+    jobs rather than the static default
+- Use --scratch to run MRIQC on node-local scratch, falling back
+    to /work when scratch space is insufficient
+- Use --image-cache to run MRIQC from a node-local copy of
+    the singularity image
+- Use --work-cache to keep MRIQC work directories between runs,
+    resuming interrupted or re-parameterized runs
+- Use --force to rerun subjects from the rawdata download, discarding
+    the stage checkpoints of previous runs
+- Use --batch-pull to download rawdata of all subjects in a single
+    job before subject workflows start
+- Use --group-job to schedule group MRIQC (via singularity, each
+    modality concurrently) once all subject jobs end, reports are
+    written to Keoki derivatives/mriqc
 - Written to be executed on the Duke Compute Cluster
 - Requires global variables:
     - SING_MRIQC - path to singularity image of MRIQC
@@ -18,6 +44,12 @@ mriqc_subj \
     -s sub-ER0009 sub-ER0010 \
     -e ses-day2
 
+mriqc_subj \
+    --array \
+    --array-limit 20 \
+    -s sub-ER0009 sub-ER0010 sub-ER0011 \
+    -e ses-day2
+
 """
 
 # %%
@@ -28,7 +60,11 @@ import textwrap
 import platform
 from datetime import datetime
 from argparse import ArgumentParser, RawTextHelpFormatter
-from func_mriqc import submit
+from func_mriqc import submit, process, checkpoint
+
+# Parent of user work directories, overridden via environment when
+# run offline against local stand-ins (see benchmark).
+WORK_ROOT = os.environ.get("FMQ_WORK_ROOT", "/work")
 
 
 def _get_args():
@@ -36,6 +72,148 @@ def _get_args():
     parser = ArgumentParser(
         description=__doc__, formatter_class=RawTextHelpFormatter
     )
+    parser.add_argument(
+        "--array",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Schedule all subjects as a single SLURM job array
+            rather than one parent job per subject
+            """
+        ),
+    )
+    parser.add_argument(
+        "--array-limit",
+        type=int,
+        default=10,
+        help=textwrap.dedent(
+            """\
+            Maximum number of simultaneously running array tasks,
+            used with --array
+            (default : %(default)s)
+            """
+        ),
+    )
+    parser.add_argument(
+        "--pull-streams",
+        type=int,
+        default=2,
+        help=textwrap.dedent(
+            """\
+            Number of parallel rsync streams, used with --batch-pull
+            (default : %(default)s)
+            """
+        ),
+    )
+    parser.add_argument(
+        "--pull-mode",
+        choices=["rsync", "tar", "tar.gz"],
+        default="rsync",
+        help=textwrap.dedent(
+            """\
+            Transfer method for downloading rawdata from Keoki,
+            tar streams avoid per-file overhead
+            (default : %(default)s)
+            """
+        ),
+    )
+    parser.add_argument(
+        "--push-mode",
+        choices=["rsync", "tar", "tar.gz"],
+        default="rsync",
+        help=textwrap.dedent(
+            """\
+            Transfer method for uploading MRIQC output to Keoki,
+            tar streams avoid per-file overhead
+            (default : %(default)s)
+            """
+        ),
+    )
+    parser.add_argument(
+        "--right-size",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Predict MRIQC job resources from usage of previous jobs,
+            escalating on memory or time failures. Not supported
+            with --stage-dag
+            """
+        ),
+    )
+    parser.add_argument(
+        "--scratch",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Stage rawdata and MRIQC work directories on node-local
+            scratch ($TMPDIR), copying only final output back to /work.
+            Not supported with --split-modality
+            """
+        ),
+    )
+    parser.add_argument(
+        "--skip-done",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Index rawdata and MRIQC output on Keoki before scheduling,
+            only schedule subjects missing MRIQC output
+            """
+        ),
+    )
+    parser.add_argument(
+        "--split-modality",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Run MRIQC separately and concurrently for each anatomical
+            modality and each BOLD run
+            """
+        ),
+    )
+    parser.add_argument(
+        "--stage-dag",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Schedule workflow stages as separate, dependency-chained
+            jobs rather than a parent job waiting on a child job
+            """
+        ),
+    )
+    parser.add_argument(
+        "--work-cache",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Keep MRIQC work directories in a size-budgeted cache keyed
+            by subject, session, and MRIQC version, so reruns reuse
+            completed processing steps. Not supported with --scratch
+            """
+        ),
+    )
+    parser.add_argument(
+        "--batch-pull",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Download rawdata of all subjects via a single job using
+            a files-from manifest, subject workflows wait for and
+            reuse the staged data
+            """
+        ),
+    )
+    parser.add_argument(
+        "--disk-budget",
+        type=float,
+        default=100,
+        help=textwrap.dedent(
+            """\
+            Maximum size (GB) of prefetched rawdata, used with --pipeline
+            (default : %(default)s)
+            """
+        ),
+    )
     parser.add_argument(
         "--fd-thresh",
         type=float,
@@ -47,6 +225,58 @@ def _get_args():
             """
         ),
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Clear stage checkpoints of previous runs, rerunning the
+            workflow of each subject from the rawdata download
+            """
+        ),
+    )
+    parser.add_argument(
+        "--group-job",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Schedule group MRIQC to run on DCC once all subject
+            jobs end, rather than via mriqc_group on labarserv2
+            """
+        ),
+    )
+    parser.add_argument(
+        "--image-cache",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Copy the MRIQC singularity image to node-local storage
+            once per node, shared by concurrent jobs on the node
+            """
+        ),
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            Run all subjects from a single controller job which
+            prefetches rawdata while MRIQC runs, and pushes and
+            cleans in the background
+            """
+        ),
+    )
+    parser.add_argument(
+        "--pipeline-workers",
+        type=int,
+        default=4,
+        help=textwrap.dedent(
+            """\
+            Number of simultaneous MRIQC jobs, used with --pipeline
+            (default : %(default)s)
+            """
+        ),
+    )
     parser.add_argument(
         "--proj-dir",
         type=str,
@@ -95,6 +325,15 @@ def _get_args():
     return parser
 
 
+def _schedule_group(args, sing_mriqc, work_deriv, log_dir, job_ids):
+    """Schedule group MRIQC after subject jobs, when requested."""
+    if not args.group_job:
+        return
+    _ = submit.schedule_group(
+        sing_mriqc, work_deriv, log_dir, args.sess, job_ids
+    )
+
+
 # %%
 def main():
     """Setup and coordinate resources."""
@@ -110,6 +349,41 @@ def main():
     proj_dir = args.proj_dir
     proj_research = args.proj_research
     fd_thresh = args.fd_thresh
+    for arg_name in [
+        "array_limit",
+        "pull_streams",
+        "pipeline_workers",
+        "disk_budget",
+    ]:
+        if getattr(args, arg_name) <= 0:
+            print(f"--{arg_name.replace('_', '-')} must be positive.")
+            sys.exit(1)
+
+    for arg_name in ["array", "stage_dag", "batch_pull"]:
+        if args.pipeline and getattr(args, arg_name):
+            print(
+                f"--{arg_name.replace('_', '-')} is not supported "
+                + "with --pipeline."
+            )
+            sys.exit(1)
+    if args.right_size and args.stage_dag:
+        print("--right-size is not supported with --stage-dag.")
+        sys.exit(1)
+    if args.scratch and args.split_modality:
+        print("--scratch is not supported with --split-modality.")
+        sys.exit(1)
+    if args.scratch and args.work_cache:
+        print("--work-cache is not supported with --scratch.")
+        sys.exit(1)
+
+    # Only schedule subjects missing output on Keoki
+    if args.skip_done:
+        subj_list = process.subj_todo(
+            subj_list, process.remote_done_index(sess)
+        )
+        if not subj_list:
+            print("No subjects require MRIQC.")
+            return
 
     # Setup group project directory, paths
     proj_raw = os.path.join(proj_dir, "rawdata")
@@ -122,7 +396,7 @@ def main():
     user_name = os.environ["USER"]
 
     # Setup work directory, for intermediates
-    work_deriv = os.path.join("/work", user_name, "EmoRep")
+    work_deriv = os.path.join(WORK_ROOT, user_name, "EmoRep")
     now_time = datetime.now()
     log_dir = os.path.join(
         work_deriv, f"logs/mriqc_{now_time.strftime('%y-%m-%d_%H:%M')}"
@@ -132,13 +406,107 @@ def main():
         if not os.path.exists(h_dir):
             os.makedirs(h_dir)
 
-    # Setup and submit jobs for subjects
+    # Setup subject output directories
     for subj in subj_list:
         subj_deriv = os.path.join(proj_mriqc, subj, sess)
         if not os.path.exists(subj_deriv):
             os.makedirs(subj_deriv)
 
-        _, _ = submit.schedule_subj(
+    # Rerun from the start rather than resume
+    if args.force:
+        for subj in subj_list:
+            checkpoint.Checkpoint(work_mriqc, subj, sess).clear()
+
+    # Options passed through to subject workflows
+    wf_kwargs = {
+        "pull_mode": args.pull_mode,
+        "push_mode": args.push_mode,
+        "split_modality": args.split_modality,
+        "scratch": args.scratch,
+        "image_cache": args.image_cache,
+        "work_cache": args.work_cache,
+    }
+    if args.right_size:
+        wf_kwargs["resource_history"] = os.path.join(
+            work_mriqc, "resource_history.jsonl"
+        )
+
+    # Submit cohort pipeline controller
+    if args.pipeline:
+        pipe_ids = submit.schedule_pipeline(
+            sing_mriqc,
+            work_deriv,
+            work_mriqc,
+            log_dir,
+            proj_research,
+            proj_raw,
+            proj_mriqc,
+            subj_list,
+            sess,
+            fd_thresh,
+            disk_budget=args.disk_budget,
+            num_workers=args.pipeline_workers,
+            wf_kwargs=wf_kwargs,
+        )
+        _schedule_group(args, sing_mriqc, work_deriv, log_dir, pipe_ids)
+        return
+
+    # Download rawdata for all subjects, subject workflows
+    # start after download regardless of success.
+    dependency = None
+    if args.batch_pull:
+        pull_id = submit.schedule_batch_pull(
+            log_dir, subj_list, sess, num_streams=args.pull_streams
+        )
+        dependency = f"afterany:{pull_id}"
+
+    # Submit workflow stages as chained jobs
+    if args.stage_dag:
+        job_dict = submit.schedule_stages(
+            sing_mriqc,
+            work_deriv,
+            work_mriqc,
+            log_dir,
+            proj_research,
+            proj_raw,
+            proj_mriqc,
+            subj_list,
+            sess,
+            fd_thresh,
+            array_limit=args.array_limit if args.array else None,
+            dependency=dependency,
+            wf_kwargs=wf_kwargs,
+        )
+        push_ids = [x["push"].split("_")[0] for x in job_dict.values()]
+        _schedule_group(args, sing_mriqc, work_deriv, log_dir, push_ids)
+        return
+
+    # Submit all subjects as single job array
+    if args.array:
+        h_out, _ = submit.schedule_array(
+            sing_mriqc,
+            work_deriv,
+            work_mriqc,
+            log_dir,
+            proj_research,
+            proj_raw,
+            proj_mriqc,
+            subj_list,
+            sess,
+            fd_thresh,
+            array_limit=args.array_limit,
+            dependency=dependency,
+            wf_kwargs=wf_kwargs,
+        )
+        _schedule_group(
+            args, sing_mriqc, work_deriv, log_dir, [submit.parse_job_id(h_out)]
+        )
+        return
+
+    # Submit jobs for each subject
+    subj_ids = []
+    for subj in subj_list:
+        h_out, _ = submit.schedule_subj(
             sing_mriqc,
             work_deriv,
             work_mriqc,
@@ -149,8 +517,12 @@ def main():
             subj,
             sess,
             fd_thresh,
+            dependency=dependency,
+            wf_kwargs=wf_kwargs,
         )
+        subj_ids.append(submit.parse_job_id(h_out))
         time.sleep(3)
+    _schedule_group(args, sing_mriqc, work_deriv, log_dir, subj_ids)
 
 
 if __name__ == "__main__":
@@ -13,6 +13,9 @@ def main():
 
         mriqc_subj    : conduct subject-level MRIQC
         mriqc_group   : conduct group-level MRIQC
+        mriqc_report  : summarize throughput of an MRIQC run
+        mriqc_iqms    : query IQMs of an MRIQC cohort
+        mriqc_status  : report workflow states of subjects
 
     """
     )
@@ -0,0 +1,247 @@
+"""Native group-level aggregation of MRIQC IQMs.
+
+aggregate : update group IQM tables from participant IQM files
+load_table : return group IQM table of modality
+table_version : return version of group IQM table of modality
+read_iqms : return numeric IQMs of participant IQM file content
+
+"""
+
+import os
+import glob
+import json
+import time
+import hashlib
+from typing import Union
+import numpy as np
+from func_mriqc import cache
+
+# BIDS datatype directory of each modality
+MODALITIES = {"T1w": "anat", "T2w": "anat", "bold": "func"}
+
+# Location of index and columnar tables, relative to derivatives/mriqc
+INDEX_DIR = ".group_index"
+
+
+def load_table(proj_mriqc: Union[str, os.PathLike], modality: str) -> tuple:
+    """Return group IQM table of modality, as updated by aggregate.
+
+    Parameters
+    ----------
+    proj_mriqc : str, os.PathLike
+        Location of project derivatives/mriqc
+    modality : str
+        Key of MODALITIES
+
+    Returns
+    -------
+    tuple
+        [0] = list of BIDS names of rows
+        [1] = list of IQM names of columns
+        [2] = numpy.ndarray of IQMs, NaN when missing
+
+    """
+    return _load_table(os.path.join(proj_mriqc, INDEX_DIR, f"{modality}.npz"))
+
+
+def table_version(
+    proj_mriqc: Union[str, os.PathLike], modality: str
+) -> Union[str, None]:
+    """Return version of group IQM table of modality, None when missing.
+
+    The version changes whenever aggregate rewrites the table, by any
+    caller, e.g. mriqc_group --native.
+
+    """
+    npz_path = os.path.join(proj_mriqc, INDEX_DIR, f"{modality}.npz")
+    try:
+        f_stat = os.stat(npz_path)
+    except FileNotFoundError:
+        return None
+    return f"{f_stat.st_mtime_ns}-{f_stat.st_size}"
+
+
+def _load_table(npz_path: str) -> tuple:
+    """Return names, columns, and values of columnar table."""
+    if not os.path.exists(npz_path):
+        return ([], [], np.empty((0, 0)))
+    with np.load(npz_path, allow_pickle=False) as npz:
+        return (
+            npz["names"].tolist(),
+            npz["columns"].tolist(),
+            npz["values"],
+        )
+
+
+def _save_table(npz_path: str, names: list, columns: list, values):
+    """Atomically write columnar table."""
+    tmp_path = f"{npz_path[:-4]}.tmp.npz"
+    np.savez(
+        tmp_path,
+        names=np.array(names, dtype=str),
+        columns=np.array(columns, dtype=str),
+        values=values,
+    )
+    os.replace(tmp_path, npz_path)
+
+
+def _write_tsv(tsv_path: str, names: list, columns: list, values):
+    """Atomically write MRIQC group TSV, empty fields for missing IQMs."""
+    with open(tsv_path + ".tmp", "w") as tf:
+        tf.write("\t".join(["bids_name"] + columns) + "\n")
+        for name, row in zip(names, values):
+            tf.write(
+                "\t".join(
+                    [name] + ["" if np.isnan(x) else f"{x:.10g}" for x in row]
+                )
+                + "\n"
+            )
+    os.replace(tsv_path + ".tmp", tsv_path)
+
+
+def read_iqms(iqm_bytes: bytes) -> dict:
+    """Return numeric IQMs of participant IQM file content.
+
+    Non-numeric and boolean fields, e.g. bids_meta, are dropped.
+
+    """
+    return {
+        k: float(v)
+        for k, v in json.loads(iqm_bytes).items()
+        if isinstance(v, (int, float)) and not isinstance(v, bool)
+    }
+
+
+def _update_modality(
+    proj_mriqc: Union[str, os.PathLike],
+    modality: str,
+    index: dict,
+    write_tsv: bool,
+) -> dict:
+    """Update group table of modality, return counts of changes."""
+    dtype = MODALITIES[modality]
+    npz_path = os.path.join(proj_mriqc, INDEX_DIR, f"{modality}.npz")
+    tsv_path = os.path.join(proj_mriqc, f"group_{modality}.tsv")
+    names, columns, values = _load_table(npz_path)
+    prev_idx = index.get(modality, {})
+
+    # Find new or changed files via stat, then content hash
+    json_list = glob.glob(
+        f"{proj_mriqc}/sub-*/ses-*/{dtype}/*_{modality}.json"
+    ) + glob.glob(f"{proj_mriqc}/sub-*/{dtype}/*_{modality}.json")
+    cur_idx = {}
+    parsed = {}
+    for json_path in json_list:
+        rel = os.path.relpath(json_path, proj_mriqc)
+        f_stat = os.stat(json_path)
+        f_key = {"mtime_ns": f_stat.st_mtime_ns, "size": f_stat.st_size}
+        prev = prev_idx.get(rel)
+        if prev and all(prev[k] == v for k, v in f_key.items()):
+            cur_idx[rel] = prev
+            continue
+        with open(json_path, "rb") as jf:
+            iqm_bytes = jf.read()
+        f_key["sha1"] = hashlib.sha1(iqm_bytes).hexdigest()
+        cur_idx[rel] = f_key
+        if prev and prev["sha1"] == f_key["sha1"]:
+            continue
+        parsed[os.path.basename(rel)[:-5]] = read_iqms(iqm_bytes)
+    removed = {os.path.basename(x)[:-5] for x in set(prev_idx) - set(cur_idx)}
+    index[modality] = cur_idx
+    out_dict = {"rows": len(cur_idx), "parsed": len(parsed)}
+    out_dict["removed"] = len(removed)
+    if (
+        not parsed
+        and not removed
+        and (os.path.exists(tsv_path) or not cur_idx)
+    ):
+        return out_dict
+
+    # Add columns of new IQMs, replace rows of changed files
+    new_cols = sorted({k for x in parsed.values() for k in x} - set(columns))
+    if new_cols:
+        columns = columns + new_cols
+        values = np.hstack(
+            [values, np.full((len(names), len(new_cols)), np.nan)]
+        )
+    keep = np.array(
+        [x not in parsed and x not in removed for x in names], dtype=bool
+    )
+    new_rows = np.full((len(parsed), len(columns)), np.nan)
+    col_pos = {x: idx for idx, x in enumerate(columns)}
+    for row, iqm_dict in zip(new_rows, parsed.values()):
+        for key, val in iqm_dict.items():
+            row[col_pos[key]] = val
+    names = [x for x, y in zip(names, keep) if y] + list(parsed)
+    values = np.vstack([values[keep], new_rows])
+
+    # Order rows by name and columns alphabetically
+    row_order = np.argsort(np.array(names, dtype=str), kind="stable")
+    col_order = np.argsort(np.array(columns, dtype=str), kind="stable")
+    names = [names[x] for x in row_order]
+    columns = [columns[x] for x in col_order]
+    values = values[np.ix_(row_order, col_order)]
+    _save_table(npz_path, names, columns, values)
+    if not write_tsv:
+        return out_dict
+    if names:
+        _write_tsv(tsv_path, names, columns, values)
+    elif os.path.exists(tsv_path):
+        os.remove(tsv_path)
+    return out_dict
+
+
+def aggregate(
+    proj_mriqc: Union[str, os.PathLike],
+    modalities: list = None,
+    write_tsv: bool = True,
+) -> dict:
+    """Update group IQM tables from participant IQM files.
+
+    Maintains group_<modality>.tsv in proj_mriqc, matching the group
+    tables of MRIQC, without docker. The modification time, size, and
+    hash of each participant IQM JSON are kept in an index, and the
+    tables as NumPy columns, both in <proj_mriqc>/.group_index. Only
+    new or changed files are parsed and rows of removed files dropped,
+    so adding subjects to a cohort does not re-read the others.
+
+    Parameters
+    ----------
+    proj_mriqc : str, os.PathLike
+        Location of project derivatives/mriqc
+    modalities : list, optional
+        Modalities to aggregate, defaults to keys of MODALITIES
+    write_tsv : bool, optional
+        Write group_<modality>.tsv, otherwise only update the
+        columnar tables (see load_table)
+
+    Returns
+    -------
+    dict
+        {modality: {"rows", "parsed", "removed", "seconds"}}
+
+    Example
+    -------
+    aggregate("/mnt/keoki/experiments2/EmoRep/.../derivatives/mriqc")
+
+    """
+    idx_dir = os.path.join(proj_mriqc, INDEX_DIR)
+    os.makedirs(idx_dir, exist_ok=True)
+    out_dict = {}
+    with cache.cache_lock(idx_dir):
+        index = cache.load_index(idx_dir)
+        for modality in modalities or list(MODALITIES):
+            start = time.monotonic()
+            out_dict[modality] = _update_modality(
+                proj_mriqc, modality, index, write_tsv
+            )
+            out_dict[modality]["seconds"] = time.monotonic() - start
+        cache.write_index(idx_dir, index)
+
+    for modality, info in out_dict.items():
+        print(
+            f"\tgroup_{modality} : {info['rows']} rows, parsed "
+            + f"{info['parsed']}, removed {info['removed']} "
+            + f"in {info['seconds']:.2f}s"
+        )
+    return out_dict
@@ -0,0 +1,396 @@
+"""Columnar store of participant IQMs for cohort QC queries.
+
+parse_where : parse filter expression, e.g. "fd_mean>0.3"
+IqmStore : memory-mapped IQM columns with a BIDS entity index
+
+"""
+
+import os
+import re
+import json
+import shutil
+from typing import Union
+import numpy as np
+from func_mriqc import cache
+from func_mriqc import group
+
+# Location of store, relative to derivatives/mriqc
+STORE_DIR = ".iqm_store"
+
+# BIDS entities of index columns, and their prefixes
+ENTITIES = {"subject": "sub", "session": "ses", "task": "task", "run": "run"}
+
+# Comparisons available to filter expressions
+_OPS = {
+    ">=": np.greater_equal,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+    ">": np.greater,
+    "<": np.less,
+}
+_WHERE_RE = re.compile(r"^\s*(\w+)\s*(>=|<=|==|!=|>|<)\s*(\S+)\s*$")
+
+
+def parse_where(expr: str) -> tuple:
+    """Parse filter expression, e.g. "fd_mean>0.3".
+
+    Parameters
+    ----------
+    expr : str
+        <IQM><op><value>, op in >, >=, <, <=, ==, !=
+
+    Returns
+    -------
+    tuple
+        [0] = IQM name
+        [1] = comparison operator
+        [2] = float value
+
+    Raises
+    ------
+    ValueError
+        Unparseable expression
+
+    """
+    match = _WHERE_RE.match(expr)
+    if not match:
+        raise ValueError(f"Unexpected filter expression : {expr}")
+    name, op, value = match.groups()
+    return (name, op, float(value))
+
+
+def _parse_entities(bids_name: str) -> tuple:
+    """Return subject, session, task, and run of BIDS name."""
+    pairs = dict(x.split("-", 1) for x in bids_name.split("_") if "-" in x)
+    subj, sess, task, run = [pairs.get(x, "") for x in ENTITIES.values()]
+    return (
+        f"sub-{subj}" if subj else "",
+        f"ses-{sess}" if sess else "",
+        f"task-{task}" if task else "",
+        int(run) if run.isdigit() else -1,
+    )
+
+
+def _prefixed(key: str, value: str) -> str:
+    """Return entity value with its BIDS prefix, e.g. ses-day3."""
+    prefix = ENTITIES[key] + "-"
+    return value if value.startswith(prefix) else prefix + value
+
+
+class IqmStore:
+    """Memory-mapped IQM columns with a BIDS entity index.
+
+    Each modality is held in <proj_mriqc>/.iqm_store/<modality> as one
+    .npy file per IQM (iqm/) and per index column (index/ : bids_name,
+    subject, session, task, run). Columns are memory-mapped, so
+    queries only read the columns they touch and cohort statistics
+    are vectorized over all runs. The store is populated from the
+    participant IQM JSON files via group.aggregate, so only new or
+    changed files are parsed, and each modality is rebuilt whenever
+    its group table changed (see group.table_version), including by
+    other callers of group.aggregate.
+
+    Parameters
+    ----------
+    proj_mriqc : str, os.PathLike
+        Location of project derivatives/mriqc
+
+    Methods
+    -------
+    update(modalities=None)
+        Populate store from participant IQM files
+    modalities()
+        Return modalities held in store
+    columns(modality)
+        Return IQM names of modality
+    column(modality, name)
+        Return memory-mapped IQM or index column
+    select(modality, subject=None, ...)
+        Return boolean mask of runs matching filters
+    zscore(modality, name)
+        Return cohort z-scores of IQM
+    iqr_outliers(modality, name, k=1.5)
+        Return cohort IQR outlier flags of IQM
+    query(modality, columns=None, ...)
+        Return filtered IQMs with optional z-scores and outlier flags
+
+    Example
+    -------
+    store = IqmStore("/mnt/keoki/.../derivatives/mriqc")
+    store.update()
+    res = store.query(
+        "bold", columns=["fd_mean"], session="day3", where=["fd_mean>0.3"]
+    )
+
+    """
+
+    def __init__(self, proj_mriqc: Union[str, os.PathLike]):
+        """Initialize."""
+        self.proj_mriqc = proj_mriqc
+        self.store_dir = os.path.join(proj_mriqc, STORE_DIR)
+        self._meta = {}
+
+    def update(self, modalities: list = None) -> dict:
+        """Populate store from participant IQM files.
+
+        Parameters
+        ----------
+        modalities : list, optional
+            Modalities to update, defaults to keys of group.MODALITIES
+
+        Returns
+        -------
+        dict
+            {modality: {"rows", "parsed", "removed", "seconds"}}
+
+        """
+        info = group.aggregate(self.proj_mriqc, modalities, write_tsv=False)
+        os.makedirs(self.store_dir, exist_ok=True)
+        with cache.cache_lock(self.store_dir):
+            for modality in info:
+                mod_dir = os.path.join(self.store_dir, modality)
+                version = group.table_version(self.proj_mriqc, modality)
+                if version and version == self._stored_version(mod_dir):
+                    continue
+                self._write_modality(modality, mod_dir, version)
+        self._meta = {}
+        return info
+
+    def _stored_version(self, mod_dir: str) -> Union[str, None]:
+        """Return group table version held by store of modality."""
+        try:
+            with open(os.path.join(mod_dir, "meta.json")) as jf:
+                return json.load(jf).get("version")
+        except FileNotFoundError:
+            return None
+
+    def _write_modality(self, modality: str, mod_dir: str, version: str):
+        """Write columns of modality, then swap into place."""
+        names, columns, values = group.load_table(self.proj_mriqc, modality)
+        if not names:
+            if os.path.exists(mod_dir):
+                shutil.rmtree(mod_dir)
+            return
+
+        tmp_dir = f"{mod_dir}.tmp"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(os.path.join(tmp_dir, "index"))
+        os.makedirs(os.path.join(tmp_dir, "iqm"))
+        ent_list = list(zip(*[_parse_entities(x) for x in names]))
+        idx_dict = {"bids_name": np.array(names, dtype=str)}
+        for key, vals in zip(ENTITIES, ent_list):
+            idx_dict[key] = np.array(vals, dtype=int if key == "run" else str)
+        for key, arr in idx_dict.items():
+            np.save(os.path.join(tmp_dir, "index", f"{key}.npy"), arr)
+        for pos, name in enumerate(columns):
+            np.save(
+                os.path.join(tmp_dir, "iqm", f"{name}.npy"),
+                np.ascontiguousarray(values[:, pos]),
+            )
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as jf:
+            json.dump(
+                {
+                    "rows": len(names),
+                    "version": version,
+                    "index": list(idx_dict),
+                    "iqms": columns,
+                },
+                jf,
+            )
+
+        # Open memory maps of readers keep the replaced files
+        old_dir = f"{mod_dir}.old"
+        if os.path.exists(mod_dir):
+            os.rename(mod_dir, old_dir)
+        os.rename(tmp_dir, mod_dir)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+
+    def _get_meta(self, modality: str) -> dict:
+        """Return meta of modality, raise KeyError when not in store."""
+        if modality not in self._meta:
+            meta_path = os.path.join(self.store_dir, modality, "meta.json")
+            if not os.path.exists(meta_path):
+                raise KeyError(f"Modality not in IQM store : {modality}")
+            with open(meta_path) as jf:
+                self._meta[modality] = json.load(jf)
+        return self._meta[modality]
+
+    def modalities(self) -> list:
+        """Return modalities held in store."""
+        return [
+            x
+            for x in group.MODALITIES
+            if os.path.exists(os.path.join(self.store_dir, x, "meta.json"))
+        ]
+
+    def columns(self, modality: str) -> list:
+        """Return IQM names of modality."""
+        return list(self._get_meta(modality)["iqms"])
+
+    def column(self, modality: str, name: str) -> np.ndarray:
+        """Return memory-mapped IQM or index column of modality.
+
+        Raises
+        ------
+        KeyError
+            Unknown modality or column
+
+        """
+        meta = self._get_meta(modality)
+        if name in meta["index"]:
+            sub_dir = "index"
+        elif name in meta["iqms"]:
+            sub_dir = "iqm"
+        else:
+            raise KeyError(f"Column not in IQM store for {modality} : {name}")
+        return np.load(
+            os.path.join(self.store_dir, modality, sub_dir, f"{name}.npy"),
+            mmap_mode="r",
+        )
+
+    def select(
+        self,
+        modality: str,
+        subject: Union[str, list] = None,
+        session: Union[str, list] = None,
+        task: Union[str, list] = None,
+        run: Union[int, list] = None,
+        where: list = None,
+    ) -> np.ndarray:
+        """Return boolean mask of runs matching all filters.
+
+        Parameters
+        ----------
+        modality : str
+            Key of group.MODALITIES
+        subject, session, task : str, list, optional
+            Entity values, with or without BIDS prefix, e.g. "day3"
+            or "ses-day3"
+        run : int, list, optional
+            Run numbers
+        where : list, optional
+            Filter expressions, see parse_where, or parsed tuples.
+            Runs missing the IQM do not match.
+
+        Returns
+        -------
+        numpy.ndarray
+
+        """
+        mask = np.ones(self._get_meta(modality)["rows"], dtype=bool)
+        for key, value in [
+            ("subject", subject),
+            ("session", session),
+            ("task", task),
+            ("run", run),
+        ]:
+            if value is None:
+                continue
+            val_list = value if isinstance(value, (list, tuple)) else [value]
+            if key == "run":
+                val_list = [int(x) for x in val_list]
+            else:
+                val_list = [_prefixed(key, str(x)) for x in val_list]
+            mask &= np.isin(self.column(modality, key), val_list)
+        for expr in where or []:
+            name, op, value = (
+                parse_where(expr) if isinstance(expr, str) else expr
+            )
+            vals = self.column(modality, name)
+            mask &= _OPS[op](vals, value) & ~np.isnan(vals)
+        return mask
+
+    def zscore(self, modality: str, name: str) -> np.ndarray:
+        """Return z-scores of IQM relative to the whole cohort.
+
+        Missing values are ignored by the cohort mean and standard
+        deviation, and remain NaN.
+
+        """
+        vals = self.column(modality, name)
+        std = np.nanstd(vals, ddof=1) if np.sum(~np.isnan(vals)) > 1 else 0
+        if not std:
+            return np.where(np.isnan(vals), np.nan, 0.0)
+        return (vals - np.nanmean(vals)) / std
+
+    def iqr_outliers(
+        self, modality: str, name: str, k: float = 1.5
+    ) -> np.ndarray:
+        """Return whether IQM falls outside k IQRs of the cohort quartiles.
+
+        Missing values are not flagged.
+
+        """
+        vals = self.column(modality, name)
+        if np.all(np.isnan(vals)):
+            return np.zeros(vals.shape, dtype=bool)
+        q1, q3 = np.nanpercentile(vals, [25, 75])
+        iqr = q3 - q1
+        with np.errstate(invalid="ignore"):
+            return (vals < q1 - k * iqr) | (vals > q3 + k * iqr)
+
+    def query(
+        self,
+        modality: str,
+        columns: list = None,
+        subject: Union[str, list] = None,
+        session: Union[str, list] = None,
+        task: Union[str, list] = None,
+        run: Union[int, list] = None,
+        where: list = None,
+        zscore: bool = False,
+        outliers: bool = False,
+        k: float = 1.5,
+    ) -> dict:
+        """Return filtered IQMs of modality.
+
+        Z-scores and outlier flags are computed over the whole cohort
+        of the modality, then filtered, so a run is judged relative to
+        all runs rather than to the selection.
+
+        Parameters
+        ----------
+        modality : str
+            Key of group.MODALITIES
+        columns : list, optional
+            IQM names to return, defaults to all
+        subject, session, task, run, where : optional
+            Filters, see select
+        zscore : bool, optional
+            Add <IQM>_z columns
+        outliers : bool, optional
+            Add <IQM>_outlier columns, see iqr_outliers
+        k : float, optional
+            IQR multiplier for outlier flags
+
+        Returns
+        -------
+        dict
+            {column: numpy.ndarray}, index columns followed by IQMs
+
+        """
+        mask = self.select(
+            modality,
+            subject=subject,
+            session=session,
+            task=task,
+            run=run,
+            where=where,
+        )
+        meta = self._get_meta(modality)
+        out_dict = {
+            x: np.asarray(self.column(modality, x)[mask])
+            for x in meta["index"]
+        }
+        for name in columns or meta["iqms"]:
+            out_dict[name] = np.asarray(self.column(modality, name)[mask])
+            if zscore:
+                out_dict[f"{name}_z"] = self.zscore(modality, name)[mask]
+            if outliers:
+                out_dict[f"{name}_outlier"] = self.iqr_outliers(
+                    modality, name, k=k
+                )[mask]
+        return out_dict
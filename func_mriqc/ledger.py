@@ -0,0 +1,447 @@
+"""Ledger of subject workflow states in SQLite.
+
+STATES : ordered states of a subject and session
+Ledger : record and query workflow states
+NullLedger : stand-in ledger which records nothing
+open_ledger : return ledger of work derivatives
+
+"""
+
+import os
+import time
+import socket
+import sqlite3
+from contextlib import contextmanager
+from typing import Union
+
+# States of a subject and session, in order of the workflow. Stage
+# states match checkpoint.STAGES, "cleaned" is complete.
+STATES = [
+    "submitted",
+    "running",
+    "pulled",
+    "mriqc_done",
+    "copied",
+    "pushed",
+    "cleaned",
+    "failed",
+]
+
+# Location of ledger, relative to work derivatives/mriqc
+LEDGER_FILE = "ledger.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    subj TEXT NOT NULL,
+    sess TEXT NOT NULL,
+    state TEXT NOT NULL,
+    job_id TEXT,
+    log_dir TEXT,
+    message TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (subj, sess)
+);
+CREATE INDEX IF NOT EXISTS runs_sess_state ON runs (sess, state);
+CREATE INDEX IF NOT EXISTS runs_state ON runs (state);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    subj TEXT NOT NULL,
+    sess TEXT NOT NULL,
+    state TEXT NOT NULL,
+    job_id TEXT,
+    host TEXT,
+    message TEXT,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_subj_sess ON events (subj, sess);
+"""
+
+
+class Ledger:
+    """Record and query workflow states in SQLite.
+
+    The current state of each subject and session is held in an
+    indexed table, and every transition is appended to an event
+    history. The database uses a rollback journal, as write-ahead
+    logging requires memory shared by all writers and so is
+    unsupported for jobs of many nodes on a network file system. Each
+    write is a short immediate transaction retried while the database
+    is busy, so submit and the workflows of many array tasks may write
+    concurrently.
+
+    Parameters
+    ----------
+    db_path : str, os.PathLike
+        Location of SQLite database, created when missing
+    timeout : float, optional
+        Seconds a query waits for a busy database
+
+    Raises
+    ------
+    sqlite3.Error
+        Database can not be opened or initialized
+
+    Methods
+    -------
+    record(subj, sess, state, job_id=None, log_dir=None, message=None)
+        Record state transition of subject and session
+    record_many(rows)
+        Record state transitions of many subjects in one transaction
+    status(sess=None, state=None, subj=None)
+        Return current states matching filters
+    counts(sess=None)
+        Return number of subjects and sessions in each state
+    history(subj, sess)
+        Return state transitions of subject and session
+    track(subj, sess, stage=None, log_dir=None)
+        Record failed state when the enclosed block raises
+
+    Example
+    -------
+    run_ledger = open_ledger("/work/user/EmoRep/mriqc")
+    run_ledger.record("sub-ER0009", "ses-day2", "submitted", job_id="1234")
+    run_ledger.status(sess="ses-day2", state="failed")
+
+    """
+
+    def __init__(self, db_path: Union[str, os.PathLike], timeout=60.0):
+        """Initialize."""
+        self.db_path = str(db_path)
+        self._timeout = timeout
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return connection, one per call for use across threads."""
+        conn = sqlite3.connect(
+            self.db_path, timeout=self._timeout, isolation_level=None
+        )
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _write(self, rows: list):
+        """Write transitions of rows in a single immediate transaction."""
+        now = time.time()
+        host = socket.gethostname()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                """
+                INSERT INTO runs
+                    (subj, sess, state, job_id, log_dir, message, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (subj, sess) DO UPDATE SET
+                    state = excluded.state,
+                    job_id = COALESCE(excluded.job_id, runs.job_id),
+                    log_dir = COALESCE(excluded.log_dir, runs.log_dir),
+                    message = excluded.message,
+                    updated = excluded.updated
+                """,
+                [
+                    (
+                        x["subj"],
+                        x["sess"],
+                        x["state"],
+                        x.get("job_id"),
+                        x.get("log_dir"),
+                        x.get("message"),
+                        now,
+                    )
+                    for x in rows
+                ],
+            )
+            conn.executemany(
+                """
+                INSERT INTO events
+                    (subj, sess, state, job_id, host, message, time)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        x["subj"],
+                        x["sess"],
+                        x["state"],
+                        x.get("job_id"),
+                        host,
+                        x.get("message"),
+                        now,
+                    )
+                    for x in rows
+                ],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def record(
+        self,
+        subj: str,
+        sess: str,
+        state: str,
+        job_id: str = None,
+        log_dir: Union[str, os.PathLike] = None,
+        message: str = None,
+    ) -> bool:
+        """Record state transition of subject and session.
+
+        The job ID defaults to that of the current SLURM job, as
+        <array_id>_<task_id> within job arrays. Failing writes are
+        reported rather than raised, so a busy ledger does not fail the
+        workflow.
+
+        Parameters
+        ----------
+        subj : str
+            BIDS subject identifier
+        sess : str
+            BIDS session identifier
+        state : str
+            Member of STATES
+        job_id : str, optional
+            SLURM job ID
+        log_dir : str, os.PathLike, optional
+            Location of work log directory
+        message : str, optional
+            Detail of transition, e.g. error
+
+        Returns
+        -------
+        bool
+            Whether transition was recorded
+
+        Raises
+        ------
+        ValueError
+            Unexpected state
+
+        """
+        return self.record_many(
+            [
+                {
+                    "subj": subj,
+                    "sess": sess,
+                    "state": state,
+                    "job_id": job_id,
+                    "log_dir": log_dir,
+                    "message": message,
+                }
+            ]
+        )
+
+    def record_many(self, rows: list) -> bool:
+        """Record state transitions of many subjects in one transaction.
+
+        Parameters
+        ----------
+        rows : list
+            Dicts of record arguments, requiring subj, sess, and state
+
+        Returns
+        -------
+        bool
+            Whether transitions were recorded
+
+        Raises
+        ------
+        ValueError
+            Unexpected state
+
+        """
+        env_job = os.environ.get("SLURM_JOB_ID")
+        if os.environ.get("SLURM_ARRAY_TASK_ID"):
+            env_job = (
+                f"{os.environ.get('SLURM_ARRAY_JOB_ID')}_"
+                + os.environ["SLURM_ARRAY_TASK_ID"]
+            )
+        row_list = []
+        for row in rows:
+            if row["state"] not in STATES:
+                raise ValueError(f"Unexpected ledger state : {row['state']}")
+            row_list.append(
+                {
+                    **row,
+                    "job_id": row.get("job_id") or env_job,
+                    "log_dir": str(row["log_dir"])
+                    if row.get("log_dir")
+                    else None,
+                }
+            )
+        if not row_list:
+            return True
+        try:
+            self._write(row_list)
+        except sqlite3.Error as e:
+            print(f"\tFailed to update ledger {self.db_path} : {e}")
+            return False
+        return True
+
+    @contextmanager
+    def track(
+        self,
+        subj: str,
+        sess: str,
+        stage: str = None,
+        log_dir: Union[str, os.PathLike] = None,
+    ):
+        """Record failed state when the enclosed block raises.
+
+        The message holds the stage and first line of the error.
+
+        Example
+        -------
+        with run_ledger.track("sub-ER0009", "ses-day2", "push"):
+            push_pull.push_data(subj_out)
+
+        """
+        try:
+            yield
+        except Exception as e:
+            err_line = (str(e).splitlines() or [type(e).__name__])[0]
+            self.record(
+                subj,
+                sess,
+                "failed",
+                log_dir=log_dir,
+                message=f"{stage} : {err_line}"[:500] if stage else err_line,
+            )
+            raise
+
+    def status(
+        self,
+        sess: Union[str, list] = None,
+        state: Union[str, list] = None,
+        subj: Union[str, list] = None,
+    ) -> list:
+        """Return current states matching all filters.
+
+        Parameters
+        ----------
+        sess, state, subj : str, list, optional
+            Values to match
+
+        Returns
+        -------
+        list
+            Dicts of subj, sess, state, job_id, log_dir, message, and
+            updated, ordered by session and subject
+
+        """
+        where = []
+        params = []
+        for col, value in [("sess", sess), ("state", state), ("subj", subj)]:
+            if value is None:
+                continue
+            val_list = value if isinstance(value, (list, tuple)) else [value]
+            where.append(f"{col} IN ({', '.join('?' * len(val_list))})")
+            params += list(val_list)
+        sql = "SELECT * FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY sess, subj"
+        conn = self._connect()
+        try:
+            return [dict(x) for x in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def counts(self, sess: str = None) -> dict:
+        """Return number of subjects and sessions in each state.
+
+        Returns
+        -------
+        dict
+            {sess: {state: count}}
+
+        """
+        sql = "SELECT sess, state, COUNT(*) FROM runs"
+        params = []
+        if sess:
+            sql += " WHERE sess = ?"
+            params.append(sess)
+        sql += " GROUP BY sess, state"
+        out_dict = {}
+        conn = self._connect()
+        try:
+            for h_sess, state, num in conn.execute(sql, params):
+                out_dict.setdefault(h_sess, {})[state] = num
+        finally:
+            conn.close()
+        return out_dict
+
+    def history(self, subj: str, sess: str) -> list:
+        """Return state transitions of subject and session, oldest first."""
+        conn = self._connect()
+        try:
+            return [
+                dict(x)
+                for x in conn.execute(
+                    "SELECT * FROM events WHERE subj = ? AND sess = ? "
+                    + "ORDER BY time, id",
+                    (subj, sess),
+                )
+            ]
+        finally:
+            conn.close()
+
+
+class NullLedger(Ledger):
+    """Stand-in ledger which records nothing.
+
+    Used when the ledger can not be opened, so workflows run without
+    recording their states. Records are validated and dropped, queries
+    return nothing, and track still re-raises errors of the enclosed
+    block.
+
+    Parameters
+    ----------
+    db_path : str, os.PathLike
+        Location of the SQLite database which failed to open
+
+    """
+
+    def __init__(self, db_path: Union[str, os.PathLike]):
+        """Initialize."""
+        self.db_path = str(db_path)
+
+    def record_many(self, rows: list) -> bool:
+        """Validate and drop state transitions, see Ledger.record_many."""
+        for row in rows:
+            if row["state"] not in STATES:
+                raise ValueError(f"Unexpected ledger state : {row['state']}")
+        return False
+
+    def status(self, sess=None, state=None, subj=None) -> list:
+        """Return no states."""
+        return []
+
+    def counts(self, sess: str = None) -> dict:
+        """Return no counts."""
+        return {}
+
+    def history(self, subj: str, sess: str) -> list:
+        """Return no transitions."""
+        return []
+
+
+def open_ledger(work_mriqc: Union[str, os.PathLike]) -> Ledger:
+    """Return ledger of work derivatives/mriqc, see LEDGER_FILE.
+
+    A ledger which can not be opened is reported and replaced by a
+    NullLedger, so ledger errors do not fail submission or workflows.
+
+    """
+    db_path = os.path.join(work_mriqc, LEDGER_FILE)
+    try:
+        return Ledger(db_path)
+    except sqlite3.Error as e:
+        print(f"\tFailed to open ledger {db_path}, not recording : {e}")
+        return NullLedger(db_path)
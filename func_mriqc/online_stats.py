@@ -0,0 +1,492 @@
+"""Running group statistics of IQMs, updated as subjects finish.
+
+QuantileSketch : mergeable sketch of approximate quantiles
+IqmStats : running count, mean, variance, and quantiles of an IQM
+RunningStats : running statistics of IQMs for each modality
+load : return running statistics of project
+fold : fold IQMs of subject and session into running statistics
+
+"""
+
+import os
+import glob
+import json
+import math
+import hashlib
+from typing import Union
+from func_mriqc import cache
+from func_mriqc import group
+
+# Location of running statistics, relative to derivatives/mriqc
+STATS_DIR = ".online_stats"
+
+# Values closer to zero than this share the zero bucket of sketches
+_MIN_VALUE = 1e-12
+
+
+class QuantileSketch:
+    """Mergeable sketch of approximate quantiles.
+
+    Values are counted in logarithmic buckets (DDSketch), so any
+    quantile is returned within relative error alpha of an observed
+    value. Merging adds bucket counts, making the result independent
+    of the order and grouping of values, and the size of the sketch
+    depends on the range of values rather than on their number.
+
+    Parameters
+    ----------
+    alpha : float, optional
+        Relative accuracy of quantiles
+
+    Methods
+    -------
+    add(value)
+        Count value
+    merge(other, sign=1)
+        Add (or with sign=-1, remove) counts of another sketch
+    quantile(q)
+        Return approximate quantile
+    to_dict()
+        Return serializable state
+
+    """
+
+    def __init__(self, alpha: float = 0.01):
+        """Initialize."""
+        self.alpha = alpha
+        self._gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self._gamma)
+        self.pos = {}
+        self.neg = {}
+        self.zero = 0
+
+    @property
+    def count(self) -> int:
+        """Return number of counted values."""
+        return sum(self.pos.values()) + sum(self.neg.values()) + self.zero
+
+    def add(self, value: float):
+        """Count value."""
+        if abs(value) < _MIN_VALUE:
+            self.zero += 1
+            return
+        idx = math.ceil(math.log(abs(value)) / self._log_gamma)
+        store = self.pos if value > 0 else self.neg
+        store[idx] = store.get(idx, 0) + 1
+
+    def merge(self, other: "QuantileSketch", sign: int = 1):
+        """Add counts of other sketch, remove them when sign is -1.
+
+        Raises
+        ------
+        ValueError
+            Sketches differ in accuracy
+
+        """
+        if other.alpha != self.alpha:
+            raise ValueError("Unable to merge sketches of differing alpha")
+        for store, o_store in [(self.pos, other.pos), (self.neg, other.neg)]:
+            for idx, num in o_store.items():
+                store[idx] = store.get(idx, 0) + sign * num
+                if store[idx] <= 0:
+                    del store[idx]
+        self.zero = max(self.zero + sign * other.zero, 0)
+
+    def quantile(self, q: float) -> float:
+        """Return approximate quantile q (0-1), NaN when empty."""
+        count = self.count
+        if not count:
+            return float("nan")
+        rank = q * (count - 1)
+        cum = 0
+        buckets = (
+            [(-1, x, self.neg[x]) for x in sorted(self.neg, reverse=True)]
+            + [(0, 0, self.zero)]
+            + [(1, x, self.pos[x]) for x in sorted(self.pos)]
+        )
+        for sign, idx, num in buckets:
+            cum += num
+            if cum > rank:
+                break
+        return sign * 2 * self._gamma**idx / (self._gamma + 1)
+
+    def to_dict(self) -> dict:
+        """Return serializable state."""
+        return {
+            "alpha": self.alpha,
+            "pos": {str(x): y for x, y in self.pos.items()},
+            "neg": {str(x): y for x, y in self.neg.items()},
+            "zero": self.zero,
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "QuantileSketch":
+        """Return sketch of serialized state."""
+        sketch = cls(state["alpha"])
+        sketch.pos = {int(x): y for x, y in state["pos"].items()}
+        sketch.neg = {int(x): y for x, y in state["neg"].items()}
+        sketch.zero = state["zero"]
+        return sketch
+
+
+class IqmStats:
+    """Running count, mean, variance, and quantiles of an IQM.
+
+    Mean and variance are updated via Welford's algorithm, and
+    states are combined via the parallel form of Chan et al., so
+    merging the states of subsets equals adding all values to one.
+
+    Methods
+    -------
+    add(value)
+        Add value
+    merge(other, sign=1)
+        Combine with (or with sign=-1, remove) state of other values
+    quantile(q)
+        Return approximate quantile
+    to_dict()
+        Return serializable state
+
+    """
+
+    def __init__(self, alpha: float = 0.01):
+        """Initialize."""
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sketch = QuantileSketch(alpha)
+
+    @property
+    def var(self) -> float:
+        """Return sample variance, NaN for fewer than two values."""
+        return self.m2 / (self.n - 1) if self.n > 1 else float("nan")
+
+    @property
+    def std(self) -> float:
+        """Return sample standard deviation."""
+        return math.sqrt(max(self.var, 0.0))
+
+    def add(self, value: float):
+        """Add value."""
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.sketch.add(value)
+
+    def merge(self, other: "IqmStats", sign: int = 1):
+        """Combine with state of other values, remove when sign is -1."""
+        self.sketch.merge(other.sketch, sign=sign)
+        if sign < 0:
+            num = self.n - other.n
+            if num <= 0:
+                self.n, self.mean, self.m2 = 0, 0.0, 0.0
+                return
+            mean = (self.n * self.mean - other.n * other.mean) / num
+            delta = other.mean - mean
+            self.m2 = max(
+                self.m2 - other.m2 - delta**2 * num * other.n / self.n, 0.0
+            )
+            self.n, self.mean = num, mean
+            return
+        num = self.n + other.n
+        if not other.n:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / num
+        self.m2 += other.m2 + delta**2 * self.n * other.n / num
+        self.n = num
+
+    def quantile(self, q: float) -> float:
+        """Return approximate quantile q (0-1)."""
+        return self.sketch.quantile(q)
+
+    def to_dict(self) -> dict:
+        """Return serializable state."""
+        return {
+            "n": self.n,
+            "mean": self.mean,
+            "m2": self.m2,
+            "sketch": self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "IqmStats":
+        """Return stats of serialized state."""
+        stats = cls()
+        stats.n, stats.mean, stats.m2 = state["n"], state["mean"], state["m2"]
+        stats.sketch = QuantileSketch.from_dict(state["sketch"])
+        return stats
+
+
+class RunningStats:
+    """Running statistics of IQMs for each modality.
+
+    Attributes
+    ----------
+    stats : dict
+        {modality: {iqm: IqmStats}}
+
+    Methods
+    -------
+    add(modality, iqm_dict)
+        Add IQMs of a run
+    merge(other, sign=1)
+        Combine with (or with sign=-1, remove) another state
+    flag(modality, iqm_dict, z_thresh=3.0, k=1.5, min_count=10)
+        Return IQMs of a run which are cohort outliers
+    summary()
+        Return count, mean, standard deviation, and quartiles
+    to_dict()
+        Return serializable state
+
+    Example
+    -------
+    run_stats = load("/hpc/group/labarlab/.../derivatives/mriqc")
+    run_stats.flag("bold", {"fd_mean": 0.6, "tsnr": 31.2})
+
+    """
+
+    def __init__(self):
+        """Initialize."""
+        self.stats = {}
+
+    def add(self, modality: str, iqm_dict: dict):
+        """Add IQMs of a run."""
+        mod_stats = self.stats.setdefault(modality, {})
+        for name, value in iqm_dict.items():
+            if math.isnan(value):
+                continue
+            mod_stats.setdefault(name, IqmStats()).add(value)
+
+    def merge(self, other: "RunningStats", sign: int = 1):
+        """Combine with state of other runs, remove when sign is -1."""
+        for modality, o_stats in other.stats.items():
+            mod_stats = self.stats.setdefault(modality, {})
+            for name, iqm_stats in o_stats.items():
+                mod_stats.setdefault(name, IqmStats()).merge(
+                    iqm_stats, sign=sign
+                )
+                if not mod_stats[name].n:
+                    del mod_stats[name]
+            if not mod_stats:
+                del self.stats[modality]
+
+    def flag(
+        self,
+        modality: str,
+        iqm_dict: dict,
+        z_thresh: float = 3.0,
+        k: float = 1.5,
+        min_count: int = 10,
+    ) -> dict:
+        """Return IQMs of a run which are cohort outliers.
+
+        An IQM is flagged when its z-score exceeds z_thresh, or when it
+        falls outside k IQRs of the approximate cohort quartiles.
+
+        Parameters
+        ----------
+        modality : str
+            Key of group.MODALITIES
+        iqm_dict : dict
+            {iqm: value} of run
+        z_thresh : float, optional
+            Absolute z-score above which IQMs are flagged
+        k : float, optional
+            IQR multiplier
+        min_count : int, optional
+            Minimum number of cohort runs, IQMs with fewer are not
+            flagged
+
+        Returns
+        -------
+        dict
+            {iqm: {"value", "z", "iqr"}}
+
+        """
+        out_dict = {}
+        for name, value in iqm_dict.items():
+            iqm_stats = self.stats.get(modality, {}).get(name)
+            if not iqm_stats or iqm_stats.n < min_count or math.isnan(value):
+                continue
+            std = iqm_stats.std
+            z_val = (value - iqm_stats.mean) / std if std else 0.0
+            q1, q3 = iqm_stats.quantile(0.25), iqm_stats.quantile(0.75)
+            iqr_out = value < q1 - k * (q3 - q1) or value > q3 + k * (q3 - q1)
+            if abs(z_val) > z_thresh or iqr_out:
+                out_dict[name] = {"value": value, "z": z_val, "iqr": iqr_out}
+        return out_dict
+
+    def summary(self) -> dict:
+        """Return count, mean, standard deviation, and quartiles.
+
+        Returns
+        -------
+        dict
+            {modality: {iqm: {"n", "mean", "std", "p25", "p50", "p75"}}}
+
+        """
+        return {
+            modality: {
+                name: {
+                    "n": x.n,
+                    "mean": x.mean,
+                    "std": x.std,
+                    **{f"p{q}": x.quantile(q / 100) for q in [25, 50, 75]},
+                }
+                for name, x in sorted(mod_stats.items())
+            }
+            for modality, mod_stats in self.stats.items()
+        }
+
+    def to_dict(self) -> dict:
+        """Return serializable state."""
+        return {
+            modality: {name: x.to_dict() for name, x in mod_stats.items()}
+            for modality, mod_stats in self.stats.items()
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "RunningStats":
+        """Return running statistics of serialized state."""
+        run_stats = cls()
+        run_stats.stats = {
+            modality: {
+                name: IqmStats.from_dict(x) for name, x in mod_state.items()
+            }
+            for modality, mod_state in state.items()
+        }
+        return run_stats
+
+
+def _read_json(json_path: str) -> dict:
+    """Return content of JSON file, empty when missing."""
+    if not os.path.exists(json_path):
+        return {}
+    with open(json_path) as jf:
+        return json.load(jf)
+
+
+def _write_json(json_path: str, content: dict):
+    """Atomically write JSON file."""
+    with open(json_path + ".tmp", "w") as jf:
+        json.dump(content, jf)
+    os.replace(json_path + ".tmp", json_path)
+
+
+def _digest(content: dict) -> str:
+    """Return hash of JSON-serializable content."""
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def load(proj_mriqc: Union[str, os.PathLike]) -> RunningStats:
+    """Return running statistics of project, see fold.
+
+    Parameters
+    ----------
+    proj_mriqc : str, os.PathLike
+        Location of project derivatives/mriqc
+
+    Returns
+    -------
+    RunningStats
+
+    """
+    state = _read_json(os.path.join(proj_mriqc, STATS_DIR, "state.json"))
+    return RunningStats.from_dict(state.get("stats", {}))
+
+
+def fold(
+    proj_mriqc: Union[str, os.PathLike],
+    subj: str,
+    sess: str,
+    z_thresh: float = 3.0,
+    k: float = 1.5,
+) -> dict:
+    """Fold IQMs of subject and session into running statistics.
+
+    The state of the project, held in <proj_mriqc>/.online_stats,
+    is updated under an exclusive lock so parallel array tasks may
+    fold concurrently. The contribution of each subject and session
+    is also kept, and removed before a rerun is folded, so reruns
+    do not count twice. Updates are staged as <subj>_<sess>.next.json
+    until the state is written, leaving the state consistent when a
+    job is killed mid-update.
+
+    Parameters
+    ----------
+    proj_mriqc : str, os.PathLike
+        Location of project derivatives/mriqc, holding participant
+        IQM files of subject and session
+    subj : str
+        BIDS subject identifier
+    sess : str
+        BIDS session identifier
+    z_thresh : float, optional
+        Absolute z-score above which IQMs are flagged
+    k : float, optional
+        IQR multiplier of outlier flags
+
+    Returns
+    -------
+    dict
+        {bids_name: {iqm: {"value", "z", "iqr"}}}, flagged IQMs of
+        runs relative to the updated cohort, see RunningStats.flag
+
+    """
+    # Build contribution of subject and session
+    part_stats = RunningStats()
+    run_iqms = {}
+    for modality, dtype in group.MODALITIES.items():
+        for json_path in sorted(
+            glob.glob(f"{proj_mriqc}/{subj}/{sess}/{dtype}/*_{modality}.json")
+        ):
+            with open(json_path, "rb") as jf:
+                iqm_dict = group.read_iqms(jf.read())
+            part_stats.add(modality, iqm_dict)
+            run_iqms[os.path.basename(json_path)[:-5]] = (modality, iqm_dict)
+    if not run_iqms:
+        return {}
+
+    key = f"{subj}_{sess}"
+    stats_dir = os.path.join(proj_mriqc, STATS_DIR)
+    part_path = os.path.join(stats_dir, "partials", f"{key}.json")
+    next_path = os.path.join(stats_dir, "partials", f"{key}.next.json")
+    part_state = part_stats.to_dict()
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    with cache.cache_lock(stats_dir):
+        state = _read_json(os.path.join(stats_dir, "state.json"))
+        members = state.get("members", {})
+        run_stats = RunningStats.from_dict(state.get("stats", {}))
+
+        # Complete or discard update interrupted after staging
+        if os.path.exists(next_path):
+            if members.get(key) == _digest(_read_json(next_path)):
+                os.replace(next_path, part_path)
+            else:
+                os.remove(next_path)
+
+        # Replace previous contribution of subject and session
+        if key in members and os.path.exists(part_path):
+            run_stats.merge(
+                RunningStats.from_dict(_read_json(part_path)), sign=-1
+            )
+        run_stats.merge(part_stats)
+        members[key] = _digest(part_state)
+        _write_json(next_path, part_state)
+        _write_json(
+            os.path.join(stats_dir, "state.json"),
+            {"members": members, "stats": run_stats.to_dict()},
+        )
+        os.replace(next_path, part_path)
+
+    out_dict = {}
+    for bids_name, (modality, iqm_dict) in run_iqms.items():
+        flags = run_stats.flag(modality, iqm_dict, z_thresh=z_thresh, k=k)
+        if flags:
+            out_dict[bids_name] = flags
+            print(f"\tOutlier IQMs of {bids_name} : {', '.join(flags)}")
+    return out_dict
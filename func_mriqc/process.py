@@ -1,41 +1,147 @@
 """Resources for conducting MRIQC.
 
 PushPull : sync relevant files with Keoki.
+batch_pull : download rawdata of many subjects from Keoki
+remote_done_index : index expected and completed MRIQC output on Keoki
+subj_todo : find subjects missing MRIQC output
+mriqc_units : find independent MRIQC units of subject rawdata
+mriqc_run : run MRIQC within the current job
+mriqc_scratch : run MRIQC on node-local scratch
 mriqc_subj : trigger MRIQC for single subject
 mriqc_group : trigger MRIQC group-level
 CleanDcc : remove files from work, group locations
+dir_size : sum size of files in directory
 
 """
 
 import os
+import sys
+import copy
 import glob
+import json
+import hashlib
+import time
+import shutil
+import textwrap
+import tempfile
 import subprocess
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Union
-from func_mriqc import submit
+from func_mriqc import submit, resources, cache, runner, group
 
 
-def _bash_subprocess(bash_cmd: str) -> Tuple:
-    """Submit BASH CMD as subprocess, retour stdout/err."""
-    h_sp = subprocess.Popen(bash_cmd, shell=True, stdout=subprocess.PIPE)
-    h_out, h_err = h_sp.communicate()
-    h_sp.wait()
-    return (h_out, h_err)
+# Supported PushPull transfer methods
+TRANSFER_MODES = ["rsync", "tar", "tar.gz"]
+
+# Container runtimes of group MRIQC
+GROUP_BACKENDS = ["docker", "singularity"]
+
+# Project locations on DCC and Keoki, overridden via environment when
+# run offline against local stand-ins (see benchmark).
+DCC_PROJ = os.environ.get(
+    "FMQ_DCC_PROJ",
+    "/hpc/group/labarlab/EmoRep/Exp2_Compute_Emotion/data_scanner_BIDS",
+)
+KEOKI_PROJ = os.environ.get(
+    "FMQ_KEOKI_PROJ",
+    "/mnt/keoki/experiments2/EmoRep/Exp2_Compute_Emotion/data_scanner_BIDS",
+)
+
+
+def _bash_subprocess(
+    bash_cmd: str, stage="cmd", log_path=None, timeout=None, capture=False
+) -> runner.CmdResult:
+    """Submit BASH CMD as subprocess, stream output to log_path.
+
+    Output is streamed to stdout of the current process when log_path
+    is not specified, stage names the command in telemetry records,
+    see runner.run_cmd.
+
+    """
+    return runner.run_cmd(
+        bash_cmd,
+        log_path=log_path,
+        timeout=timeout,
+        capture=capture,
+        stage=stage,
+    )
 
 
 class PushPull:
     """Get and send relevant files to Keoki.
 
+    All rsync and remote commands share a single multiplexed SSH
+    connection (ControlMaster), which is started in the background on
+    initialization. Close the connection via close() or by using the
+    object as a context manager.
+
+    Transfers in each direction use rsync by default, or alternatively
+    a single tar stream over SSH ("tar", or gzip compressed "tar.gz")
+    which avoids per-file overhead for trees of many small files. Tar
+    streams overwrite existing files rather than skipping newer ones.
+
     Methods
     -------
-    pull_data()
+    pull_data(staged_dir=None)
         Download rawdata to DCC
+    pull_batch(subj_list, staged_dir, num_streams=1)
+        Download rawdata of many subjects to DCC
     push_data(subj_final)
         Upload final subject directory to Keoki
+    pull_iqms(dst_dir)
+        Download participant IQM files of all subjects from Keoki
+    push_group(group_mriqc)
+        Upload group MRIQC reports to Keoki
+    verify_push(subj_final, max_workers=8)
+        Compare checksums of local output and Keoki copies
+    remote_index()
+        Index expected and completed MRIQC output on Keoki
+    for_subject(subj)
+        Return transfers of subject sharing the SSH connection
+    close()
+        Tear down multiplexed SSH connection
+
+    Example
+    -------
+    with PushPull("sub-ER0009", "ses-day2") as push_pull:
+        push_pull.pull_data()
 
     """
 
-    def __init__(self, subj: str, sess: str):
-        """Initialize."""
+    def __init__(
+        self,
+        subj: Union[str, None],
+        sess: str,
+        pull_mode: str = "rsync",
+        push_mode: str = "rsync",
+        log_dir: Union[str, os.PathLike] = None,
+    ):
+        """Initialize.
+
+        Parameters
+        ----------
+        subj : str, None
+            BIDS subject identifier, None when only used for
+            cohort transfers (pull_batch, pull_iqms, push_group)
+        sess : str
+            BIDS session identifier
+        pull_mode : str, optional
+            {"rsync", "tar", "tar.gz"}
+            Transfer method for downloading rawdata
+        push_mode : str, optional
+            {"rsync", "tar", "tar.gz"}
+            Transfer method for uploading MRIQC output
+        log_dir : str, os.PathLike, optional
+            Location for writing transfer logs of each stage, output
+            is written to stdout when not specified
+
+        """
+        for h_mode in [pull_mode, push_mode]:
+            if h_mode not in TRANSFER_MODES:
+                raise ValueError(f"Unexpected transfer mode : {h_mode}")
+        self._pull_mode = pull_mode
+        self._push_mode = push_mode
         try:
             self._rsa_key = os.environ["RSA_LS2"]
         except KeyError as e:
@@ -44,21 +150,114 @@ class PushPull:
             ) from e
         self._subj = subj
         self._sess = sess
-        self._dcc_path = (
-            "/hpc/group/labarlab/EmoRep/Exp2_Compute_Emotion/"
-            + "data_scanner_BIDS"
-        )
+        self._log_dir = log_dir
+        self._dcc_path = DCC_PROJ
 
         # Setup remote paths, addresses
-        self._keoki_path = (
-            "/mnt/keoki/experiments2/EmoRep/"
-            + "Exp2_Compute_Emotion/data_scanner_BIDS"
-        )
+        self._keoki_path = KEOKI_PROJ
         self._keoki_addr = f"{os.environ['USER']}@ccn-labarserv2.vm.duke.edu"
         self._keoki_full = f"{self._keoki_addr}:{self._keoki_path}"
 
-    def pull_data(self):
-        """Download session rawdata from keoki."""
+        # Setup multiplexed ssh, keep control socket path short
+        self._ctl_dir = tempfile.mkdtemp(prefix="fmq_")
+        ssh_opts = [
+            f"ssh -i {self._rsa_key}",
+            f"-o ControlPath={self._ctl_dir}/cm",
+            "-o ServerAliveInterval=60",
+            "-o ConnectionAttempts=3",
+        ]
+        self._ssh_cmd = " ".join(ssh_opts + ["-o ControlMaster=no"])
+        self._owner = True
+        try:
+            self._start_master(ssh_opts)
+        except BaseException:
+            shutil.rmtree(self._ctl_dir, ignore_errors=True)
+            raise
+
+    def for_subject(self, subj: str) -> "PushPull":
+        """Return transfers of subject sharing this SSH connection.
+
+        The returned object does not own the connection, its close()
+        leaves the connection open for other subjects.
+
+        Example
+        -------
+        with PushPull(None, "ses-day2") as cohort_pull:
+            cohort_pull.for_subject("sub-ER0009").pull_data()
+
+        """
+        subj_pull = copy.copy(self)
+        subj_pull._subj = subj
+        subj_pull._owner = False
+        return subj_pull
+
+    def _start_master(self, ssh_opts: list):
+        """Start multiplexed SSH connection in the background.
+
+        The master is detached from the output pipes of runner.run_cmd,
+        which would otherwise be held open until ControlPersist
+        expires. Commands connect directly when the master fails.
+
+        """
+        master_cmd = " ".join(
+            ssh_opts + ["-MNf", "-o ControlPersist=10m", self._keoki_addr]
+        )
+        h_err = (
+            open(os.path.join(self._log_dir, "ssh_master.log"), "a")
+            if self._log_dir
+            else subprocess.DEVNULL
+        )
+        try:
+            h_sp = subprocess.run(
+                master_cmd,
+                shell=True,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=h_err,
+                timeout=300,
+            )
+            if h_sp.returncode != 0:
+                print("\tFailed to start SSH master, connecting per command")
+        except subprocess.TimeoutExpired:
+            print("\tTimed out starting SSH master, connecting per command")
+        finally:
+            if self._log_dir:
+                h_err.close()
+
+    def __enter__(self):
+        """Enter context."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close multiplexed connection on context exit."""
+        self.close()
+
+    def close(self):
+        """Tear down multiplexed SSH connection, when owned."""
+        if not self._owner or not os.path.exists(self._ctl_dir):
+            return
+        if os.path.exists(f"{self._ctl_dir}/cm"):
+            _ = _bash_subprocess(
+                f"{self._ssh_cmd} -O exit {self._keoki_addr} 2>/dev/null",
+                stage="ssh_exit",
+            )
+        shutil.rmtree(self._ctl_dir, ignore_errors=True)
+
+    def pull_data(self, staged_dir=None):
+        """Download session rawdata from keoki.
+
+        Parameters
+        ----------
+        staged_dir : str, os.PathLike, optional
+            Location of markers written by pull_batch, skip
+            download when subject data was already staged
+
+        """
+        if staged_dir and os.path.exists(
+            os.path.join(staged_dir, f"{self._subj}_{self._sess}")
+        ):
+            print(f"\tRawdata already staged : {self._subj} {self._sess}")
+            return
         src = os.path.join(
             f"{self._keoki_full}",
             "rawdata",
@@ -68,36 +267,406 @@ class PushPull:
         dst = os.path.join(self._dcc_path, "rawdata", self._subj)
         if not os.path.exists(dst):
             os.makedirs(dst)
-        _, _ = self._submit_rsync(src, dst)
+        if self._pull_mode == "rsync":
+            self._submit_rsync(src, dst, "pull").check()
+            return
+
+        # Stream session directory as single tar archive
+        keoki_src = os.path.join(self._keoki_path, "rawdata", self._subj)
+        z_opt = "z" if self._pull_mode == "tar.gz" else ""
+        bash_cmd = f"""\
+            {self._ssh_cmd} \
+                {self._keoki_addr} \
+                "tar -C {keoki_src} -c{z_opt}f - {self._sess}" \
+            | tar -C {dst} -x{z_opt}f -
+        """
+        _bash_subprocess(
+            f"set -o pipefail; {bash_cmd}",
+            stage="pull",
+            log_path=self._log_path("pull"),
+        ).check()
+
+    def pull_batch(
+        self,
+        subj_list: list,
+        staged_dir: Union[str, os.PathLike],
+        num_streams: int = 1,
+    ):
+        """Download session rawdata of many subjects from keoki.
+
+        Subjects are split among num_streams files-from manifests, and
+        each manifest is transferred via a single rsync stream. Subjects
+        of successful streams are marked as staged in staged_dir.
+
+        Parameters
+        ----------
+        subj_list : list
+            BIDS subject identifiers
+        staged_dir : str, os.PathLike
+            Location for writing manifests and staged markers
+        num_streams : int, optional
+            Number of parallel rsync streams
+
+        """
+        if not os.path.exists(staged_dir):
+            os.makedirs(staged_dir)
+        stream_list = [subj_list[x::num_streams] for x in range(num_streams)]
+        stream_list = [x for x in stream_list if x]
+
+        with ThreadPoolExecutor(max_workers=len(stream_list)) as pool:
+            futures = [
+                pool.submit(self._pull_stream, idx, stream_subj, staged_dir)
+                for idx, stream_subj in enumerate(stream_list)
+            ]
+        for fut in futures:
+            fut.result()
+
+    def _pull_stream(self, idx: int, subj_list: list, staged_dir: str):
+        """Transfer rawdata of subjects via single rsync stream."""
+        manifest = os.path.join(staged_dir, f"manifest_{self._sess}_{idx}.txt")
+        with open(manifest, "w") as mf:
+            for subj in subj_list:
+                mf.write(f"rawdata/{subj}/{self._sess}/\n")
+        bash_cmd = f"""\
+            rsync \
+            -e "{self._ssh_cmd}" \
+            -rauv \
+            --files-from={manifest} \
+            {self._keoki_full}/ {self._dcc_path}/
+        """
+        res = _bash_subprocess(
+            bash_cmd,
+            stage="pull_batch",
+            log_path=self._log_path(f"pull_batch_{idx}"),
+        )
+        if not res.ok:
+            print(f"\tBatch pull failed for manifest {manifest}")
+            return
+        for subj in subj_list:
+            open(os.path.join(staged_dir, f"{subj}_{self._sess}"), "w").close()
+
+    def remote_index(self) -> dict:
+        """Index expected and completed MRIQC output of session on Keoki.
+
+        List rawdata images and MRIQC reports of the session via a
+        single remote command, a missing derivatives/mriqc on Keoki
+        counts as no completed output.
+
+        Returns
+        -------
+        dict
+            {subj: {"expected": set, "done": set}}, sets contain BIDS
+            file stems (e.g. sub-ER0009_ses-day2_T1w) of rawdata images
+            and of existing MRIQC reports
+
+        """
+        bash_cmd = f"""\
+            {self._ssh_cmd} \
+                {self._keoki_addr} \
+                "cd {self._keoki_path} && \
+                find rawdata -path '*/{self._sess}/*' \
+                    \\( -name '*_T1w.nii.gz' \
+                    -o -name '*_T2w.nii.gz' \
+                    -o -name '*_bold.nii.gz' \\) && \
+                {{ [ ! -d derivatives/mriqc ] || \
+                find derivatives/mriqc -maxdepth 1 \
+                    -name '*_{self._sess}_*.html'; }}"
+        """
+        res = _bash_subprocess(
+            bash_cmd,
+            stage="index",
+            log_path=self._log_path("index"),
+            capture=True,
+        )
+        res.check()
+
+        out_dict = {}
+        for line in res.stdout.decode("utf-8").splitlines():
+            file_name = os.path.basename(line.strip())
+            if not file_name.startswith("sub-"):
+                continue
+            subj = file_name.split("_")[0]
+            h_dict = out_dict.setdefault(
+                subj, {"expected": set(), "done": set()}
+            )
+            if file_name.endswith(".nii.gz"):
+                h_dict["expected"].add(file_name[:-7])
+            else:
+                h_dict["done"].add(file_name[:-5])
+        return out_dict
 
     def push_data(self, subj_final: Union[str, os.PathLike]):
-        """Push data to remote destination."""
-        dst = f"{self._keoki_addr}:{self._keoki_path}/derivatives/mriqc"
-        self._mk_dst()
-        _, _ = self._submit_rsync(subj_final, dst)
+        """Push data to remote destination.
 
-    def _mk_dst(self):
-        """Make remote destination."""
-        keoki_dst = os.path.join(
+        Parameters
+        ----------
+        subj_final : str, os.PathLike
+            Location of subject output, may contain a glob
+            pattern in the final path component
+
+        """
+        if self._push_mode == "rsync":
+            dst = f"{self._keoki_addr}:{self._keoki_path}/derivatives/mriqc"
+            self._mk_dst()
+            self._submit_rsync(subj_final, dst, "push").check()
+            return
+
+        # Make destination and extract in same round trip
+        keoki_mriqc = os.path.join(self._keoki_path, "derivatives/mriqc")
+        z_opt = "z" if self._push_mode == "tar.gz" else ""
+        bash_cmd = f"""\
+            cd {os.path.dirname(subj_final)} && \
+            tar -c{z_opt}f - {os.path.basename(subj_final)} \
+            | {self._ssh_cmd} \
+                {self._keoki_addr} \
+                "mkdir -p {self._keoki_dst()} && \
+                tar -C {keoki_mriqc} -x{z_opt}f -"
+        """
+        _bash_subprocess(
+            f"set -o pipefail; {bash_cmd}",
+            stage="push",
+            log_path=self._log_path("push"),
+        ).check()
+
+    def pull_iqms(self, dst_dir: Union[str, os.PathLike]):
+        """Download participant IQM files of all subjects from Keoki.
+
+        The IQM JSON files of derivatives/mriqc, along with the
+        rawdata dataset description, are streamed as a single tar
+        archive, which is all that group MRIQC requires.
+
+        Parameters
+        ----------
+        dst_dir : str, os.PathLike
+            Location of project copy, receives rawdata and
+            derivatives/mriqc
+
+        """
+        if not os.path.exists(dst_dir):
+            os.makedirs(dst_dir)
+        bash_cmd = f"""\
+            {self._ssh_cmd} \
+                {self._keoki_addr} \
+                "cd {self._keoki_path} && \
+                {{ find rawdata -maxdepth 1 -name dataset_description.json ; \
+                find derivatives/mriqc -path 'derivatives/mriqc/sub-*' \
+                    -name '*.json' ; }} \
+                | tar -c -T - -f -" \
+            | tar -C {dst_dir} -xf -
+        """
+        _bash_subprocess(
+            f"set -o pipefail; {bash_cmd}",
+            stage="pull_iqms",
+            log_path=self._log_path("pull_iqms"),
+        ).check()
+
+    def push_group(self, group_mriqc: Union[str, os.PathLike]):
+        """Upload group MRIQC reports to Keoki derivatives/mriqc.
+
+        Parameters
+        ----------
+        group_mriqc : str, os.PathLike
+            Location of derivatives/mriqc holding group_*.tsv and
+            group_*.html files
+
+        """
+        dst = f"{self._keoki_full}/derivatives/mriqc"
+        self._submit_rsync(f"{group_mriqc}/group_*", dst, "push_group").check()
+
+    def verify_push(
+        self, subj_final: Union[str, os.PathLike], max_workers: int = 8
+    ) -> dict:
+        """Compare checksums of local output and Keoki copies.
+
+        Local files are hashed by a thread pool while their Keoki
+        copies are hashed by a single SSH command, reading the file
+        list from stdin and hashing in parallel on Keoki.
+
+        Parameters
+        ----------
+        subj_final : str, os.PathLike
+            Location of subject output, may contain a glob
+            pattern in the final path component
+        max_workers : int, optional
+            Number of local hashing threads and remote processes
+
+        Returns
+        -------
+        dict
+            {"files": count, "bytes": total, "seconds": duration}
+
+        Raises
+        ------
+        RuntimeError
+            Failed remote hashing, or missing or mismatched Keoki
+            copies
+
+        """
+        start = time.monotonic()
+        proj_mriqc = os.path.dirname(subj_final)
+        file_list = []
+        for h_path in sorted(glob.glob(str(subj_final))):
+            file_list += _tree_files(h_path)[0]
+        rel_list = [os.path.relpath(x, proj_mriqc) for x in file_list]
+        if not rel_list:
+            raise RuntimeError(f"No output found for {subj_final}")
+
+        # Hash remote copies while hashing local files
+        keoki_mriqc = os.path.join(self._keoki_path, "derivatives/mriqc")
+        h_sp = subprocess.Popen(
+            f"{self._ssh_cmd} {self._keoki_addr} "
+            + f'"cd {keoki_mriqc} && xargs -0 -r -n 64 -P {max_workers} '
+            + 'md5sum --"',
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            remote_fut = pool.submit(
+                h_sp.communicate, "\0".join(rel_list).encode()
+            )
+            local_hash = dict(zip(rel_list, pool.map(_md5sum, file_list)))
+            h_out, h_err = remote_fut.result()
+        if h_sp.returncode != 0:
+            raise RuntimeError(
+                f"Failed to hash Keoki copies of {subj_final} "
+                + f"(exit {h_sp.returncode}) : "
+                + h_err.decode("utf-8", errors="replace").strip()[-2000:]
+            )
+        remote_hash = {}
+        for line in h_out.decode("utf-8").splitlines():
+            h_md5, _, h_rel = line.partition("  ")
+            remote_hash[h_rel] = h_md5
+
+        # Require manifest match
+        mismatch = [x for x in rel_list if remote_hash.get(x) != local_hash[x]]
+        if mismatch:
+            raise RuntimeError(
+                f"Keoki copies missing or mismatched for {len(mismatch)} "
+                + f"files, e.g. : {', '.join(mismatch[:5])}"
+            )
+        out_dict = {
+            "files": len(rel_list),
+            "bytes": sum(os.lstat(x).st_size for x in file_list),
+            "seconds": time.monotonic() - start,
+        }
+        print(
+            f"\tVerified {out_dict['files']} files on Keoki "
+            + f"in {out_dict['seconds']:.2f}s"
+        )
+        return out_dict
+
+    def _keoki_dst(self) -> str:
+        """Return remote subject, session output location."""
+        return os.path.join(
             self._keoki_path, "derivatives/mriqc", self._subj, self._sess
         )
+
+    def _mk_dst(self):
+        """Make remote destination."""
+        keoki_dst = self._keoki_dst()
         make_dst = f"""\
-            ssh \
-                -i {self._rsa_key} \
+            {self._ssh_cmd} \
                 {self._keoki_addr} \
                 " command ; bash -c 'mkdir -p {keoki_dst}'"
             """
-        _, _ = _bash_subprocess(make_dst)
+        _bash_subprocess(
+            make_dst, stage="mkdir", log_path=self._log_path("push")
+        ).check()
 
-    def _submit_rsync(self, src: str, dst: str) -> Tuple:
+    def _submit_rsync(
+        self, src: str, dst: str, stage: str
+    ) -> runner.CmdResult:
         """Execute rsync between DCC and labarserv2."""
         bash_cmd = f"""\
             rsync \
-            -e "ssh -i {self._rsa_key}" \
+            -e "{self._ssh_cmd}" \
             -rauv {src} {dst}
         """
-        h_out, h_err = _bash_subprocess(bash_cmd)
-        return (h_out, h_err)
+        return _bash_subprocess(
+            bash_cmd, stage=stage, log_path=self._log_path(stage)
+        )
+
+    def _log_path(self, stage: str) -> Union[str, None]:
+        """Return location of transfer log of stage."""
+        if not self._log_dir:
+            return None
+        subj = self._subj or "cohort"
+        return os.path.join(self._log_dir, f"{stage}_{subj}_{self._sess}.log")
+
+
+def batch_pull(
+    subj_list: list,
+    sess: str,
+    staged_dir: Union[str, os.PathLike],
+    num_streams: int = 1,
+):
+    """Download session rawdata of many subjects from Keoki.
+
+    Parameters
+    ----------
+    subj_list : list
+        BIDS subject identifiers
+    sess : str
+        BIDS session identifier
+    staged_dir : str, os.PathLike
+        Location for writing manifests and staged markers, checked
+        by PushPull.pull_data to avoid repeated downloads
+    num_streams : int, optional
+        Number of parallel rsync streams
+
+    """
+    with PushPull(None, sess) as push_pull:
+        push_pull.pull_batch(subj_list, staged_dir, num_streams=num_streams)
+
+
+def remote_done_index(sess: str) -> dict:
+    """Index expected and completed MRIQC output of session on Keoki.
+
+    Parameters
+    ----------
+    sess : str
+        BIDS session identifier
+
+    Returns
+    -------
+    dict
+        {subj: {"expected": set, "done": set}}, see
+        PushPull.remote_index
+
+    """
+    with PushPull(None, sess) as push_pull:
+        return push_pull.remote_index()
+
+
+def subj_todo(subj_list: list, done_index: dict) -> list:
+    """Return subjects with rawdata that lack MRIQC output.
+
+    Parameters
+    ----------
+    subj_list : list
+        BIDS subject identifiers
+    done_index : dict
+        Output of remote_done_index
+
+    Returns
+    -------
+    list
+        BIDS subject identifiers requiring MRIQC
+
+    """
+    todo_list = []
+    for subj in subj_list:
+        if subj not in done_index or not done_index[subj]["expected"]:
+            print(f"\tNo rawdata found on Keoki for {subj}, skipping")
+            continue
+        missing = done_index[subj]["expected"] - done_index[subj]["done"]
+        if not missing:
+            print(f"\tMRIQC output already exists for {subj}, skipping")
+            continue
+        todo_list.append(subj)
+    return todo_list
 
 
 def mriqc_subj(
@@ -111,11 +680,18 @@ def mriqc_subj(
     subj,
     sess,
     fd_thresh,
+    run_local=False,
+    split_modality=False,
+    resource_history=None,
+    scratch=False,
+    image_cache=False,
+    work_cache=False,
 ):
     """Generate and run mriqc command.
 
     Conduct MRIQC for a single subject via singularity. Write the bash
-    command and then submit work as a subprocess.
+    command and then submit work as a subprocess, either scheduled as
+    a child SBATCH job or executed within the current job.
 
     Parameters
     ----------
@@ -140,6 +716,27 @@ def mriqc_subj(
         BIDS session identifier
     fd_thresh : float
         Framewise displacement value
+    run_local : bool, optional
+        Execute singularity directly rather than scheduling
+        a child SBATCH job, used when already running within
+        an appropriately sized job
+    split_modality : bool, optional
+        Run MRIQC separately and concurrently for each anatomical
+        modality and each BOLD run (see mriqc_units)
+    resource_history : str, os.PathLike, optional
+        Location of usage history, right-size the child job request
+        via resources.ResourceModel and resubmit with escalated
+        resources on memory or time failures
+    scratch : bool, optional
+        Stage input and work directories on node-local scratch
+        (see mriqc_scratch), not supported with split_modality
+    image_cache : bool, optional
+        Run MRIQC from node-local copy of the singularity image
+        (see cache.cache_image)
+    work_cache : bool, optional
+        Keep MRIQC work directory in a persistent cache keyed by
+        subject, session, and MRIQC version (see cache.work_cache),
+        not supported with scratch
 
     Returns
     -------
@@ -148,19 +745,116 @@ def mriqc_subj(
         Location of subject mriqc output in work
 
     """
-    # Setup tmp dir
-    work_mriqc_tmp = os.path.join(work_mriqc, "tmp_work", subj, sess)
-    if not os.path.exists(work_mriqc_tmp):
-        os.makedirs(work_mriqc_tmp)
-
     # Avoid repeating work
     proj_mriqc_file = os.path.join(proj_mriqc, f"{subj}_{sess}_T1w.html")
     if os.path.exists(proj_mriqc_file):
         print(f"\tOutput file already exists: {proj_mriqc_file}.")
         return False
 
-    # Construct, schedule work
-    bash_cmd = f"""
+    # Setup tmp dir, reuse cached work of previous runs, leased for
+    # the whole run so other jobs do not evict it.
+    with ExitStack() as stack:
+        if work_cache:
+            work_mriqc_tmp = stack.enter_context(
+                cache.work_cache(work_mriqc, sing_mriqc, subj, sess)
+            )
+        else:
+            work_mriqc_tmp = os.path.join(work_mriqc, "tmp_work", subj, sess)
+        if not os.path.exists(work_mriqc_tmp):
+            os.makedirs(work_mriqc_tmp)
+
+        # Construct, schedule work
+        if split_modality:
+            _mriqc_split(
+                sing_mriqc,
+                work_deriv,
+                work_mriqc,
+                work_mriqc_tmp,
+                log_dir,
+                proj_research,
+                proj_raw,
+                subj,
+                sess,
+                fd_thresh,
+                run_local,
+                image_cache,
+            )
+        elif resource_history and not run_local:
+            _mriqc_right_sized(
+                sing_mriqc,
+                work_deriv,
+                work_mriqc,
+                work_mriqc_tmp,
+                log_dir,
+                proj_research,
+                proj_raw,
+                subj,
+                sess,
+                fd_thresh,
+                resource_history,
+                scratch,
+                image_cache,
+            )
+        elif run_local:
+            mriqc_run(
+                sing_mriqc,
+                work_deriv,
+                work_mriqc,
+                work_mriqc_tmp,
+                proj_research,
+                proj_raw,
+                subj,
+                sess,
+                fd_thresh,
+                scratch=scratch,
+                image_cache=image_cache,
+            )
+        else:
+            bash_cmd = _job_cmd(
+                sing_mriqc,
+                work_deriv,
+                work_mriqc,
+                work_mriqc_tmp,
+                log_dir,
+                proj_research,
+                proj_raw,
+                subj,
+                sess,
+                fd_thresh,
+                scratch=scratch,
+                image_cache=image_cache,
+            )
+            _ = submit.submit_sbatch(
+                bash_cmd,
+                f"{subj[7:]}s{sess[7:]}_mriqc",
+                log_dir,
+                num_hours=16,
+                num_cpus=10,
+                mem_gig=24,
+            )
+
+    # Check for output
+    check_file = os.path.join(work_mriqc, f"{subj}_{sess}_T1w.html")
+    if not os.path.exists(check_file):
+        raise FileNotFoundError(f"Failed to find {check_file}.")
+    return check_file
+
+
+def _mriqc_cmd(
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    work_mriqc_tmp,
+    proj_research,
+    proj_raw,
+    subj,
+    sess,
+    fd_thresh,
+    nprocs=8,
+    unit_opts="",
+):
+    """Return singularity command of participant MRIQC."""
+    return f"""
         singularity run \\
         --cleanenv \\
         --bind {work_deriv}:{work_deriv} \\
@@ -174,102 +868,746 @@ def mriqc_subj(
         participant \\
         --participant_label {subj[4:]} \\
         --session-id {sess[4:]} \\
+        {unit_opts} \\
         --work {work_mriqc_tmp} \\
         --no-sub \\
         --fd_thres {fd_thresh} \\
-        --nprocs 8
+        --nprocs {nprocs}
     """
-    _, _ = submit.submit_sbatch(
-        bash_cmd,
-        f"{subj[7:]}s{sess[7:]}_mriqc",
-        log_dir,
-        num_hours=16,
-        num_cpus=10,
-        mem_gig=24,
+
+
+def _mriqc_right_sized(
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    work_mriqc_tmp,
+    log_dir,
+    proj_research,
+    proj_raw,
+    subj,
+    sess,
+    fd_thresh,
+    resource_history,
+    scratch,
+    image_cache,
+):
+    """Run MRIQC as child job with predicted, escalating resources."""
+    model = resources.ResourceModel(resource_history)
+    feat = resources.subj_features(proj_raw, subj, sess)
+    req = model.predict(feat)
+    while req:
+        num_hours, num_cpus, mem_gig = req
+        bash_cmd = _job_cmd(
+            sing_mriqc,
+            work_deriv,
+            work_mriqc,
+            work_mriqc_tmp,
+            log_dir,
+            proj_research,
+            proj_raw,
+            subj,
+            sess,
+            fd_thresh,
+            nprocs=max(num_cpus - 1, 1),
+            scratch=scratch,
+            image_cache=image_cache,
+        )
+        job = submit.submit_job(
+            bash_cmd,
+            f"{subj[7:]}s{sess[7:]}_mriqc",
+            log_dir,
+            num_hours=num_hours,
+            num_cpus=num_cpus,
+            mem_gig=mem_gig,
+        )
+        submit.JobTracker([job], min_wait=30).wait_all()
+        try:
+            _ = model.record(job.job_id, feat, req)
+        except RuntimeError as e:
+            print(f"\tFailed to record usage of {job.job_id} : {e}")
+        if job.ok:
+            return
+        req = model.escalate(req, job.state)
+        if req:
+            print(f"\t{job.state} for {subj} {sess}, resubmitting : {req}")
+
+
+def _job_cmd(
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    work_mriqc_tmp,
+    log_dir,
+    proj_research,
+    proj_raw,
+    subj,
+    sess,
+    fd_thresh,
+    nprocs=8,
+    unit_opts="",
+    unit=None,
+    scratch=False,
+    image_cache=False,
+):
+    """Return bash command executed by MRIQC child job.
+
+    Scratch staging and image caching require python within the
+    child job, write a child script to log_dir and return its command.
+
+    """
+    if not scratch and not image_cache:
+        return _mriqc_cmd(
+            sing_mriqc,
+            work_deriv,
+            work_mriqc,
+            work_mriqc_tmp,
+            proj_research,
+            proj_raw,
+            subj,
+            sess,
+            fd_thresh,
+            nprocs=nprocs,
+            unit_opts=unit_opts,
+        )
+
+    child_cmd = f"""\
+        from func_mriqc import process
+
+
+        process.mriqc_run(
+            "{sing_mriqc}",
+            "{work_deriv}",
+            "{work_mriqc}",
+            "{work_mriqc_tmp}",
+            "{proj_research}",
+            "{proj_raw}",
+            "{subj}",
+            "{sess}",
+            {fd_thresh},
+            nprocs={nprocs},
+            unit_opts="{unit_opts}",
+            scratch={scratch},
+            image_cache={image_cache},
+        )
+
+    """
+    unit_str = f"_{unit}" if unit else ""
+    py_script = os.path.join(log_dir, f"run_child_{subj}_{sess}{unit_str}.py")
+    with open(py_script, "w") as ps:
+        ps.write(textwrap.dedent(child_cmd))
+    return f"{sys.executable} {py_script}"
+
+
+def mriqc_run(
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    work_mriqc_tmp,
+    proj_research,
+    proj_raw,
+    subj,
+    sess,
+    fd_thresh,
+    nprocs=8,
+    unit_opts="",
+    scratch=False,
+    image_cache=False,
+):
+    """Run MRIQC within the current job.
+
+    Parameters
+    ----------
+    sing_mriqc : path
+        Location of MRIQC singularity image
+    work_deriv : path
+        Location of work derivatives (required for binding)
+    work_mriqc : path
+        Location of work derivatives/mriqc
+    work_mriqc_tmp : path
+        Location of MRIQC work directory
+    proj_research : path
+        Location of group research bin, contains simg file
+    proj_raw : path
+        Location of project rawdir
+    subj : str
+        BIDS subject identifier
+    sess : str
+        BIDS session identifier
+    fd_thresh : float
+        Framewise displacement value
+    nprocs : int, optional
+        Number of MRIQC processes
+    unit_opts : str, optional
+        MRIQC options selecting modality or run
+    scratch : bool, optional
+        Stage input and work directories on node-local scratch
+        (see mriqc_scratch), ignored when unit_opts are specified
+    image_cache : bool, optional
+        Run MRIQC from node-local copy of the image
+        (see cache.cache_image)
+
+    """
+    if image_cache:
+        sing_mriqc = cache.cache_image(sing_mriqc)
+    if scratch and not unit_opts:
+        _ = mriqc_scratch(
+            sing_mriqc,
+            work_deriv,
+            work_mriqc,
+            work_mriqc_tmp,
+            proj_research,
+            proj_raw,
+            subj,
+            sess,
+            fd_thresh,
+            nprocs=nprocs,
+        )
+        return
+    bash_cmd = _mriqc_cmd(
+        sing_mriqc,
+        work_deriv,
+        work_mriqc,
+        work_mriqc_tmp,
+        proj_research,
+        proj_raw,
+        subj,
+        sess,
+        fd_thresh,
+        nprocs=nprocs,
+        unit_opts=unit_opts,
     )
+    print(f"Running:\n{bash_cmd}")
+    _ = _bash_subprocess(bash_cmd, stage="mriqc")
 
-    # Check for output
-    check_file = os.path.join(work_mriqc, f"{subj}_{sess}_T1w.html")
-    if not os.path.exists(check_file):
-        raise FileNotFoundError(f"Failed to find {check_file}.")
-    return check_file
 
+def mriqc_scratch(
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    work_mriqc_tmp,
+    proj_research,
+    proj_raw,
+    subj,
+    sess,
+    fd_thresh,
+    nprocs=8,
+    scratch_factor=10,
+):
+    """Run MRIQC with input and work directories on node-local scratch.
 
-def mriqc_group(proj_raw, proj_mriqc):
-    """Conduct group-level MRIQC via docker.
+    Copy subject rawdata to $TMPDIR, run MRIQC with input, output, and
+    work directories on scratch, and copy only the final derivatives to
+    work_mriqc. Falls back to the shared locations when scratch lacks
+    space for scratch_factor times the rawdata size. Bytes moved and
+    durations are appended to <work_mriqc>/scratch_stats.jsonl, where
+    time saved is estimated against the mean MRIQC duration of previous
+    runs on shared locations.
 
     Parameters
     ----------
+    sing_mriqc : path
+        Location of MRIQC singularity image
+    work_deriv : path
+        Location of work derivatives (required for binding)
+    work_mriqc : path
+        Location of work derivatives/mriqc
+    work_mriqc_tmp : path
+        Location of shared MRIQC work directory, used on fallback
+    proj_research : path
+        Location of group research bin, contains simg file
     proj_raw : path
-        Location of project rawdata
-    proj_mriqc : path
-        Location of project derivatives/mriqc
+        Location of project rawdir
+    subj : str
+        BIDS subject identifier
+    sess : str
+        BIDS session identifier
+    fd_thresh : float
+        Framewise displacement value
+    nprocs : int, optional
+        Number of MRIQC processes
+    scratch_factor : float, optional
+        Required scratch space relative to rawdata size
+
+    Returns
+    -------
+    dict
+        Staging statistics
+
+    """
+    scratch_root = os.environ.get("TMPDIR", tempfile.gettempdir())
+    subj_raw = os.path.join(proj_raw, subj, sess)
+    stats = {
+        "subj": subj,
+        "sess": sess,
+        "host": os.uname().nodename,
+        "bytes_in": dir_size(subj_raw),
+        "scratch_free": shutil.disk_usage(scratch_root).free,
+    }
+    stats["scratch"] = (
+        stats["scratch_free"] > stats["bytes_in"] * scratch_factor
+    )
+
+    # Fall back to shared locations
+    if not stats["scratch"]:
+        print(f"\tInsufficient scratch in {scratch_root}, using shared")
+        bash_cmd = _mriqc_cmd(
+            sing_mriqc,
+            work_deriv,
+            work_mriqc,
+            work_mriqc_tmp,
+            proj_research,
+            proj_raw,
+            subj,
+            sess,
+            fd_thresh,
+            nprocs=nprocs,
+        )
+        start = time.monotonic()
+        _ = _bash_subprocess(bash_cmd, stage="mriqc")
+        stats["mriqc_s"] = time.monotonic() - start
+        _write_scratch_stats(work_mriqc, stats)
+        return stats
+
+    # Stage rawdata, keeping BIDS dataset description
+    scr_dir = tempfile.mkdtemp(
+        prefix=f"mriqc_{subj}_{sess}_", dir=scratch_root
+    )
+    scr_raw = os.path.join(scr_dir, "rawdata")
+    scr_out = os.path.join(scr_dir, "out")
+    scr_work = os.path.join(scr_dir, "work")
+    try:
+        start = time.monotonic()
+        shutil.copytree(subj_raw, os.path.join(scr_raw, subj, sess))
+        raw_desc = os.path.join(proj_raw, "dataset_description.json")
+        if os.path.exists(raw_desc):
+            shutil.copy2(raw_desc, scr_raw)
+        os.makedirs(scr_out)
+        os.makedirs(scr_work)
+        stats["stage_in_s"] = time.monotonic() - start
+
+        # Run MRIQC on scratch
+        bash_cmd = _mriqc_cmd(
+            sing_mriqc,
+            scr_dir,
+            scr_out,
+            scr_work,
+            proj_research,
+            scr_raw,
+            subj,
+            sess,
+            fd_thresh,
+            nprocs=nprocs,
+        )
+        print(f"Running:\n{bash_cmd}")
+        start = time.monotonic()
+        _ = _bash_subprocess(bash_cmd, stage="mriqc")
+        stats["mriqc_s"] = time.monotonic() - start
+
+        # Copy final derivatives back
+        start = time.monotonic()
+        stats["bytes_out"] = dir_size(scr_out)
+        shutil.copytree(scr_out, work_mriqc, dirs_exist_ok=True)
+        stats["stage_out_s"] = time.monotonic() - start
+    finally:
+        shutil.rmtree(scr_dir, ignore_errors=True)
+
+    # Estimate time saved against runs on shared locations
+    shared_s = [
+        x["mriqc_s"]
+        for x in _read_scratch_stats(work_mriqc)
+        if not x["scratch"]
+    ]
+    if shared_s:
+        stats["time_saved_s"] = sum(shared_s) / len(shared_s) - (
+            stats["stage_in_s"] + stats["mriqc_s"] + stats["stage_out_s"]
+        )
+    _write_scratch_stats(work_mriqc, stats)
+    return stats
+
+
+def _read_scratch_stats(work_mriqc) -> list:
+    """Return records of scratch statistics."""
+    stats_path = os.path.join(work_mriqc, "scratch_stats.jsonl")
+    if not os.path.exists(stats_path):
+        return []
+    with open(stats_path) as sf:
+        return [json.loads(x) for x in sf if x.strip()]
+
+
+def _write_scratch_stats(work_mriqc, stats: dict):
+    """Append record of scratch statistics."""
+    stats_path = os.path.join(work_mriqc, "scratch_stats.jsonl")
+    with open(stats_path, "a") as sf:
+        sf.write(json.dumps(stats) + "\n")
+
+
+def mriqc_units(proj_raw, subj, sess):
+    """Find independent MRIQC units of subject rawdata.
+
+    Anatomical images of a modality form one unit, and each BOLD run
+    forms its own unit.
+
+    Parameters
+    ----------
+    proj_raw : str, os.PathLike
+        Location of project rawdir
+    subj : str
+        BIDS subject identifier
+    sess : str
+        BIDS session identifier
+
+    Returns
+    -------
+    dict
+        {unit_name: {"modality": str, "opts": str, "stems": list}},
+        opts contains MRIQC selection options and stems the BIDS
+        file stems of unit images
 
     """
-    # Write docker command
-    bash_cmd = f"""
+    out_dict = {}
+    subj_raw = os.path.join(proj_raw, subj, sess)
+    for anat in ["T1w", "T2w"]:
+        stems = sorted(
+            os.path.basename(x)[:-7]
+            for x in glob.glob(f"{subj_raw}/anat/*_{anat}.nii.gz")
+        )
+        if stems:
+            out_dict[anat] = {
+                "modality": anat,
+                "opts": f"-m {anat}",
+                "stems": stems,
+            }
+    for bold_path in sorted(glob.glob(f"{subj_raw}/func/*_bold.nii.gz")):
+        stem = os.path.basename(bold_path)[:-7]
+        ent_dict = dict(
+            x.split("-", 1) for x in stem.split("_")[:-1] if "-" in x
+        )
+        unit_opts = "-m bold"
+        if "task" in ent_dict:
+            unit_opts += f" --task-id {ent_dict['task']}"
+        if "run" in ent_dict:
+            unit_opts += f" --run-id {int(ent_dict['run'])}"
+        out_dict[stem.split(f"{sess}_")[-1]] = {
+            "modality": "bold",
+            "opts": unit_opts,
+            "stems": [stem],
+        }
+    return out_dict
+
+
+def _job_cpus() -> int:
+    """Return number of CPUs allocated to the current job."""
+    try:
+        return int(os.environ["SLURM_CPUS_PER_TASK"])
+    except (KeyError, ValueError):
+        return len(os.sched_getaffinity(0))
+
+
+def _mriqc_split(
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    work_mriqc_tmp,
+    log_dir,
+    proj_research,
+    proj_raw,
+    subj,
+    sess,
+    fd_thresh,
+    run_local,
+    image_cache,
+):
+    """Run MRIQC units of subject concurrently, verify all output."""
+    unit_dict = mriqc_units(proj_raw, subj, sess)
+    if not unit_dict:
+        raise FileNotFoundError(f"No rawdata found for {subj} {sess}")
+
+    # Construct command of each unit, using separate work dirs. Local
+    # units split the CPUs of the current job, child jobs are sized
+    # by MODALITY_RESOURCES.
+    if run_local and image_cache:
+        sing_mriqc = cache.cache_image(sing_mriqc)
+    if run_local:
+        job_cpus = _job_cpus()
+        unit_cpus = max(job_cpus // len(unit_dict), 1)
+        num_workers = min(len(unit_dict), max(job_cpus // unit_cpus, 1))
+    cmd_dict = {}
+    for unit, info in unit_dict.items():
+        n_procs = (
+            unit_cpus
+            if run_local
+            else max(submit.MODALITY_RESOURCES[info["modality"]][1] - 1, 1)
+        )
+        work_unit_tmp = os.path.join(work_mriqc_tmp, unit)
+        if not os.path.exists(work_unit_tmp):
+            os.makedirs(work_unit_tmp)
+        cmd_dict[unit] = _job_cmd(
+            sing_mriqc,
+            work_deriv,
+            work_mriqc,
+            work_unit_tmp,
+            log_dir,
+            proj_research,
+            proj_raw,
+            subj,
+            sess,
+            fd_thresh,
+            nprocs=n_procs,
+            unit_opts=info["opts"],
+            unit=unit,
+            image_cache=image_cache and not run_local,
+        )
+
+    # Run units concurrently, as subprocesses in current job
+    # or as right-sized child jobs.
+    if run_local:
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            _ = list(
+                pool.map(
+                    lambda x: _bash_subprocess(x, stage="mriqc"),
+                    cmd_dict.values(),
+                )
+            )
+    else:
+        job_list = []
+        for unit, bash_cmd in cmd_dict.items():
+            n_hours, n_cpus, n_gig = submit.MODALITY_RESOURCES[
+                unit_dict[unit]["modality"]
+            ]
+            job_list.append(
+                submit.submit_job(
+                    bash_cmd,
+                    f"{subj[7:]}s{sess[7:]}_{unit}",
+                    log_dir,
+                    num_hours=n_hours,
+                    num_cpus=n_cpus,
+                    mem_gig=n_gig,
+                )
+            )
+        submit.JobTracker(job_list, min_wait=30).wait_all()
+
+    # Merge completion of units
+    missing = [
+        stem
+        for info in unit_dict.values()
+        for stem in info["stems"]
+        if not os.path.exists(os.path.join(work_mriqc, f"{stem}.html"))
+    ]
+    if missing:
+        raise FileNotFoundError(
+            f"Failed to find MRIQC output for : {', '.join(missing)}"
+        )
+
+
+def _group_cmd(backend, proj_raw, proj_mriqc, modality=None, sing_mriqc=None):
+    """Return container command of group MRIQC."""
+    mod_opt = f"-m {modality}" if modality else ""
+    if backend == "docker":
+        return f"""
         docker run --rm \\
         -v {proj_raw}:/data:ro \\
         -v {proj_mriqc}:/out \\
         nipreps/mriqc:latest \\
             /data \\
             /out \\
-            group
+            group {mod_opt}
     """
 
-    # Run docker command as subprocess
-    print(f"Running:\n{bash_cmd}")
-    _, _ = _bash_subprocess(bash_cmd)
+    # Keep work of concurrent runs apart, defaults to working directory
+    return f"""
+        singularity run \\
+        --cleanenv \\
+        --bind {proj_raw}:/data:ro \\
+        --bind {proj_mriqc}:/out \\
+        {sing_mriqc} \\
+            /data \\
+            /out \\
+            group {mod_opt} \\
+            --work /out/.work_group_{modality or 'all'}
+    """
+
+
+def mriqc_group(
+    proj_raw,
+    proj_mriqc,
+    backend="docker",
+    parallel=False,
+    sing_mriqc=None,
+    log_dir=None,
+):
+    """Conduct group-level MRIQC via docker or singularity.
+
+    By default a single run reports all modalities. When parallel,
+    one run is conducted concurrently for each modality which has
+    participant IQM files (see group.MODALITIES), so the T1w and
+    BOLD reports do not wait on each other.
+
+    Parameters
+    ----------
+    proj_raw : path
+        Location of project rawdata
+    proj_mriqc : path
+        Location of project derivatives/mriqc
+    backend : str, optional
+        {"docker", "singularity"}
+        Container runtime
+    parallel : bool, optional
+        Run each modality concurrently
+    sing_mriqc : path, optional
+        Location of MRIQC singularity image, required for singularity
+    log_dir : path, optional
+        Location for writing a log of each run, output is written
+        to stdout when not specified
+
+    Raises
+    ------
+    ValueError
+        Unexpected backend, or missing singularity image
+    FileNotFoundError
+        Missing group reports
+
+    """
+    if backend not in GROUP_BACKENDS:
+        raise ValueError(f"Unexpected group backend : {backend}")
+    if backend == "singularity" and not sing_mriqc:
+        raise ValueError("Singularity backend requires sing_mriqc")
+
+    # Find modalities of participant IQM files
+    mod_list = [None]
+    if parallel:
+        mod_list = [
+            x
+            for x, y in group.MODALITIES.items()
+            if glob.glob(f"{proj_mriqc}/sub-*/ses-*/{y}/*_{x}.json")
+            or glob.glob(f"{proj_mriqc}/sub-*/{y}/*_{x}.json")
+        ]
+        if not mod_list:
+            raise FileNotFoundError(
+                f"Failed to find participant IQM files in {proj_mriqc}"
+            )
+
+    def _run(modality):
+        """Run group MRIQC of modality, or all when None."""
+        bash_cmd = _group_cmd(
+            backend, proj_raw, proj_mriqc, modality, sing_mriqc
+        )
+        print(f"Running:\n{bash_cmd}")
+        log_path = (
+            os.path.join(log_dir, f"mriqc_group_{modality or 'all'}.log")
+            if log_dir
+            else None
+        )
+        res = _bash_subprocess(
+            bash_cmd, stage="mriqc_group", log_path=log_path
+        )
+        if backend == "singularity":
+            shutil.rmtree(
+                os.path.join(proj_mriqc, f".work_group_{modality or 'all'}"),
+                ignore_errors=True,
+            )
+        return res
+
+    with ThreadPoolExecutor(max_workers=len(mod_list)) as pool:
+        _ = list(pool.map(_run, mod_list))
 
     # Check for output
     group_out = glob.glob(f"{proj_mriqc}/group*.html")
-    if not group_out:
+    missing = [
+        x
+        for x in mod_list
+        if x and not os.path.exists(f"{proj_mriqc}/group_{x}.html")
+    ]
+    if not group_out or missing:
         raise FileNotFoundError(
             f"Failed to find group*.html files in {proj_mriqc}"
+            + (f" for {', '.join(missing)}" if missing else "")
         )
 
 
 class CleanDcc:
     """Remove files from group and work locations.
 
+    Output is moved via atomic renames when work and project
+    derivatives share a filesystem, otherwise files are copied and
+    deleted by a bounded thread pool. All operations run in-process
+    and report bytes and time.
+
     Parameters
     ----------
     subj : str
         BIDS subject identifier
     proj_mriqc : str, os.PathLike
         Location of project derivatives/mriqc
+    max_workers : int, optional
+        Number of threads copying or deleting files
 
     Methods
     -------
-    clean_work(work_mriqc)
+    clean_work(work_mriqc, keep_work=False)
         Remove files from work location
     clean_group(proj_raw)
         Remove files from group rawdata
 
     """
 
-    def __init__(self, subj, proj_mriqc):
+    def __init__(self, subj, proj_mriqc, max_workers=8):
         """Initialize."""
         self._subj = subj
         self._proj_mriqc = proj_mriqc
+        self._max_workers = max_workers
 
-    def clean_work(self, work_mriqc):
-        """Remove files from work location.
+    def clean_work(self, work_mriqc, keep_work=False) -> dict:
+        """Move output to project derivatives, remove work files.
 
         Parameters
         ----------
         work_mriqc : str, os.PathLike
             Location of work derivatives/mriqc
+        keep_work : bool, optional
+            Keep MRIQC work directory, used with cache.work_cache
+
+        Returns
+        -------
+        dict
+            {operation: {"method", "bytes", "seconds"}}
 
         """
-        bash_cmd = f"""
-            cp -r {work_mriqc}/{self._subj}* {self._proj_mriqc}/ &&
-                rm -r {work_mriqc}/{self._subj}* &&
-                rm -r {work_mriqc}/tmp_work/{self._subj}
-        """
-        _, _ = _bash_subprocess(bash_cmd)
+        out_dict = {}
+        src_list = sorted(glob.glob(f"{work_mriqc}/{self._subj}*"))
+        if src_list:
+            same_fs = (
+                os.stat(work_mriqc).st_dev == os.stat(self._proj_mriqc).st_dev
+            )
+            start = time.monotonic()
+            move_bytes = sum(_tree_files(x)[2] for x in src_list)
+            for src in src_list:
+                dst = os.path.join(self._proj_mriqc, os.path.basename(src))
+                if same_fs:
+                    _rename_tree(src, dst)
+                else:
+                    self._copy_tree(src, dst)
+            if not same_fs:
+                _ = self._remove(src_list)
+            out_dict["move"] = {
+                "method": "rename" if same_fs else "copy",
+                "bytes": move_bytes,
+                "seconds": time.monotonic() - start,
+            }
+
+        if not keep_work:
+            start = time.monotonic()
+            rm_bytes = self._remove(
+                [os.path.join(work_mriqc, "tmp_work", self._subj)]
+            )
+            out_dict["remove_work"] = {
+                "method": "delete",
+                "bytes": rm_bytes,
+                "seconds": time.monotonic() - start,
+            }
+        self._report(out_dict)
+        return out_dict
 
-    def clean_group(self, proj_raw):
+    def clean_group(self, proj_raw) -> dict:
         """Remove files from group location.
 
         Paramters
@@ -277,8 +1615,137 @@ class CleanDcc:
         proj_raw : str, os.PathLike
             Location of project rawdir
 
+        Returns
+        -------
+        dict
+            {operation: {"method", "bytes", "seconds"}}
+
         """
-        cl_raw = f"rm -r {proj_raw}/{self._subj}"
-        cl_der = f"rm -r {self._proj_mriqc}/{self._subj}*"
-        for bash_cmd in [cl_raw, cl_der]:
-            _, _ = _bash_subprocess(bash_cmd)
+        out_dict = {}
+        for op, rm_list in [
+            ("remove_raw", [os.path.join(proj_raw, self._subj)]),
+            (
+                "remove_deriv",
+                glob.glob(f"{self._proj_mriqc}/{self._subj}*"),
+            ),
+        ]:
+            start = time.monotonic()
+            rm_bytes = self._remove(rm_list)
+            out_dict[op] = {
+                "method": "delete",
+                "bytes": rm_bytes,
+                "seconds": time.monotonic() - start,
+            }
+        self._report(out_dict)
+        return out_dict
+
+    def _copy_tree(self, src, dst):
+        """Copy file or directory, merging into existing dst."""
+        if not os.path.isdir(src):
+            shutil.copy2(src, dst)
+            return
+        file_list, _, _ = _tree_files(src)
+        for root, _, _ in os.walk(src):
+            os.makedirs(
+                os.path.join(dst, os.path.relpath(root, src)), exist_ok=True
+            )
+        with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            _ = list(
+                pool.map(
+                    lambda x: shutil.copy2(
+                        x, os.path.join(dst, os.path.relpath(x, src))
+                    ),
+                    file_list,
+                )
+            )
+
+    def _remove(self, path_list: list) -> int:
+        """Delete files and directories in parallel, return bytes."""
+        file_list = []
+        dir_list = []
+        total = 0
+        for h_path in path_list:
+            h_files, h_dirs, h_bytes = _tree_files(h_path)
+            file_list += h_files
+            dir_list += h_dirs
+            total += h_bytes
+        with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            _ = list(pool.map(_remove_file, file_list))
+        for h_dir in dir_list:
+            os.rmdir(h_dir)
+        return total
+
+    def _report(self, out_dict: dict):
+        """Print bytes and time of operations."""
+        for op, info in out_dict.items():
+            print(
+                f"\t{self._subj} {op} ({info['method']}) : "
+                + f"{info['bytes'] / 1024**2:.1f} MB "
+                + f"in {info['seconds']:.2f}s"
+            )
+
+
+def _tree_files(path) -> Tuple[list, list, int]:
+    """Return files, directories (deepest first), and bytes of path."""
+    if os.path.islink(path) or os.path.isfile(path):
+        return ([path], [], os.lstat(path).st_size)
+    if not os.path.isdir(path):
+        return ([], [], 0)
+    file_list = []
+    dir_list = []
+    total = 0
+    for root, dirs, files in os.walk(path, topdown=False):
+        for file_name in files + [
+            x for x in dirs if os.path.islink(os.path.join(root, x))
+        ]:
+            file_path = os.path.join(root, file_name)
+            file_list.append(file_path)
+            total += os.lstat(file_path).st_size
+        dir_list.append(root)
+    return (file_list, dir_list, total)
+
+
+def _md5sum(file_path, chunk_mb=8) -> str:
+    """Return MD5 hex digest of file."""
+    h_md5 = hashlib.md5()
+    with open(file_path, "rb") as hf:
+        while True:
+            chunk = hf.read(chunk_mb * 1024**2)
+            if not chunk:
+                break
+            h_md5.update(chunk)
+    return h_md5.hexdigest()
+
+
+def _remove_file(file_path):
+    """Remove file, ignoring files already removed."""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def _rename_tree(src, dst):
+    """Move src to dst via renames, merging into existing dst."""
+    if not os.path.lexists(dst):
+        os.rename(src, dst)
+    elif os.path.isdir(src) and not os.path.islink(src) and os.path.isdir(dst):
+        for name in os.listdir(src):
+            _rename_tree(os.path.join(src, name), os.path.join(dst, name))
+        os.rmdir(src)
+    else:
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            shutil.rmtree(dst)
+        os.replace(src, dst)
+
+
+def dir_size(dir_path: Union[str, os.PathLike]) -> int:
+    """Return total size (bytes) of files within directory."""
+    total = 0
+    for root, _, files in os.walk(dir_path):
+        for file_name in files:
+            try:
+                total += os.lstat(os.path.join(root, file_name)).st_size
+            except FileNotFoundError:
+                continue
+    return total
@@ -0,0 +1,267 @@
+"""Summarize throughput and bottlenecks of a MRIQC run.
+
+percentile : return percentile of sorted values
+summarize : build cohort summary from a run log directory
+format_summary : render cohort summary as text
+
+"""
+
+import os
+import re
+import glob
+import json
+import heapq
+import shutil
+import subprocess
+from datetime import datetime
+from typing import Union
+from func_mriqc import resources
+
+# Submission lines written to scheduler logs by sbatch
+_SUBMIT_RE = re.compile(r"Submitted batch job (\d+)")
+
+
+def percentile(sorted_vals: list, pct: float) -> float:
+    """Return percentile of sorted values, linearly interpolated."""
+    if not sorted_vals:
+        return float("nan")
+    pos = (len(sorted_vals) - 1) * pct / 100
+    low = int(pos)
+    high = min(low + 1, len(sorted_vals) - 1)
+    return sorted_vals[low] + (sorted_vals[high] - sorted_vals[low]) * (
+        pos - low
+    )
+
+
+def _read_telemetry(tel_path: str, job_ids: set, num_slow: int) -> dict:
+    """Stream telemetry records, return stage durations and workflows."""
+    stage_secs = {}
+    start = end = None
+    done_subj = set()
+    slow_heap = []
+    with open(tel_path) as tf:
+        for line in tf:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get("job_id"):
+                job_ids.add(str(rec["job_id"]))
+            if rec.get("event") != "stage":
+                continue
+            stage_secs.setdefault(rec["name"], []).append(rec["seconds"])
+            if rec["name"] != "workflow" or rec["status"] != "ok":
+                continue
+
+            # Completed subject workflows drive throughput
+            done_subj.add((rec.get("subj"), rec.get("sess")))
+            start = rec["start"] if start is None else min(start, rec["start"])
+            end = rec["end"] if end is None else max(end, rec["end"])
+            item = (rec["seconds"], f"{rec.get('subj')} {rec.get('sess')}")
+            if len(slow_heap) < num_slow:
+                heapq.heappush(slow_heap, item)
+            else:
+                heapq.heappushpop(slow_heap, item)
+    return {
+        "stage_secs": stage_secs,
+        "n_done": len(done_subj),
+        "span_h": (end - start) / 3600 if start is not None else 0.0,
+        "slowest": sorted(slow_heap, reverse=True),
+    }
+
+
+def _scan_logs(log_dir: str, job_ids: set) -> dict:
+    """Stream scheduler logs, collect job IDs and count failed jobs."""
+    n_out = n_err = 0
+    err_jobs = []
+    for out_log in glob.iglob(os.path.join(log_dir, "out_*.log")):
+        n_out += 1
+        with open(out_log, errors="replace") as lf:
+            for line in lf:
+                match = _SUBMIT_RE.search(line)
+                if match:
+                    job_ids.add(match.group(1))
+    for err_log in glob.iglob(os.path.join(log_dir, "err_*.log")):
+        n_err += 1
+        with open(err_log, errors="replace") as lf:
+            for line in lf:
+                if "Traceback" in line or "Error" in line:
+                    err_jobs.append(os.path.basename(err_log)[4:-4])
+                    break
+    jobs_tsv = os.path.join(log_dir, "submitted_jobs.tsv")
+    if os.path.exists(jobs_tsv):
+        with open(jobs_tsv) as jf:
+            for line in jf:
+                if line.strip():
+                    job_ids.add(line.split("\t")[0])
+    return {"n_out": n_out, "n_err": n_err, "err_jobs": sorted(err_jobs)}
+
+
+def _query_sacct(job_ids: set) -> dict:
+    """Return queue wait, run time, and core-hours of jobs via sacct."""
+    out_dict = {
+        "queue_h": [],
+        "run_h": [],
+        "core_h_alloc": 0.0,
+        "core_h_cpu": 0.0,
+        "core_h_req": 0.0,
+    }
+    id_list = sorted(job_ids)
+    while id_list:
+        chunk, id_list = id_list[:500], id_list[500:]
+        h_sp = subprocess.run(
+            "sacct -n -P -X -o JobID,Submit,Start,Elapsed,Timelimit,"
+            + "AllocCPUS,TotalCPU -j "
+            + ",".join(chunk),
+            shell=True,
+            capture_output=True,
+        )
+        for line in h_sp.stdout.decode("utf-8").splitlines():
+            fields = line.split("|")
+            if len(fields) < 7:
+                continue
+            _, submit, start, elapsed, limit, cpus, total_cpu = fields[:7]
+            try:
+                wait_h = (
+                    datetime.fromisoformat(start)
+                    - datetime.fromisoformat(submit)
+                ).total_seconds() / 3600
+            except ValueError:
+                continue
+            run_h = resources.parse_time(elapsed)
+            n_cpus = int(cpus or 0)
+            out_dict["queue_h"].append(wait_h)
+            out_dict["run_h"].append(run_h)
+            out_dict["core_h_alloc"] += run_h * n_cpus
+            out_dict["core_h_cpu"] += resources.parse_time(total_cpu)
+            out_dict["core_h_req"] += resources.parse_time(limit) * n_cpus
+    out_dict["queue_h"].sort()
+    out_dict["run_h"].sort()
+    return out_dict
+
+
+def summarize(
+    log_dir: Union[str, os.PathLike],
+    use_sacct: bool = True,
+    num_slow: int = 10,
+) -> dict:
+    """Build cohort summary from a run log directory.
+
+    Streams <log_dir>/telemetry.jsonl (see telemetry) and the
+    out_*/err_* scheduler logs line by line, so only durations and
+    job IDs are held in memory. Queue wait, run time, and core-hours
+    of jobs found in the logs are queried from sacct in batches.
+
+    Parameters
+    ----------
+    log_dir : str, os.PathLike
+        Location of run logs, e.g. /work/user/EmoRep/logs/mriqc_<time>
+    use_sacct : bool, optional
+        Query scheduler accounting, skipped when sacct is unavailable
+    num_slow : int, optional
+        Number of slowest subjects to report
+
+    Returns
+    -------
+    dict
+        Cohort summary, see format_summary
+
+    Example
+    -------
+    print(format_summary(summarize("/work/user/EmoRep/logs/mriqc_x")))
+
+    """
+    job_ids = set()
+    summ = {"log_dir": str(log_dir)}
+    tel_path = os.path.join(log_dir, "telemetry.jsonl")
+    tel = (
+        _read_telemetry(tel_path, job_ids, num_slow)
+        if os.path.exists(tel_path)
+        else {"stage_secs": {}, "n_done": 0, "span_h": 0.0, "slowest": []}
+    )
+    summ["subjects_done"] = tel["n_done"]
+    summ["subjects_per_hour"] = (
+        tel["n_done"] / tel["span_h"] if tel["span_h"] else None
+    )
+    summ["stages"] = {}
+    for name, secs in tel["stage_secs"].items():
+        secs.sort()
+        summ["stages"][name] = {
+            "n": len(secs),
+            **{f"p{x}": percentile(secs, x) for x in [50, 90, 99]},
+            "max": secs[-1],
+        }
+    summ["slowest"] = [
+        {"subject": x[1], "seconds": x[0]} for x in tel["slowest"]
+    ]
+    summ["logs"] = _scan_logs(log_dir, job_ids)
+
+    summ["jobs"] = None
+    if use_sacct and job_ids and shutil.which("sacct"):
+        acct = _query_sacct(job_ids)
+        summ["jobs"] = {
+            "n": len(acct["run_h"]),
+            **{
+                f"{key}_p{x}": percentile(acct[key], x)
+                for key in ["queue_h", "run_h"]
+                for x in [50, 90]
+            },
+            "queue_h_total": sum(acct["queue_h"]),
+            "run_h_total": sum(acct["run_h"]),
+            "core_h_alloc": acct["core_h_alloc"],
+            "core_h_cpu": acct["core_h_cpu"],
+            "core_h_req": acct["core_h_req"],
+        }
+    return summ
+
+
+def format_summary(summ: dict) -> str:
+    """Render cohort summary as text."""
+    rate = summ["subjects_per_hour"]
+    lines = [
+        f"MRIQC run : {summ['log_dir']}",
+        f"  Subjects completed : {summ['subjects_done']}",
+        "  Subjects per hour  : "
+        + (f"{rate:.2f}" if rate is not None else "n/a"),
+        "",
+        "Stage latency (minutes)",
+        f"  {'stage':10s} {'n':>6s} {'p50':>8s} {'p90':>8s} "
+        + f"{'p99':>8s} {'max':>8s}",
+    ]
+    for name, info in sorted(summ["stages"].items()):
+        lines.append(
+            f"  {name:10s} {info['n']:6d} "
+            + " ".join(
+                f"{info[x] / 60:8.1f}" for x in ["p50", "p90", "p99", "max"]
+            )
+        )
+
+    jobs = summ["jobs"]
+    lines += ["", "Scheduler"]
+    if jobs and jobs["n"]:
+        lines += [
+            f"  Jobs               : {jobs['n']}",
+            f"  Queue wait (h)     : p50 {jobs['queue_h_p50']:.2f}, "
+            + f"p90 {jobs['queue_h_p90']:.2f}, "
+            + f"total {jobs['queue_h_total']:.1f}",
+            f"  Run time (h)       : p50 {jobs['run_h_p50']:.2f}, "
+            + f"p90 {jobs['run_h_p90']:.2f}, "
+            + f"total {jobs['run_h_total']:.1f}",
+            f"  Core-hours         : {jobs['core_h_alloc']:.1f} allocated, "
+            + f"{jobs['core_h_cpu']:.1f} CPU, "
+            + f"{jobs['core_h_req']:.1f} requested",
+        ]
+    else:
+        lines.append("  No accounting data (sacct unavailable or no jobs)")
+    logs = summ["logs"]
+    lines.append(
+        f"  Logs               : {logs['n_out']} out, {logs['n_err']} err, "
+        + f"{len(logs['err_jobs'])} with errors"
+    )
+    for job_name in logs["err_jobs"][:10]:
+        lines.append(f"    {job_name}")
+
+    lines += ["", "Slowest subjects (hours)"]
+    for info in summ["slowest"]:
+        lines.append(f"  {info['subject']:24s} {info['seconds'] / 3600:6.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,289 @@
+"""Right-size MRIQC job requests from historical accounting data.
+
+nifti_volumes : read number of volumes from NIfTI header
+subj_features : count BOLD runs and volumes of subject rawdata
+parse_time : return hours of SLURM time
+ResourceModel : record job usage, predict and escalate requests
+
+"""
+
+import os
+import glob
+import gzip
+import json
+import math
+import struct
+from typing import Union
+from func_mriqc import runner
+
+
+def nifti_volumes(nii_path: Union[str, os.PathLike]) -> int:
+    """Return number of volumes of NIfTI-1 or NIfTI-2 image.
+
+    Only the header is read, supports gzipped images.
+
+    """
+    h_open = gzip.open if str(nii_path).endswith(".gz") else open
+    with h_open(nii_path, "rb") as nf:
+        hdr = nf.read(540)
+    for endian in ["<", ">"]:
+        (size_hdr,) = struct.unpack(f"{endian}i", hdr[:4])
+        if size_hdr == 348:
+            dims = struct.unpack(f"{endian}8h", hdr[40:56])
+            break
+        if size_hdr == 540:
+            dims = struct.unpack(f"{endian}8q", hdr[16:80])
+            break
+    else:
+        raise ValueError(f"Unrecognized NIfTI header : {nii_path}")
+    return int(dims[4]) if dims[0] >= 4 else 1
+
+
+def subj_features(
+    proj_raw: Union[str, os.PathLike], subj: str, sess: str
+) -> dict:
+    """Return features of subject rawdata which drive MRIQC resources.
+
+    Parameters
+    ----------
+    proj_raw : str, os.PathLike
+        Location of project rawdir
+    subj : str
+        BIDS subject identifier
+    sess : str
+        BIDS session identifier
+
+    Returns
+    -------
+    dict
+        {"n_bold": number of BOLD runs, "n_vols": total BOLD volumes}
+
+    """
+    bold_list = glob.glob(
+        os.path.join(proj_raw, subj, sess, "func", "*_bold.nii.gz")
+    )
+    return {
+        "n_bold": len(bold_list),
+        "n_vols": sum(nifti_volumes(x) for x in bold_list),
+    }
+
+
+def parse_time(time_str: str) -> float:
+    """Return hours of SLURM [D-][HH:]MM:SS[.mmm] time."""
+    if not time_str or time_str in ["Unknown", "INVALID"]:
+        return 0.0
+    days = 0
+    if "-" in time_str:
+        days, time_str = time_str.split("-", 1)
+    parts = [float(x) for x in time_str.split(":")]
+    while len(parts) < 3:
+        parts.insert(0, 0.0)
+    return int(days) * 24 + parts[0] + parts[1] / 60 + parts[2] / 3600
+
+
+def _parse_mem(mem_str: str) -> float:
+    """Return GB of SLURM memory, e.g. 123456K."""
+    if not mem_str:
+        return 0.0
+    units = {"K": 1024**-2, "M": 1024**-1, "G": 1.0, "T": 1024.0}
+    if mem_str[-1] in units:
+        return float(mem_str[:-1]) * units[mem_str[-1]]
+    return float(mem_str) / 1024**3
+
+
+class ResourceModel:
+    """Predict MRIQC job requests from usage of finished jobs.
+
+    Usage of each finished job (MaxRSS, elapsed time, CPU efficiency)
+    is queried from sacct and appended to a JSON lines history. Memory
+    and walltime are predicted via a linear fit on the number of BOLD
+    volumes of completed jobs, CPUs from the observed CPU efficiency,
+    and all predictions are inflated by a safety margin and clamped to
+    the default request. Jobs failing due to memory or time limits
+    are escalated.
+
+    Parameters
+    ----------
+    history_path : str, os.PathLike
+        Location of JSON lines usage history
+    margin : float, optional
+        Multiplicative safety margin of predictions
+    default_req : tuple, optional
+        (hours, cpus, GB) requested without history, and upper bound
+        of predictions
+
+    Methods
+    -------
+    predict(features)
+        Predict request for job with rawdata features
+    record(job_id, features, req)
+        Query job usage from sacct and append to history
+    escalate(req, state)
+        Increase request of job which ran out of memory or time
+
+    Example
+    -------
+    model = ResourceModel("/work/user/EmoRep/mriqc/resource_history.jsonl")
+    feat = subj_features(proj_raw, "sub-ER0009", "ses-day2")
+    num_hours, num_cpus, mem_gig = model.predict(feat)
+
+    """
+
+    def __init__(
+        self,
+        history_path: Union[str, os.PathLike],
+        margin: float = 1.3,
+        default_req: tuple = (16, 10, 24),
+    ):
+        """Initialize."""
+        self._history_path = history_path
+        self._margin = margin
+        self._default_req = default_req
+
+    def _load(self) -> list:
+        """Return usage records of completed jobs."""
+        if not os.path.exists(self._history_path):
+            return []
+        rec_list = []
+        with open(self._history_path) as hf:
+            for line in hf:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec.get("state") == "COMPLETED":
+                    rec_list.append(rec)
+        return rec_list
+
+    def _fit(self, rec_list: list, key: str, n_vols: int) -> float:
+        """Return linear prediction of key at n_vols.
+
+        The least squares fit is shifted up by its largest residual,
+        so no completed job would have been under-predicted.
+
+        """
+        x_list = [x["n_vols"] for x in rec_list]
+        y_list = [x[key] for x in rec_list]
+        if len(set(x_list)) < 2:
+            return max(y_list)
+        x_mean = sum(x_list) / len(x_list)
+        y_mean = sum(y_list) / len(y_list)
+        slope = sum(
+            (x - x_mean) * (y - y_mean) for x, y in zip(x_list, y_list)
+        ) / sum((x - x_mean) ** 2 for x in x_list)
+        slope = max(slope, 0)
+        resid = max(
+            y - (y_mean + slope * (x - x_mean)) for x, y in zip(x_list, y_list)
+        )
+        return y_mean + slope * (n_vols - x_mean) + resid
+
+    def predict(self, features: dict) -> tuple:
+        """Predict request for job with rawdata features.
+
+        Parameters
+        ----------
+        features : dict
+            Output of subj_features
+
+        Returns
+        -------
+        tuple
+            (num_hours, num_cpus, mem_gig)
+
+        """
+        rec_list = self._load()
+        if not rec_list:
+            return self._default_req
+        max_hours, max_cpus, max_gig = self._default_req
+        n_vols = features["n_vols"]
+        num_hours = self._fit(rec_list, "elapsed_h", n_vols) * self._margin
+        mem_gig = self._fit(rec_list, "max_rss_gb", n_vols) * self._margin
+        cpu_used = max(x["cpu_eff"] * x["alloc_cpus"] for x in rec_list)
+        num_cpus = cpu_used * self._margin
+        return (
+            min(max(math.ceil(num_hours), 1), max_hours),
+            min(max(math.ceil(num_cpus), 2), max_cpus),
+            min(max(math.ceil(mem_gig), 2), max_gig),
+        )
+
+    def escalate(self, req: tuple, state: str) -> tuple:
+        """Increase request of job which ran out of memory or time.
+
+        Parameters
+        ----------
+        req : tuple
+            (num_hours, num_cpus, mem_gig) of failed job
+        state : str
+            SLURM state of failed job
+
+        Returns
+        -------
+        tuple, None
+            Escalated (num_hours, num_cpus, mem_gig), None when the
+            failure is not due to resources or the request cannot grow
+
+        """
+        num_hours, num_cpus, mem_gig = req
+        max_hours, _, max_gig = self._default_req
+        if state == "OUT_OF_MEMORY" and mem_gig < 2 * max_gig:
+            return (num_hours, num_cpus, min(mem_gig * 2, 2 * max_gig))
+        if state == "TIMEOUT" and num_hours < 2 * max_hours:
+            return (min(num_hours * 2, 2 * max_hours), num_cpus, mem_gig)
+        return None
+
+    def record(self, job_id: str, features: dict, req: tuple) -> dict:
+        """Query job usage from sacct and append to history.
+
+        Parameters
+        ----------
+        job_id : str
+            SLURM job ID of finished job
+        features : dict
+            Output of subj_features
+        req : tuple
+            (num_hours, num_cpus, mem_gig) requested by job
+
+        Returns
+        -------
+        dict
+            Usage record
+
+        Raises
+        ------
+        RuntimeError
+            sacct query failed
+
+        """
+        res = runner.run_cmd(
+            "sacct -n -P -o JobID,State,Elapsed,TotalCPU,AllocCPUS,MaxRSS "
+            + f"-j {job_id}",
+            log_path=os.devnull,
+            capture=True,
+            check=True,
+            stage="sacct",
+        )
+
+        # Allocation line holds state and elapsed, steps hold MaxRSS
+        rec = {"job_id": job_id, **features, "req": list(req)}
+        max_rss = total_cpu = 0.0
+        for line in res.stdout.decode("utf-8").splitlines():
+            fields = line.split("|")
+            if len(fields) < 6:
+                continue
+            if fields[0] == job_id:
+                rec["state"] = fields[1].split(" ")[0]
+                rec["elapsed_h"] = parse_time(fields[2])
+                rec["alloc_cpus"] = int(fields[4] or 1)
+            max_rss = max(max_rss, _parse_mem(fields[5]))
+            total_cpu = max(total_cpu, parse_time(fields[3]))
+        if "state" not in rec:
+            return rec
+        rec["max_rss_gb"] = max_rss
+        rec["cpu_eff"] = (
+            total_cpu / (rec["elapsed_h"] * rec["alloc_cpus"])
+            if rec["elapsed_h"]
+            else 0.0
+        )
+        with open(self._history_path, "a") as hf:
+            hf.write(json.dumps(rec) + "\n")
+        return rec
@@ -0,0 +1,210 @@
+"""Run bash commands, streaming output to logs.
+
+CmdResult : outcome of a bash command
+run_cmd : run bash command, streaming timestamped output
+
+"""
+
+import os
+import sys
+import time
+import signal
+import threading
+import subprocess
+from collections import deque
+from datetime import datetime
+from typing import Union
+from func_mriqc import telemetry
+
+
+class CmdResult:
+    """Outcome of a bash command.
+
+    Attributes
+    ----------
+    bash_cmd : str
+        Executed command
+    returncode : int
+        Exit status, negative when killed by a signal
+    stdout : bytes, None
+        Complete stdout, only when captured
+    tail : list
+        Most recent lines of stdout and stderr
+    seconds : float
+        Duration of command
+    timed_out : bool
+        Whether command was killed after exceeding its timeout
+    max_rss_kb : int
+        Peak RSS (KB) of the command and its children
+    ok : bool
+        Whether command exited with 0 in time
+
+    Methods
+    -------
+    check()
+        Raise RuntimeError when command failed
+
+    """
+
+    def __init__(
+        self,
+        bash_cmd,
+        returncode,
+        stdout,
+        tail,
+        seconds,
+        timed_out,
+        max_rss_kb,
+    ):
+        """Initialize."""
+        self.bash_cmd = bash_cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.tail = tail
+        self.seconds = seconds
+        self.timed_out = timed_out
+        self.max_rss_kb = max_rss_kb
+
+    @property
+    def ok(self) -> bool:
+        """Return whether command succeeded."""
+        return self.returncode == 0 and not self.timed_out
+
+    def check(self):
+        """Raise RuntimeError when command failed, include recent output."""
+        if self.ok:
+            return
+        reason = "Timed out" if self.timed_out else f"Exit {self.returncode}"
+        raise RuntimeError(
+            f"{reason} : {' '.join(self.bash_cmd.split())}\n"
+            + "\n".join(self.tail)
+        )
+
+
+def run_cmd(
+    bash_cmd: str,
+    log_path: Union[str, os.PathLike] = None,
+    timeout: float = None,
+    capture: bool = False,
+    tail_lines: int = 200,
+    check: bool = False,
+    stage: str = "cmd",
+) -> CmdResult:
+    """Run bash command, streaming timestamped output.
+
+    Lines of stdout and stderr are written as they arrive, prefixed
+    by a timestamp and stream name, to log_path or to stdout of the
+    current process. Only the most recent tail_lines are held in
+    memory unless capture is requested. Duration, exit status, and
+    peak RSS are recorded via telemetry.record.
+
+    Parameters
+    ----------
+    bash_cmd : str
+        Bash syntax, work to execute
+    log_path : str, os.PathLike, optional
+        Location of log file, appended to
+    timeout : float, optional
+        Seconds after which the command and its children are killed
+    capture : bool, optional
+        Keep complete stdout, e.g. for parsing listings
+    tail_lines : int, optional
+        Number of recent lines kept for error reporting
+    check : bool, optional
+        Raise RuntimeError when command fails
+    stage : str, optional
+        Name of command in telemetry records
+
+    Returns
+    -------
+    CmdResult
+
+    Example
+    -------
+    res = run_cmd("rsync -rauv src dst", log_path="/tmp/pull.log")
+    res.check()
+
+    """
+    tail = deque(maxlen=tail_lines)
+    out_list = []
+    lock = threading.Lock()
+    h_log = open(log_path, "a") if log_path else sys.stdout
+
+    def _stream(pipe, name):
+        """Write lines of pipe to log and tail."""
+        for raw_line in iter(pipe.readline, b""):
+            if name == "stdout" and capture:
+                out_list.append(raw_line)
+            line = raw_line.decode("utf-8", errors="replace").rstrip("\n")
+            stamp = datetime.now().isoformat(timespec="seconds")
+            with lock:
+                tail.append(f"[{name}] {line}")
+                h_log.write(f"{stamp} [{name}] {line}\n")
+                h_log.flush()
+        pipe.close()
+
+    start = time.time()
+    h_sp = subprocess.Popen(
+        bash_cmd,
+        shell=True,
+        executable="/bin/bash",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    thread_list = [
+        threading.Thread(target=_stream, args=(h_sp.stdout, "stdout")),
+        threading.Thread(target=_stream, args=(h_sp.stderr, "stderr")),
+    ]
+    for h_thread in thread_list:
+        h_thread.start()
+
+    # Reap via wait4 for resource usage of the command tree
+    usage = {}
+
+    def _reap():
+        """Wait for command, keep exit status and usage."""
+        _, status, rusage = os.wait4(h_sp.pid, 0)
+        h_sp.returncode = os.waitstatus_to_exitcode(status)
+        usage["max_rss_kb"] = rusage.ru_maxrss
+
+    reap_thread = threading.Thread(target=_reap)
+    reap_thread.start()
+
+    # Kill process group on timeout, output of children closes pipes
+    reap_thread.join(timeout=timeout)
+    timed_out = reap_thread.is_alive()
+    if timed_out:
+        try:
+            os.killpg(h_sp.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        reap_thread.join()
+    for h_thread in thread_list:
+        h_thread.join()
+    if log_path:
+        h_log.close()
+
+    end = time.time()
+    res = CmdResult(
+        bash_cmd,
+        h_sp.returncode,
+        b"".join(out_list) if capture else None,
+        list(tail),
+        end - start,
+        timed_out,
+        usage.get("max_rss_kb"),
+    )
+    telemetry.record(
+        event="cmd",
+        name=stage,
+        start=start,
+        end=end,
+        seconds=res.seconds,
+        status=res.returncode,
+        timed_out=timed_out,
+        max_rss_kb=res.max_rss_kb,
+    )
+    if check:
+        res.check()
+    return res
@@ -2,12 +2,67 @@
 
 submit_sbatch : submit bash command to SLURM scheduler
 schedule_subj : schedule subject workflow with SLURM
+schedule_array : schedule cohort workflow as SLURM job array
+submit_script : schedule script without waiting, return job ID
+schedule_stages : schedule subject workflow as chained stage jobs
+schedule_batch_pull : schedule cohort rawdata download
+schedule_pipeline : schedule cohort workflow as chained pipeline jobs
+schedule_group : schedule group MRIQC after subject jobs end
+parse_job_id : return job ID of sbatch output
+submit_job : schedule bash command, return job handle immediately
+SbatchJob : handle of scheduled job
+JobTracker : poll states of many jobs via batched sacct calls
 
 """
 
+import os
+import re
 import sys
+import time
 import textwrap
-import subprocess
+from func_mriqc import runner, ledger
+
+
+# Walltime (hours), CPUs, and memory (GB) requested by each workflow
+# stage when scheduled as chained jobs, in order of execution.
+STAGE_RESOURCES = {
+    "pull": (2, 1, 2),
+    "mriqc": (16, 10, 24),
+    "clean": (1, 1, 2),
+    "push": (2, 1, 2),
+}
+
+# Walltime (hours), CPUs, and memory (GB) requested by each MRIQC
+# unit when modalities are split into concurrent jobs.
+MODALITY_RESOURCES = {
+    "T1w": (6, 4, 12),
+    "T2w": (6, 4, 12),
+    "bold": (8, 4, 12),
+}
+
+# Maximum walltime (hours) of scheduled jobs, i.e. the partition
+# MaxTime, cohorts are split across pipeline controllers to fit.
+MAX_WALLTIME = 72
+
+# Walltime (hours), CPUs, and memory (GB) requested by group MRIQC,
+# CPUs allow each modality to run concurrently.
+GROUP_RESOURCES = (4, 3, 12)
+
+# Line of sbatch output reporting the scheduled job
+_SUBMIT_RE = re.compile(r"Submitted batch job (\d+)")
+
+# SLURM job states which will not change further
+TERMINAL_STATES = [
+    "BOOT_FAIL",
+    "CANCELLED",
+    "COMPLETED",
+    "DEADLINE",
+    "FAILED",
+    "NODE_FAIL",
+    "OUT_OF_MEMORY",
+    "PREEMPTED",
+    "TIMEOUT",
+]
 
 
 def submit_sbatch(
@@ -20,6 +75,9 @@ def submit_sbatch(
 ):
     """Schedule child SBATCH job.
 
+    The job ID is appended to log_dir/submitted_jobs.tsv, see
+    report.summarize.
+
     Parameters
     ----------
     bash_cmd : str
@@ -37,9 +95,8 @@ def submit_sbatch(
 
     Returns
     -------
-    tuple
-        [0] = stdout of subprocess
-        [1] = stderr of subprocess
+    runner.CmdResult
+        Return code of the job and recent sbatch output
 
     """
     sbatch_cmd = f"""
@@ -54,10 +111,15 @@ def submit_sbatch(
         --wrap="{bash_cmd}"
     """
     print(f"Submitting SBATCH job:\n\t{sbatch_cmd}\n")
-    h_sp = subprocess.Popen(sbatch_cmd, shell=True, stdout=subprocess.PIPE)
-    h_out, h_err = h_sp.communicate()
-    h_sp.wait()
-    return (h_out, h_err)
+    res = runner.run_cmd(sbatch_cmd, stage="sbatch")
+
+    # Record job for reporting, sbatch prints its ID before waiting
+    for line in res.tail:
+        match = _SUBMIT_RE.search(line)
+        if match:
+            _record_job(log_dir, match.group(1), job_name)
+            break
+    return res
 
 
 def schedule_subj(
@@ -71,6 +133,8 @@ def schedule_subj(
     subj,
     sess,
     fd_thresh,
+    dependency=None,
+    wf_kwargs=None,
 ):
     """Schedule Parent SBATCH job.
 
@@ -99,6 +163,10 @@ def schedule_subj(
         BIDS session identifier
     fd_thresh : float
         Framewise displacement value
+    dependency : str, optional
+        SLURM dependency specification, e.g. "afterany:1234"
+    wf_kwargs : dict, optional
+        Additional keyword arguments of the workflow
 
     Returns
     -------
@@ -106,6 +174,11 @@ def schedule_subj(
         [0] = stdout of sbatch submit
         [1] = stderr of sbatch submit
 
+    Raises
+    ------
+    RuntimeError
+        sbatch failed
+
     Notes
     -----
     Writes parent python script to log_dir
@@ -134,6 +207,7 @@ def schedule_subj(
             "{subj}",
             "{sess}",
             {fd_thresh},
+            **{wf_kwargs or {}},
         )
 
     """
@@ -143,11 +217,975 @@ def schedule_subj(
         ps.write(sbatch_cmd)
 
     # Execute script
-    h_sp = subprocess.Popen(
-        f"sbatch {py_script}",
-        shell=True,
-        stdout=subprocess.PIPE,
-    )
-    h_out, h_err = h_sp.communicate()
+    h_out, h_err = _sbatch(f"sbatch {_dependency_opt(dependency)} {py_script}")
     print(f"{h_out.decode('utf-8')}\tfor {subj} {sess}")
+    _record_job(log_dir, h_out.decode("utf-8"), f"{subj}_{sess}")
+    _record_submitted(work_mriqc, log_dir, [subj], sess, [parse_job_id(h_out)])
+    return (h_out, h_err)
+
+
+def schedule_array(
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    log_dir,
+    proj_research,
+    proj_raw,
+    proj_mriqc,
+    subj_list,
+    sess,
+    fd_thresh,
+    array_limit=10,
+    dependency=None,
+    wf_kwargs=None,
+):
+    """Schedule cohort as a single parent SBATCH job array.
+
+    Write one parent script for all subjects and schedule it as a job
+    array, each array task resolves its subject from SLURM_ARRAY_TASK_ID
+    and runs the subject workflow.
+
+    Parameters
+    ----------
+    sing_mriqc : path
+        Location of MRIQC singularity image
+    work_deriv : path
+        Location of work derivatives (required for binding)
+    work_mriqc : path
+        Location of work derivatives/mriqc
+    log_dir : path
+        Location of work log directory
+    proj_research : path
+        Location of group research bin, contains simg file
+        e.g. /hpc/group/labarlab/research_bin
+    proj_raw : path
+        Location of project rawdir
+    proj_mriqc : path
+        Location of project derivatives/mriqc
+    subj_list : list
+        BIDS subject identifiers
+    sess : str
+        BIDS session identifier
+    fd_thresh : float
+        Framewise displacement value
+    array_limit : int
+        Maximum number of simultaneously running array tasks
+    dependency : str, optional
+        SLURM dependency specification, e.g. "afterany:1234"
+    wf_kwargs : dict, optional
+        Additional keyword arguments of the workflow
+
+    Returns
+    -------
+    tuple
+        [0] = stdout of sbatch submit
+        [1] = stderr of sbatch submit
+
+    Raises
+    ------
+    RuntimeError
+        sbatch failed
+
+    Notes
+    -----
+    Writes parent python script to log_dir
+
+    """
+    # Write parent python script
+    sbatch_cmd = f"""\
+        #!/bin/env {sys.executable}
+
+        #SBATCH --job-name=arr{sess[7:]}
+        #SBATCH --output={log_dir}/par_%A_%a.txt
+        #SBATCH --time=10:00:00
+        #SBATCH --mem=6G
+        #SBATCH --array=0-{len(subj_list) - 1}%{array_limit}
+
+        import os
+        from func_mriqc import workflows
+
+
+        subj_list = {subj_list}
+        subj = subj_list[int(os.environ["SLURM_ARRAY_TASK_ID"])]
+
+        workflows.wf_mriqc_subj(
+            "{sing_mriqc}",
+            "{work_deriv}",
+            "{work_mriqc}",
+            "{log_dir}",
+            "{proj_research}",
+            "{proj_raw}",
+            "{proj_mriqc}",
+            subj,
+            "{sess}",
+            {fd_thresh},
+            **{wf_kwargs or {}},
+        )
+
+    """
+    sbatch_cmd = textwrap.dedent(sbatch_cmd)
+    py_script = f"{log_dir}/run_mriqc_array_{sess}.py"
+    with open(py_script, "w") as ps:
+        ps.write(sbatch_cmd)
+
+    # Execute script
+    h_out, h_err = _sbatch(f"sbatch {_dependency_opt(dependency)} {py_script}")
+    print(f"{h_out.decode('utf-8')}\tfor {len(subj_list)} subjects {sess}")
+    _record_job(log_dir, h_out.decode("utf-8"), f"array_{sess}")
+    array_id = parse_job_id(h_out)
+    _record_submitted(
+        work_mriqc,
+        log_dir,
+        subj_list,
+        sess,
+        [
+            f"{array_id}_{x}" if array_id else None
+            for x in range(len(subj_list))
+        ],
+    )
     return (h_out, h_err)
+
+
+def _sbatch(sbatch_cmd):
+    """Run sbatch, return stdout and stderr, raise RuntimeError on failure."""
+    res = runner.run_cmd(sbatch_cmd, capture=True, check=True, stage="sbatch")
+    h_err = "\n".join(
+        x.split("] ", 1)[1] for x in res.tail if x.startswith("[stderr] ")
+    )
+    return (res.stdout, h_err.encode("utf-8"))
+
+
+def _dependency_opt(dependency):
+    """Return sbatch option of dependency, cancel if never satisfied."""
+    if not dependency:
+        return ""
+    return f"--dependency={dependency} --kill-on-invalid-dep=yes"
+
+
+def submit_script(
+    py_script,
+    job_name,
+    log_dir,
+    num_hours=1,
+    num_cpus=1,
+    mem_gig=1,
+    script_args=None,
+    dependency=None,
+    array=None,
+):
+    """Schedule script without waiting for completion.
+
+    Parameters
+    ----------
+    py_script : str, os.PathLike
+        Location of executable script to schedule
+    job_name : str
+        Name for scheduler
+    log_dir : Path
+        Location of output dir for writing logs
+    num_hours : int
+        Walltime to schedule
+    num_cpus : int
+        Number of CPUs required by job
+    mem_gig : int
+        Job RAM requirement (GB)
+    script_args : list, optional
+        Arguments passed to py_script
+    dependency : str, optional
+        SLURM dependency specification, e.g. "afterok:1234"
+    array : str, optional
+        SLURM array specification, e.g. "0-99%10"
+
+    Returns
+    -------
+    str
+        Scheduled job ID
+
+    Raises
+    ------
+    RuntimeError
+        sbatch failed or did not return a job ID
+
+    """
+    log_name = f"{job_name}_%a" if array else job_name
+    sbatch_cmd = [
+        "sbatch",
+        "--parsable",
+        f"-J {job_name}",
+        f"-t {num_hours}:00:00",
+        f"--cpus-per-task={num_cpus}",
+        f"--mem={mem_gig}G",
+        f"-o {log_dir}/out_{log_name}.log",
+        f"-e {log_dir}/err_{log_name}.log",
+    ]
+    if array:
+        sbatch_cmd.append(f"--array={array}")
+    if dependency:
+        sbatch_cmd.append(_dependency_opt(dependency))
+    sbatch_cmd.append(py_script)
+    if script_args:
+        sbatch_cmd += [str(x) for x in script_args]
+    sbatch_cmd = " ".join(sbatch_cmd)
+
+    print(f"Submitting SBATCH job:\n\t{sbatch_cmd}\n")
+    h_out, _ = _sbatch(sbatch_cmd)
+    job_id = h_out.decode("utf-8").strip().split(";")[0]
+    if not job_id:
+        raise RuntimeError(f"Failed to schedule {job_name}")
+    _record_job(log_dir, job_id, job_name)
+    return job_id
+
+
+def parse_job_id(sbatch_out):
+    """Return job ID of sbatch output, empty when missing."""
+    if isinstance(sbatch_out, bytes):
+        sbatch_out = sbatch_out.decode("utf-8")
+    return "".join(x for x in sbatch_out.split(";")[0] if x.isdigit())
+
+
+def _record_job(log_dir, sbatch_out, job_name):
+    """Append scheduled job ID and name to log_dir/submitted_jobs.tsv."""
+    job_id = parse_job_id(sbatch_out)
+    if not job_id:
+        return
+    with open(os.path.join(log_dir, "submitted_jobs.tsv"), "a") as jf:
+        jf.write(f"{job_id}\t{job_name}\n")
+
+
+def _record_submitted(work_mriqc, log_dir, subj_list, sess, job_ids):
+    """Record scheduled subjects in the ledger of work_mriqc."""
+    ledger.open_ledger(work_mriqc).record_many(
+        [
+            {
+                "subj": subj,
+                "sess": sess,
+                "state": "submitted",
+                "job_id": job_id,
+                "log_dir": log_dir,
+            }
+            for subj, job_id in zip(subj_list, job_ids)
+            if job_id
+        ]
+    )
+
+
+def schedule_stages(
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    log_dir,
+    proj_research,
+    proj_raw,
+    proj_mriqc,
+    subj_list,
+    sess,
+    fd_thresh,
+    array_limit=None,
+    dependency=None,
+    wf_kwargs=None,
+):
+    """Schedule subject workflows as dependency-chained stage jobs.
+
+    Write a stage script and schedule the pull, mriqc, clean, and push
+    stages of each subject as separate jobs, linked via afterok
+    dependencies. Each stage job requests only the resources it uses
+    and no parent job waits on the others. When array_limit is
+    specified each stage is scheduled as a job array covering all
+    subjects, linked via aftercorr dependencies.
+
+    Parameters
+    ----------
+    sing_mriqc : path
+        Location of MRIQC singularity image
+    work_deriv : path
+        Location of work derivatives (required for binding)
+    work_mriqc : path
+        Location of work derivatives/mriqc
+    log_dir : path
+        Location of work log directory
+    proj_research : path
+        Location of group research bin, contains simg file
+        e.g. /hpc/group/labarlab/research_bin
+    proj_raw : path
+        Location of project rawdir
+    proj_mriqc : path
+        Location of project derivatives/mriqc
+    subj_list : list
+        BIDS subject identifiers
+    sess : str
+        BIDS session identifier
+    fd_thresh : float
+        Framewise displacement value
+    array_limit : int, optional
+        Schedule stages as job arrays, with maximum number
+        of simultaneously running array tasks
+    dependency : str, optional
+        SLURM dependency specification of the first stage,
+        e.g. "afterany:1234"
+    wf_kwargs : dict, optional
+        Additional keyword arguments of the workflow
+
+    Returns
+    -------
+    dict
+        {subj: {stage: job_id}}, array job IDs are formatted
+        as <array_id>_<task_id>
+
+    Notes
+    -----
+    Writes stage python script to log_dir
+
+    """
+    # Write stage python script, subject is resolved from the array
+    # task ID or the second script argument.
+    sbatch_cmd = f"""\
+        #!/bin/env {sys.executable}
+
+        import os
+        import sys
+        from func_mriqc import workflows
+
+
+        subj_list = {subj_list}
+        if len(sys.argv) > 2:
+            subj = subj_list[int(sys.argv[2])]
+        else:
+            subj = subj_list[int(os.environ["SLURM_ARRAY_TASK_ID"])]
+
+        workflows.wf_mriqc_stage(
+            sys.argv[1],
+            "{sing_mriqc}",
+            "{work_deriv}",
+            "{work_mriqc}",
+            "{log_dir}",
+            "{proj_research}",
+            "{proj_raw}",
+            "{proj_mriqc}",
+            subj,
+            "{sess}",
+            {fd_thresh},
+            **{wf_kwargs or {}},
+        )
+
+    """
+    sbatch_cmd = textwrap.dedent(sbatch_cmd)
+    py_script = f"{log_dir}/run_mriqc_stages_{sess}.py"
+    with open(py_script, "w") as ps:
+        ps.write(sbatch_cmd)
+    os.chmod(py_script, 0o755)
+
+    # Schedule stages as arrays, link tasks by index
+    job_dict = {x: {} for x in subj_list}
+    if array_limit:
+        prev_id = None
+        for stage, (n_hours, n_cpus, n_gig) in STAGE_RESOURCES.items():
+            prev_id = submit_script(
+                py_script,
+                f"{stage}s{sess[7:]}",
+                log_dir,
+                num_hours=n_hours,
+                num_cpus=n_cpus,
+                mem_gig=n_gig,
+                script_args=[stage],
+                dependency=f"aftercorr:{prev_id}" if prev_id else dependency,
+                array=f"0-{len(subj_list) - 1}%{array_limit}",
+            )
+            for idx, subj in enumerate(subj_list):
+                job_dict[subj][stage] = f"{prev_id}_{idx}"
+        _record_submitted(
+            work_mriqc,
+            log_dir,
+            subj_list,
+            sess,
+            [job_dict[x]["pull"] for x in subj_list],
+        )
+        return job_dict
+
+    # Schedule stages for each subject
+    for idx, subj in enumerate(subj_list):
+        prev_id = None
+        for stage, (n_hours, n_cpus, n_gig) in STAGE_RESOURCES.items():
+            prev_id = submit_script(
+                py_script,
+                f"{stage}{subj[7:]}s{sess[7:]}",
+                log_dir,
+                num_hours=n_hours,
+                num_cpus=n_cpus,
+                mem_gig=n_gig,
+                script_args=[stage, idx],
+                dependency=f"afterok:{prev_id}" if prev_id else dependency,
+            )
+            job_dict[subj][stage] = prev_id
+        print(f"\tScheduled stages for {subj} {sess}")
+    _record_submitted(
+        work_mriqc,
+        log_dir,
+        subj_list,
+        sess,
+        [job_dict[x]["pull"] for x in subj_list],
+    )
+    return job_dict
+
+
+def schedule_batch_pull(log_dir, subj_list, sess, num_streams=2):
+    """Schedule single job to download rawdata of all subjects.
+
+    Data of subjects pulled successfully are marked in
+    <log_dir>/staged, allowing subject workflows scheduled
+    with a dependency on this job to skip their own download.
+
+    Parameters
+    ----------
+    log_dir : path
+        Location of work log directory
+    subj_list : list
+        BIDS subject identifiers
+    sess : str
+        BIDS session identifier
+    num_streams : int, optional
+        Number of parallel rsync streams
+
+    Returns
+    -------
+    str
+        Scheduled job ID
+
+    Notes
+    -----
+    Writes pull python script to log_dir
+
+    """
+    sbatch_cmd = f"""\
+        #!/bin/env {sys.executable}
+
+        from func_mriqc import process
+
+
+        process.batch_pull(
+            {subj_list},
+            "{sess}",
+            "{log_dir}/staged",
+            num_streams={num_streams},
+        )
+
+    """
+    sbatch_cmd = textwrap.dedent(sbatch_cmd)
+    py_script = f"{log_dir}/run_mriqc_pull_{sess}.py"
+    with open(py_script, "w") as ps:
+        ps.write(sbatch_cmd)
+    os.chmod(py_script, 0o755)
+    return submit_script(
+        py_script,
+        f"pull_s{sess[7:]}",
+        log_dir,
+        num_hours=4,
+        num_cpus=num_streams,
+        mem_gig=4,
+    )
+
+
+def schedule_pipeline(
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    log_dir,
+    proj_research,
+    proj_raw,
+    proj_mriqc,
+    subj_list,
+    sess,
+    fd_thresh,
+    disk_budget=100,
+    num_workers=4,
+    wf_kwargs=None,
+):
+    """Schedule controller jobs running the cohort pipeline.
+
+    Each controller runs as many rounds of num_workers subjects as fit
+    within MAX_WALLTIME. Larger cohorts are split across controllers
+    chained via afterany dependencies, so only one runs at a time and
+    disk_budget and num_workers hold for the whole cohort.
+
+    Parameters
+    ----------
+    sing_mriqc : path
+        Location of MRIQC singularity image
+    work_deriv : path
+        Location of work derivatives (required for binding)
+    work_mriqc : path
+        Location of work derivatives/mriqc
+    log_dir : path
+        Location of work log directory
+    proj_research : path
+        Location of group research bin, contains simg file
+        e.g. /hpc/group/labarlab/research_bin
+    proj_raw : path
+        Location of project rawdir
+    proj_mriqc : path
+        Location of project derivatives/mriqc
+    subj_list : list
+        BIDS subject identifiers
+    sess : str
+        BIDS session identifier
+    fd_thresh : float
+        Framewise displacement value
+    disk_budget : float, optional
+        Maximum size (GB) of staged rawdata
+    num_workers : int, optional
+        Number of simultaneous MRIQC jobs
+    wf_kwargs : dict, optional
+        Additional keyword arguments of the workflow
+
+    Returns
+    -------
+    list
+        Scheduled job IDs, in order of execution
+
+    Notes
+    -----
+    Writes pipeline python scripts to log_dir
+
+    """
+    # Allow for MRIQC walltime of each round of workers, split the
+    # cohort so each controller fits within MAX_WALLTIME.
+    round_hours = STAGE_RESOURCES["mriqc"][0]
+    max_rounds = max((MAX_WALLTIME - 2) // round_hours, 1)
+    chunk_size = max_rounds * num_workers
+    chunks = [
+        subj_list[x:][:chunk_size]
+        for x in range(0, len(subj_list), chunk_size)
+    ]
+    job_ids = []
+    for num, chunk_list in enumerate(chunks):
+        sbatch_cmd = f"""\
+            #!/bin/env {sys.executable}
+
+            from func_mriqc import workflows
+
+
+            workflows.wf_mriqc_pipeline(
+                "{sing_mriqc}",
+                "{work_deriv}",
+                "{work_mriqc}",
+                "{log_dir}",
+                "{proj_research}",
+                "{proj_raw}",
+                "{proj_mriqc}",
+                {chunk_list},
+                "{sess}",
+                {fd_thresh},
+                disk_budget={disk_budget},
+                num_workers={num_workers},
+                **{wf_kwargs or {}},
+            )
+
+        """
+        sbatch_cmd = textwrap.dedent(sbatch_cmd)
+        py_script = f"{log_dir}/run_mriqc_pipeline_{sess}_{num}.py"
+        with open(py_script, "w") as ps:
+            ps.write(sbatch_cmd)
+        os.chmod(py_script, 0o755)
+
+        # Controllers run one after another, sharing the disk budget
+        num_rounds = -(-len(chunk_list) // num_workers)
+        job_id = submit_script(
+            py_script,
+            f"pipe_s{sess[7:]}_{num}",
+            log_dir,
+            num_hours=min(num_rounds * round_hours + 2, MAX_WALLTIME),
+            num_cpus=2,
+            mem_gig=4,
+            dependency=f"afterany:{job_ids[-1]}" if job_ids else None,
+        )
+        _record_submitted(
+            work_mriqc, log_dir, chunk_list, sess, [job_id] * len(chunk_list)
+        )
+        job_ids.append(job_id)
+    return job_ids
+
+
+def schedule_group(
+    sing_mriqc, work_deriv, log_dir, sess, job_ids, parallel=True
+):
+    """Schedule group MRIQC to start once subject jobs end.
+
+    The group job runs workflows.wf_mriqc_group_dcc after all
+    job_ids end regardless of their success, so the group reports
+    cover every subject with output on Keoki.
+
+    Parameters
+    ----------
+    sing_mriqc : path
+        Location of MRIQC singularity image
+    work_deriv : path
+        Location of work derivatives
+    log_dir : path
+        Location of work log directory
+    sess : str
+        BIDS session identifier
+    job_ids : list
+        IDs of subject jobs, array IDs cover all tasks
+    parallel : bool, optional
+        Run MRIQC group concurrently for each modality
+
+    Returns
+    -------
+    str
+        Scheduled job ID
+
+    Notes
+    -----
+    Writes group python script to log_dir
+
+    """
+    sbatch_cmd = f"""\
+        #!/bin/env {sys.executable}
+
+        from func_mriqc import workflows
+
+
+        workflows.wf_mriqc_group_dcc(
+            "{sing_mriqc}",
+            "{work_deriv}",
+            "{log_dir}",
+            "{sess}",
+            parallel={parallel},
+        )
+
+    """
+    sbatch_cmd = textwrap.dedent(sbatch_cmd)
+    py_script = f"{log_dir}/run_mriqc_group_{sess}.py"
+    with open(py_script, "w") as ps:
+        ps.write(sbatch_cmd)
+    os.chmod(py_script, 0o755)
+
+    num_hours, num_cpus, mem_gig = GROUP_RESOURCES
+    job_list = sorted({str(x) for x in job_ids if x})
+    return submit_script(
+        py_script,
+        f"group_s{sess[7:]}",
+        log_dir,
+        num_hours=num_hours,
+        num_cpus=num_cpus,
+        mem_gig=mem_gig,
+        dependency="afterany:" + ":".join(job_list) if job_list else None,
+    )
+
+
+class SbatchJob:
+    """Handle of a scheduled SBATCH job.
+
+    State is updated by JobTracker.
+
+    Attributes
+    ----------
+    job_id : str
+        SLURM job ID
+    job_name : str
+        Name for scheduler
+    state : str
+        Last known SLURM job state
+    exit_code : str
+        Last known SLURM exit code, e.g. "0:0"
+    done : bool
+        Whether job is in a terminal state
+    ok : bool
+        Whether job completed successfully
+
+    """
+
+    def __init__(self, job_id, job_name=None):
+        """Initialize."""
+        self.job_id = str(job_id)
+        self.job_name = job_name
+        self.state = "PENDING"
+        self.exit_code = None
+
+    def __repr__(self):
+        """Represent job."""
+        return f"SbatchJob({self.job_id}, {self.job_name}, {self.state})"
+
+    @property
+    def done(self):
+        """Return whether job is in terminal state."""
+        return self.state in TERMINAL_STATES
+
+    @property
+    def ok(self):
+        """Return whether job completed successfully."""
+        return self.state == "COMPLETED"
+
+
+def submit_job(
+    bash_cmd,
+    job_name,
+    log_dir,
+    num_hours=1,
+    num_cpus=1,
+    mem_gig=1,
+    dependency=None,
+):
+    """Schedule child SBATCH job without waiting for completion.
+
+    Parameters
+    ----------
+    bash_cmd : str
+        Bash syntax, work to schedule
+    job_name : str
+        Name for scheduler
+    log_dir : Path
+        Location of output dir for writing logs
+    num_hours : int
+        Walltime to schedule
+    num_cpus : int
+        Number of CPUs required by job
+    mem_gig : int
+        Job RAM requirement (GB)
+    dependency : str, optional
+        SLURM dependency specification, e.g. "afterok:1234"
+
+    Returns
+    -------
+    SbatchJob
+        Handle of scheduled job
+
+    Raises
+    ------
+    RuntimeError
+        sbatch failed or did not return a job ID
+
+    """
+    sbatch_cmd = f"""
+        sbatch \
+        --parsable \
+        -J {job_name} \
+        -t {num_hours}:00:00 \
+        --cpus-per-task={num_cpus} \
+        --mem={mem_gig}G \
+        -o {log_dir}/out_{job_name}.log \
+        -e {log_dir}/err_{job_name}.log \
+        {_dependency_opt(dependency)} \
+        --wrap="{bash_cmd}"
+    """
+    print(f"Submitting SBATCH job:\n\t{sbatch_cmd}\n")
+    h_out, _ = _sbatch(sbatch_cmd)
+    job_id = h_out.decode("utf-8").strip().split(";")[0]
+    if not job_id:
+        raise RuntimeError(f"Failed to schedule {job_name}")
+    _record_job(log_dir, job_id, job_name)
+    return SbatchJob(job_id, job_name)
+
+
+class JobTracker:
+    """Track states of many scheduled jobs.
+
+    Job states are polled with a single batched sacct call (with squeue
+    as fallback for jobs not yet known to accounting). The polling
+    interval starts at min_wait, grows by backoff while no job changes
+    state, and resets when a change is observed.
+
+    Parameters
+    ----------
+    jobs : list, optional
+        SbatchJob objects to track
+    min_wait : float, optional
+        Minimum seconds between polls
+    max_wait : float, optional
+        Maximum seconds between polls
+    backoff : float, optional
+        Growth factor of the polling interval
+
+    Methods
+    -------
+    add(job)
+        Start tracking job
+    poll()
+        Update job states, return jobs that changed state
+    wait_any(timeout=None)
+        Block until at least one tracked job finishes
+    wait_all(timeout=None)
+        Block until all tracked jobs finish
+
+    Example
+    -------
+    tracker = JobTracker([submit_job("sleep 60", "test", "/tmp")])
+    for job in tracker.wait_all():
+        print(job.job_id, job.state)
+
+    """
+
+    def __init__(self, jobs=None, min_wait=5, max_wait=120, backoff=1.5):
+        """Initialize."""
+        self._jobs = {}
+        self._reported = set()
+        self._min_wait = min_wait
+        self._max_wait = max_wait
+        self._backoff = backoff
+        self._wait = min_wait
+        for job in jobs or []:
+            self.add(job)
+
+    @property
+    def jobs(self):
+        """Return list of tracked jobs."""
+        return list(self._jobs.values())
+
+    @property
+    def pending(self):
+        """Return list of tracked jobs not in a terminal state."""
+        return [x for x in self._jobs.values() if not x.done]
+
+    def add(self, job):
+        """Start tracking SbatchJob."""
+        self._jobs[job.job_id] = job
+
+    def poll(self):
+        """Update states of unfinished jobs with batched queries.
+
+        A failing sacct query falls back to squeue for all jobs.
+
+        Returns
+        -------
+        list
+            SbatchJob objects which changed state
+
+        Raises
+        ------
+        RuntimeError
+            squeue query failed
+
+        """
+        pend_ids = [x.job_id for x in self.pending]
+        changed = []
+        while pend_ids:
+            chunk, pend_ids = pend_ids[:500], pend_ids[500:]
+            try:
+                found = self._query_sacct(chunk)
+            except RuntimeError as e:
+                print(f"\tFailed to query sacct, using squeue : {e}")
+                found = {}
+            missing = [x for x in chunk if x not in found]
+            if missing:
+                found.update(self._query_squeue(missing))
+            for job_id, (state, exit_code) in found.items():
+                job = self._jobs[job_id]
+                if state != job.state:
+                    changed.append(job)
+                job.state = state
+                job.exit_code = exit_code
+        return changed
+
+    def _query_sacct(self, job_ids):
+        """Return {job_id: (state, exit_code)} from accounting."""
+        h_out = _query_cmd(
+            "sacct -n -P -X -o JobID,State,ExitCode -j " + ",".join(job_ids)
+        )
+        out_dict = {}
+        for line in h_out:
+            try:
+                job_id, state, exit_code = line.split("|")[:3]
+            except ValueError:
+                continue
+            if job_id in self._jobs:
+                out_dict[job_id] = (state.split(" ")[0], exit_code)
+        return out_dict
+
+    def _query_squeue(self, job_ids):
+        """Return {job_id: (state, None)} from scheduler queue."""
+        h_out = _query_cmd("squeue -h -o '%i|%T' -j " + ",".join(job_ids))
+        out_dict = {}
+        for line in h_out:
+            try:
+                job_id, state = line.split("|")[:2]
+            except ValueError:
+                continue
+            if job_id in self._jobs:
+                out_dict[job_id] = (state, None)
+        return out_dict
+
+    def _sleep(self, changed, deadline):
+        """Sleep for adaptive interval, bounded by deadline."""
+        if changed:
+            self._wait = self._min_wait
+        else:
+            self._wait = min(self._wait * self._backoff, self._max_wait)
+        h_wait = self._wait
+        if deadline is not None:
+            h_wait = min(h_wait, max(deadline - time.monotonic(), 0))
+        time.sleep(h_wait)
+
+    def wait_any(self, timeout=None):
+        """Block until at least one tracked job finishes.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum seconds to wait
+
+        Returns
+        -------
+        list
+            Newly finished SbatchJob objects since last wait_any
+            call, empty on timeout
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self.poll()
+            finished = [
+                x
+                for x in self._jobs.values()
+                if x.done and x.job_id not in self._reported
+            ]
+            if finished or not self.pending:
+                self._reported.update([x.job_id for x in finished])
+                return finished
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+            self._sleep(changed, deadline)
+
+    def wait_all(self, timeout=None):
+        """Block until all tracked jobs finish.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum seconds to wait
+
+        Returns
+        -------
+        list
+            All tracked SbatchJob objects
+
+        Raises
+        ------
+        TimeoutError
+            Jobs remain unfinished after timeout
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self.poll()
+            if not self.pending:
+                return self.jobs
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"{len(self.pending)} jobs unfinished after {timeout}s"
+                )
+            self._sleep(changed, deadline)
+
+
+def _query_cmd(bash_cmd):
+    """Return stdout lines of scheduler query, raise RuntimeError on failure.
+
+    Output is not logged, failures include recent stderr.
+
+    """
+    res = runner.run_cmd(
+        bash_cmd,
+        log_path=os.devnull,
+        capture=True,
+        check=True,
+        stage=bash_cmd.split()[0],
+    )
+    return res.stdout.decode("utf-8").strip().splitlines()
@@ -0,0 +1,127 @@
+"""Record timing and resource telemetry as JSON lines.
+
+enable : write telemetry of current and child processes to file
+record : append telemetry record
+stage : time a workflow stage, record bytes and child peak RSS
+record_span : record stage spanning several threads or jobs
+
+"""
+
+import os
+import json
+import time
+import fcntl
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Union
+
+# Environment variable holding telemetry location, inherited by
+# child processes and SLURM jobs.
+ENV_VAR = "FMQ_TELEMETRY"
+
+_local = threading.local()
+
+
+def enable(tel_path: Union[str, os.PathLike]):
+    """Write telemetry of current and child processes to tel_path."""
+    os.environ[ENV_VAR] = str(tel_path)
+
+
+def record(**fields):
+    """Append telemetry record, when enabled.
+
+    Records hold the host, process, and SLURM job of the writer and
+    the subject and session of the enclosing stage. Command records
+    also update the peak RSS of the enclosing stage.
+
+    """
+    stage_rec = getattr(_local, "stage_rec", None)
+    if stage_rec is not None and fields.get("max_rss_kb"):
+        stage_rec["max_rss_kb"] = max(
+            stage_rec["max_rss_kb"] or 0, fields["max_rss_kb"]
+        )
+    tel_path = os.environ.get(ENV_VAR)
+    if not tel_path:
+        return
+    rec = {
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+        "job_id": os.environ.get("SLURM_JOB_ID"),
+        **getattr(_local, "context", {}),
+        **fields,
+    }
+
+    # Many jobs append to one cohort file, write whole lines
+    with open(tel_path, "a") as tf:
+        fcntl.flock(tf, fcntl.LOCK_EX)
+        tf.write(json.dumps(rec) + "\n")
+        tf.flush()
+        fcntl.flock(tf, fcntl.LOCK_UN)
+
+
+@contextmanager
+def stage(name: str, subj: str = None, sess: str = None):
+    """Time a workflow stage, record bytes and child peak RSS.
+
+    Yields a dict, set its "bytes" key to record bytes transferred
+    or moved by the stage. Peak RSS is the largest of the commands
+    run via runner.run_cmd within the stage.
+
+    Example
+    -------
+    with stage("push", "sub-ER0009", "ses-day2") as tel:
+        tel["bytes"] = push_pull.verify_push(subj_out)["bytes"]
+
+    """
+    prev_context = getattr(_local, "context", {})
+    prev_rec = getattr(_local, "stage_rec", None)
+    _local.context = {**prev_context, "subj": subj, "sess": sess}
+    _local.stage_rec = stage_rec = {"bytes": None, "max_rss_kb": None}
+    start = time.time()
+    status = "ok"
+    try:
+        yield stage_rec
+    except BaseException as e:
+        status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        end = time.time()
+        _local.stage_rec = prev_rec
+        record(
+            event="stage",
+            name=name,
+            start=start,
+            end=end,
+            seconds=end - start,
+            status=status,
+            bytes=stage_rec["bytes"],
+            max_rss_kb=stage_rec["max_rss_kb"],
+        )
+        _local.context = prev_context
+
+
+def record_span(name: str, start: float, subj: str = None, sess: str = None):
+    """Record completed stage spanning several threads or jobs.
+
+    Used where a stage cannot be timed by a single stage context,
+    e.g. the workflow of a subject split into chained jobs.
+
+    Example
+    -------
+    record_span("workflow", pull_start, "sub-ER0009", "ses-day2")
+
+    """
+    end = time.time()
+    record(
+        event="stage",
+        name=name,
+        subj=subj,
+        sess=sess,
+        start=start,
+        end=end,
+        seconds=end - start,
+        status="ok",
+        bytes=None,
+        max_rss_kb=None,
+    )
@@ -1,12 +1,27 @@
 """MRIQC workflows.
 
 wf_mriqc_subj : conduct MRIQC for single subject and session
+wf_mriqc_stage : conduct single stage of subject MRIQC workflow
+wf_mriqc_pipeline : conduct MRIQC for many subjects, prefetching data
 wf_mriqc_group : conduct MRIQC for group
+wf_mriqc_group_dcc : conduct MRIQC for group on DCC, syncing with Keoki
 
 """
 
 import os
-from func_mriqc import process
+import time
+import shutil
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from func_mriqc import (
+    process,
+    checkpoint,
+    telemetry,
+    group,
+    online_stats,
+    ledger,
+)
 
 
 def wf_mriqc_subj(
@@ -20,11 +35,25 @@ def wf_mriqc_subj(
     subj,
     sess,
     fd_thresh,
+    pull_mode="rsync",
+    push_mode="rsync",
+    split_modality=False,
+    resource_history=None,
+    scratch=False,
+    image_cache=False,
+    work_cache=False,
 ):
     """Run MRIQC workflow for single subejct and session.
 
     Pull required data from Keoki, executed MRIQC, and then
-    push output back to Keoki.
+    push output back to Keoki. Group rawdata is only removed once
+    checksums of the Keoki copies match. Completed stages are recorded via
+    checkpoint.Checkpoint, a rerun resumes at the first stage
+    which is not verified. Timing, bytes, and peak RSS of each stage
+    are appended to <log_dir>/telemetry.jsonl. IQMs are folded into
+    the running group statistics (see online_stats.fold) before
+    the push, printing cohort outliers. Each transition is recorded in
+    the ledger of work_mriqc (see ledger.open_ledger).
 
     Parameters
     ----------
@@ -49,35 +78,542 @@ def wf_mriqc_subj(
         BIDS session identifier
     fd_thresh : float
         Framewise displacement value
+    pull_mode : str, optional
+        {"rsync", "tar", "tar.gz"}
+        Transfer method for downloading rawdata
+    push_mode : str, optional
+        {"rsync", "tar", "tar.gz"}
+        Transfer method for uploading MRIQC output
+    split_modality : bool, optional
+        Run MRIQC separately and concurrently for each modality
+        and BOLD run
+    resource_history : str, os.PathLike, optional
+        Location of usage history, right-size MRIQC job requests
+        from previous jobs
+    scratch : bool, optional
+        Stage MRIQC input and work directories on node-local scratch
+    image_cache : bool, optional
+        Run MRIQC from node-local copy of the singularity image
+    work_cache : bool, optional
+        Keep MRIQC work directories in a persistent cache, reused
+        by reruns of the subject and session
 
     """
-    # Get data
-    push_pull = process.PushPull(subj, sess)
-    push_pull.pull_data()
-
-    # Run MRIQC
-    mriqc_done = process.mriqc_subj(
-        sing_mriqc,
-        work_deriv,
-        work_mriqc,
-        log_dir,
-        proj_research,
-        proj_raw,
-        proj_mriqc,
+    # Resume at first incomplete stage
+    telemetry.enable(os.path.join(log_dir, "telemetry.jsonl"))
+    ckpt = checkpoint.Checkpoint(work_mriqc, subj, sess)
+    raw_dir = os.path.join(proj_raw, subj, sess)
+    subj_out = os.path.join(proj_mriqc, f"{subj}*")
+    work_out = os.path.join(work_mriqc, f"{subj}_{sess}_T1w.html")
+    img_stat = os.stat(sing_mriqc)
+    mriqc_fp = {
+        "fd_thresh": fd_thresh,
+        "image": f"{sing_mriqc}|{img_stat.st_size}|{img_stat.st_mtime_ns}",
+    }
+    run_ledger = ledger.open_ledger(work_mriqc)
+    if ckpt.verified("cleaned", **mriqc_fp):
+        print(f"\tWorkflow already complete for {subj} {sess}")
+        run_ledger.record(subj, sess, "cleaned", message="already complete")
+        return
+    elif ckpt.verified("pushed", **mriqc_fp):
+        resume = "cleaned"
+    elif ckpt.verified(
+        "copied", out=checkpoint.tree_fingerprint(subj_out), **mriqc_fp
+    ):
+        resume = "pushed"
+    elif ckpt.verified(
+        "mriqc_done", raw=checkpoint.tree_fingerprint(raw_dir), **mriqc_fp
+    ) and os.path.exists(work_out):
+        resume = "copied"
+    elif ckpt.verified("pulled", raw=checkpoint.tree_fingerprint(raw_dir)):
+        resume = "mriqc_done"
+    else:
+        resume = "pulled"
+    start = checkpoint.STAGES.index(resume)
+    if start:
+        print(f"\tResuming {subj} {sess} at stage : {resume}")
+    run_ledger.record(
         subj,
         sess,
-        fd_thresh,
+        "running",
+        log_dir=log_dir,
+        message=f"resume at {resume}" if start else None,
     )
 
-    # Send data and clean up
+    def _mark(stage, **fingerprint):
+        """Checkpoint stage and record transition."""
+        ckpt.mark(stage, **fingerprint)
+        run_ledger.record(subj, sess, stage, log_dir=log_dir)
+
     clean_data = process.CleanDcc(subj, proj_mriqc)
-    if mriqc_done:
-        clean_data.clean_work(work_mriqc)
-    push_pull.push_data(os.path.join(proj_mriqc, f"{subj}*"))
-    clean_data.clean_group(proj_raw)
+    with telemetry.stage("workflow", subj, sess), run_ledger.track(
+        subj, sess, "workflow", log_dir=log_dir
+    ), process.PushPull(
+        subj, sess, pull_mode, push_mode, log_dir=log_dir
+    ) as push_pull:
+        # Get data, unless already staged by batch pull
+        if start <= checkpoint.STAGES.index("pulled"):
+            with telemetry.stage("pull", subj, sess) as tel:
+                push_pull.pull_data(staged_dir=os.path.join(log_dir, "staged"))
+                tel["bytes"] = process.dir_size(raw_dir)
+            _mark("pulled", raw=checkpoint.tree_fingerprint(raw_dir))
+
+        # Run MRIQC, skipped by mriqc_subj when output already
+        # exists in project derivatives.
+        if start <= checkpoint.STAGES.index("mriqc_done"):
+            with telemetry.stage("mriqc", subj, sess):
+                _ = process.mriqc_subj(
+                    sing_mriqc,
+                    work_deriv,
+                    work_mriqc,
+                    log_dir,
+                    proj_research,
+                    proj_raw,
+                    proj_mriqc,
+                    subj,
+                    sess,
+                    fd_thresh,
+                    split_modality=split_modality,
+                    resource_history=resource_history,
+                    scratch=scratch,
+                    image_cache=image_cache,
+                    work_cache=work_cache,
+                )
+            _mark(
+                "mriqc_done",
+                raw=checkpoint.tree_fingerprint(raw_dir),
+                **mriqc_fp,
+            )
+
+        # Move output from work to project derivatives, when present
+        if start <= checkpoint.STAGES.index("copied"):
+            with telemetry.stage("copy", subj, sess) as tel:
+                if os.path.exists(work_out):
+                    tel["bytes"] = clean_data.clean_work(
+                        work_mriqc, keep_work=work_cache
+                    )["move"]["bytes"]
+            _mark(
+                "copied",
+                out=checkpoint.tree_fingerprint(subj_out),
+                **mriqc_fp,
+            )
+
+        # Update running group statistics, reruns replace the
+        # previous contribution of subject and session.
+        if start <= checkpoint.STAGES.index("pushed"):
+            with telemetry.stage("stats", subj, sess):
+                _ = online_stats.fold(proj_mriqc, subj, sess)
+
+        # Send data and clean up
+        if start <= checkpoint.STAGES.index("pushed"):
+            with telemetry.stage("push", subj, sess) as tel:
+                push_pull.push_data(subj_out)
+                tel["bytes"] = push_pull.verify_push(subj_out)["bytes"]
+            _mark(
+                "pushed",
+                out=checkpoint.tree_fingerprint(subj_out),
+                **mriqc_fp,
+            )
+        with telemetry.stage("clean", subj, sess) as tel:
+            tel["bytes"] = sum(
+                x["bytes"] for x in clean_data.clean_group(proj_raw).values()
+            )
+        _mark("cleaned", **mriqc_fp)
+
 
+def _pull_start(run_ledger, subj, sess):
+    """Return start of latest pull of subject, now when unrecorded."""
+    start_list = [
+        x["time"]
+        for x in run_ledger.history(subj, sess)
+        if x["state"] == "running"
+    ]
+    return start_list[-1] if start_list else time.time()
 
-def wf_mriqc_group(proj_raw, proj_mriqc):
+
+def wf_mriqc_stage(
+    stage,
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    log_dir,
+    proj_research,
+    proj_raw,
+    proj_mriqc,
+    subj,
+    sess,
+    fd_thresh,
+    pull_mode="rsync",
+    push_mode="rsync",
+    split_modality=False,
+    scratch=False,
+    image_cache=False,
+    work_cache=False,
+):
+    """Run a single stage of the MRIQC workflow for subject and session.
+
+    Stages are intended to be scheduled as separate SBATCH jobs chained
+    via dependencies (see submit.schedule_stages), each executing within
+    its own job rather than waiting on a child job.
+
+    Parameters
+    ----------
+    stage : str
+        {"pull", "mriqc", "clean", "push"}
+        Workflow stage to execute
+    sing_mriqc : str, os.PathLike
+        Location of MRIQC singularity image
+    work_deriv : str, os.PathLike
+        Location of work derivatives (required for binding)
+    work_mriqc : str, os.PathLike
+        Location of work derivatives/mriqc
+    log_dir : str, os.PathLike
+        Location of work log directory
+    proj_research : str, os.PathLike
+        Location of group research bin, contains simg file
+        e.g. /hpc/group/labarlab/research_bin
+    proj_raw : str, os.PathLike
+        Location of project rawdir
+    proj_mriqc : str, os.PathLike
+        Location of project derivatives/mriqc
+    subj : str
+        BIDS subject identifier
+    sess : str
+        BIDS session identifier
+    fd_thresh : float
+        Framewise displacement value
+    pull_mode : str, optional
+        {"rsync", "tar", "tar.gz"}
+        Transfer method for downloading rawdata
+    push_mode : str, optional
+        {"rsync", "tar", "tar.gz"}
+        Transfer method for uploading MRIQC output
+    split_modality : bool, optional
+        Run MRIQC separately and concurrently for each modality
+        and BOLD run
+    scratch : bool, optional
+        Stage MRIQC input and work directories on node-local scratch
+    image_cache : bool, optional
+        Run MRIQC from node-local copy of the singularity image
+    work_cache : bool, optional
+        Keep MRIQC work directories in a persistent cache, reused
+        by reruns of the subject and session
+
+    Raises
+    ------
+    ValueError
+        Unexpected stage
+
+    """
+    if stage not in ["pull", "mriqc", "clean", "push"]:
+        raise ValueError(f"Unexpected stage : {stage}")
+
+    telemetry.enable(os.path.join(log_dir, "telemetry.jsonl"))
+    run_ledger = ledger.open_ledger(work_mriqc)
+    with telemetry.stage(stage, subj, sess), run_ledger.track(
+        subj, sess, stage, log_dir=log_dir
+    ):
+        if stage == "pull":
+            run_ledger.record(subj, sess, "running", log_dir=log_dir)
+            with process.PushPull(
+                subj, sess, pull_mode, push_mode, log_dir=log_dir
+            ) as push_pull:
+                push_pull.pull_data(staged_dir=os.path.join(log_dir, "staged"))
+            run_ledger.record(subj, sess, "pulled", log_dir=log_dir)
+
+        elif stage == "mriqc":
+            _ = process.mriqc_subj(
+                sing_mriqc,
+                work_deriv,
+                work_mriqc,
+                log_dir,
+                proj_research,
+                proj_raw,
+                proj_mriqc,
+                subj,
+                sess,
+                fd_thresh,
+                run_local=True,
+                split_modality=split_modality,
+                scratch=scratch,
+                image_cache=image_cache,
+                work_cache=work_cache,
+            )
+            run_ledger.record(subj, sess, "mriqc_done", log_dir=log_dir)
+
+        elif stage == "clean":
+            work_out = os.path.join(work_mriqc, f"{subj}_{sess}_T1w.html")
+            if os.path.exists(work_out):
+                process.CleanDcc(subj, proj_mriqc).clean_work(
+                    work_mriqc, keep_work=work_cache
+                )
+            _ = online_stats.fold(proj_mriqc, subj, sess)
+            run_ledger.record(subj, sess, "copied", log_dir=log_dir)
+
+        elif stage == "push":
+            with process.PushPull(
+                subj, sess, pull_mode, push_mode, log_dir=log_dir
+            ) as push_pull:
+                subj_out = os.path.join(proj_mriqc, f"{subj}*")
+                push_pull.push_data(subj_out)
+                _ = push_pull.verify_push(subj_out)
+            run_ledger.record(subj, sess, "pushed", log_dir=log_dir)
+            process.CleanDcc(subj, proj_mriqc).clean_group(proj_raw)
+            run_ledger.record(subj, sess, "cleaned", log_dir=log_dir)
+
+    # Record subject workflow from start of pull job, see report
+    if stage == "push":
+        telemetry.record_span(
+            "workflow", _pull_start(run_ledger, subj, sess), subj, sess
+        )
+
+
+def wf_mriqc_pipeline(
+    sing_mriqc,
+    work_deriv,
+    work_mriqc,
+    log_dir,
+    proj_research,
+    proj_raw,
+    proj_mriqc,
+    subj_list,
+    sess,
+    fd_thresh,
+    disk_budget=100,
+    num_workers=4,
+    pull_mode="rsync",
+    push_mode="rsync",
+    split_modality=False,
+    resource_history=None,
+    scratch=False,
+    image_cache=False,
+    work_cache=False,
+):
+    """Run MRIQC workflow for many subjects as a pipeline.
+
+    A prefetch thread downloads rawdata of upcoming subjects while
+    workers run MRIQC (each as a child SBATCH job) for staged subjects,
+    and pushes and clean up are drained by a background thread, all
+    transfers sharing one multiplexed SSH connection. The
+    prefetch depth is bounded by disk_budget: a download only starts
+    when the staged rawdata plus the expected size of the next subject
+    fits within the budget, or when nothing is staged.
+
+    Parameters
+    ----------
+    sing_mriqc : str, os.PathLike
+        Location of MRIQC singularity image
+    work_deriv : str, os.PathLike
+        Location of work derivatives (required for binding)
+    work_mriqc : str, os.PathLike
+        Location of work derivatives/mriqc
+    log_dir : str, os.PathLike
+        Location of work log directory
+    proj_research : str, os.PathLike
+        Location of group research bin, contains simg file
+        e.g. /hpc/group/labarlab/research_bin
+    proj_raw : str, os.PathLike
+        Location of project rawdir
+    proj_mriqc : str, os.PathLike
+        Location of project derivatives/mriqc
+    subj_list : list
+        BIDS subject identifiers
+    sess : str
+        BIDS session identifier
+    fd_thresh : float
+        Framewise displacement value
+    disk_budget : float, optional
+        Maximum size (GB) of staged rawdata
+    num_workers : int, optional
+        Number of simultaneous MRIQC jobs
+    pull_mode : str, optional
+        {"rsync", "tar", "tar.gz"}
+        Transfer method for downloading rawdata
+    push_mode : str, optional
+        {"rsync", "tar", "tar.gz"}
+        Transfer method for uploading MRIQC output
+    split_modality : bool, optional
+        Run MRIQC separately and concurrently for each modality
+        and BOLD run
+    resource_history : str, os.PathLike, optional
+        Location of usage history, right-size MRIQC job requests
+        from previous jobs
+    scratch : bool, optional
+        Stage MRIQC input and work directories on node-local scratch
+    image_cache : bool, optional
+        Run MRIQC from node-local copy of the singularity image
+    work_cache : bool, optional
+        Keep MRIQC work directories in a persistent cache, reused
+        by reruns of the subject and session
+
+    Raises
+    ------
+    RuntimeError
+        Workflow failed for one or more subjects
+
+    Notes
+    -----
+    Rawdata of subjects failing MRIQC is kept for inspection and no
+    longer counted against disk_budget.
+
+    """
+    telemetry.enable(os.path.join(log_dir, "telemetry.jsonl"))
+    run_ledger = ledger.open_ledger(work_mriqc)
+    budget = disk_budget * 1024**3
+    staged = {"bytes": 0, "sizes": {}}
+    cond = threading.Condition()
+    ready = queue.Queue()
+    failed = {}
+    started = {}
+    queued = set()
+
+    def _fail(subj, stage, err):
+        """Keep and record failure of subject."""
+        failed[subj] = f"{stage} : {err}"
+        err_line = (str(err).splitlines() or [type(err).__name__])[0]
+        run_ledger.record(
+            subj,
+            sess,
+            "failed",
+            log_dir=log_dir,
+            message=f"{stage} : {err_line}"[:500],
+        )
+
+    def _release(subj):
+        """Release disk budget of subject."""
+        with cond:
+            staged["bytes"] -= staged["sizes"].pop(subj, 0)
+            cond.notify_all()
+
+    def _prefetch():
+        """Download rawdata while within disk budget."""
+        try:
+            for subj in subj_list:
+                with cond:
+                    sizes = list(staged["sizes"].values())
+                    expect = sum(sizes) / len(sizes) if sizes else 0
+                    cond.wait_for(
+                        lambda: not staged["sizes"]
+                        or staged["bytes"] + expect <= budget
+                    )
+                run_ledger.record(subj, sess, "running", log_dir=log_dir)
+                started[subj] = time.time()
+                try:
+                    with telemetry.stage("pull", subj, sess) as tel:
+                        cohort_pull.for_subject(subj).pull_data(
+                            staged_dir=os.path.join(log_dir, "staged")
+                        )
+                        subj_size = process.dir_size(
+                            os.path.join(proj_raw, subj, sess)
+                        )
+                        tel["bytes"] = subj_size
+                except Exception as e:
+                    _fail(subj, "pull", e)
+                    continue
+                run_ledger.record(subj, sess, "pulled", log_dir=log_dir)
+                with cond:
+                    staged["sizes"][subj] = subj_size
+                    staged["bytes"] += subj_size
+                ready.put(subj)
+                queued.add(subj)
+        except Exception as e:
+            for subj in subj_list:
+                if subj not in queued and subj not in failed:
+                    _fail(subj, "prefetch", e)
+        finally:
+            # Always release workers, also when prefetch fails
+            for _ in range(num_workers):
+                ready.put(None)
+
+    def _drain(subj, mriqc_done):
+        """Push output and clean up, release disk budget."""
+        try:
+            clean_data = process.CleanDcc(subj, proj_mriqc)
+            if mriqc_done:
+                with telemetry.stage("copy", subj, sess) as tel:
+                    tel["bytes"] = clean_data.clean_work(
+                        work_mriqc, keep_work=work_cache
+                    )["move"]["bytes"]
+                run_ledger.record(subj, sess, "copied", log_dir=log_dir)
+            with telemetry.stage("stats", subj, sess):
+                _ = online_stats.fold(proj_mriqc, subj, sess)
+            with telemetry.stage("push", subj, sess) as tel:
+                push_pull = cohort_pull.for_subject(subj)
+                subj_out = os.path.join(proj_mriqc, f"{subj}*")
+                push_pull.push_data(subj_out)
+                tel["bytes"] = push_pull.verify_push(subj_out)["bytes"]
+            run_ledger.record(subj, sess, "pushed", log_dir=log_dir)
+            with telemetry.stage("clean", subj, sess) as tel:
+                tel["bytes"] = sum(
+                    x["bytes"]
+                    for x in clean_data.clean_group(proj_raw).values()
+                )
+            run_ledger.record(subj, sess, "cleaned", log_dir=log_dir)
+            telemetry.record_span("workflow", started[subj], subj, sess)
+        except Exception as e:
+            _fail(subj, "push", e)
+        finally:
+            _release(subj)
+
+    def _work(drain_pool):
+        """Run MRIQC for staged subjects."""
+        while True:
+            subj = ready.get()
+            if subj is None:
+                return
+            try:
+                with telemetry.stage("mriqc", subj, sess):
+                    mriqc_done = process.mriqc_subj(
+                        sing_mriqc,
+                        work_deriv,
+                        work_mriqc,
+                        log_dir,
+                        proj_research,
+                        proj_raw,
+                        proj_mriqc,
+                        subj,
+                        sess,
+                        fd_thresh,
+                        split_modality=split_modality,
+                        resource_history=resource_history,
+                        scratch=scratch,
+                        image_cache=image_cache,
+                        work_cache=work_cache,
+                    )
+            except Exception as e:
+                _fail(subj, "mriqc", e)
+                _release(subj)
+                continue
+            run_ledger.record(subj, sess, "mriqc_done", log_dir=log_dir)
+            drain_pool.submit(_drain, subj, mriqc_done)
+
+    # Start prefetch, workers, and drain, sharing one SSH connection
+    with process.PushPull(
+        None, sess, pull_mode, push_mode, log_dir=log_dir
+    ) as cohort_pull, ThreadPoolExecutor(max_workers=1) as drain_pool:
+        threads = [threading.Thread(target=_prefetch)] + [
+            threading.Thread(target=_work, args=(drain_pool,))
+            for _ in range(num_workers)
+        ]
+        for h_thread in threads:
+            h_thread.start()
+        for h_thread in threads:
+            h_thread.join()
+
+    if failed:
+        for subj, msg in failed.items():
+            print(f"\tFailed {subj} {sess} -- {msg}")
+        raise RuntimeError(f"Pipeline failed for {len(failed)} subjects")
+
+
+def wf_mriqc_group(
+    proj_raw,
+    proj_mriqc,
+    native=False,
+    backend="docker",
+    parallel=False,
+    sing_mriqc=None,
+):
     """Trigger group-level MRIQC.
 
     Parameters
@@ -86,6 +622,73 @@ def wf_mriqc_group(proj_raw, proj_mriqc):
         Location of project rawdir
     proj_mriqc : str, os.PathLike
         Location of project derivatives/mriqc
+    native : bool, optional
+        Incrementally update group IQM tables in-package (see
+        group.aggregate) rather than running MRIQC group
+    backend : str, optional
+        {"docker", "singularity"}
+        Container runtime of MRIQC group
+    parallel : bool, optional
+        Run MRIQC group concurrently for each modality
+    sing_mriqc : str, os.PathLike, optional
+        Location of MRIQC singularity image, required for singularity
+
+    """
+    if native:
+        _ = group.aggregate(proj_mriqc)
+        return
+    process.mriqc_group(
+        proj_raw,
+        proj_mriqc,
+        backend=backend,
+        parallel=parallel,
+        sing_mriqc=sing_mriqc,
+    )
+
+
+def wf_mriqc_group_dcc(sing_mriqc, work_deriv, log_dir, sess, parallel=True):
+    """Conduct group-level MRIQC on DCC, syncing with Keoki.
+
+    Subject output is removed from DCC once pushed, so participant
+    IQM files of all subjects are downloaded from Keoki to
+    <work_deriv>/mriqc_group, which is emptied first, MRIQC group is
+    run via singularity, and the group reports are uploaded to Keoki
+    derivatives/mriqc.
+
+    Parameters
+    ----------
+    sing_mriqc : str, os.PathLike
+        Location of MRIQC singularity image
+    work_deriv : str, os.PathLike
+        Location of work derivatives
+    log_dir : str, os.PathLike
+        Location of work log directory
+    sess : str
+        BIDS session identifier, of the triggering subject run
+    parallel : bool, optional
+        Run MRIQC group concurrently for each modality
 
     """
-    process.mriqc_group(proj_raw, proj_mriqc)
+    telemetry.enable(os.path.join(log_dir, "telemetry.jsonl"))
+    work_group = os.path.join(work_deriv, "mriqc_group")
+    group_raw = os.path.join(work_group, "rawdata")
+    group_mriqc = os.path.join(work_group, "derivatives/mriqc")
+    # Start from an empty copy, so IQM files of subjects removed
+    # from Keoki and reports of previous runs are not included.
+    if os.path.exists(work_group):
+        shutil.rmtree(work_group)
+    with process.PushPull(None, sess, log_dir=log_dir) as push_pull:
+        with telemetry.stage("pull_iqms", sess=sess):
+            push_pull.pull_iqms(work_group)
+        os.makedirs(group_raw, exist_ok=True)
+        with telemetry.stage("group", sess=sess):
+            process.mriqc_group(
+                group_raw,
+                group_mriqc,
+                backend="singularity",
+                parallel=parallel,
+                sing_mriqc=sing_mriqc,
+                log_dir=log_dir,
+            )
+        with telemetry.stage("push_group", sess=sess):
+            push_pull.push_group(group_mriqc)
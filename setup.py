@@ -5,15 +5,19 @@ exec(open("func_mriqc/_version.py").read())
 setup(
     name="func_mriqc",
     version=__version__,  # noqa: F821
-    packages=find_packages(),
+    packages=find_packages(exclude=["tests", "tests.*"]),
     entry_points={
         "console_scripts": [
             "func_mriqc=func_mriqc.entrypoint:main",
             "mriqc_subj=func_mriqc.cli.mriqc_subj:main",
             "mriqc_group=func_mriqc.cli.mriqc_group:main",
+            "mriqc_report=func_mriqc.cli.mriqc_report:main",
+            "mriqc_iqms=func_mriqc.cli.mriqc_iqms:main",
+            "mriqc_status=func_mriqc.cli.mriqc_status:main",
         ]
     },
     install_requires=[
         "setuptools>=65.5.0",
+        "numpy>=1.21",
     ],
 )
@@ -0,0 +1,21 @@
+"""Fixtures of the func_mriqc test suite."""
+
+import os
+import pytest
+import stand_ins
+
+
+@pytest.fixture
+def fake_slurm(tmp_path, monkeypatch):
+    """Put fake sbatch, sacct, and squeue first on PATH.
+
+    Yields the state directory of the fake scheduler, jobs are
+    awaited at teardown so none outlive the test.
+
+    """
+    fake_dir = str(tmp_path / "fake")
+    bin_dir = stand_ins.write_fake_slurm(fake_dir, latency=0.1)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    state_dir = os.path.join(fake_dir, "state")
+    yield state_dir
+    stand_ins.wait_idle(state_dir, timeout=60)
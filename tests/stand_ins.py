@@ -0,0 +1,1183 @@
+"""Local stand-ins for cluster and remote commands.
+
+Write executables which mimic the SLURM commands sbatch, sacct, and
+squeue, the remote commands ssh and rsync, and the MRIQC containers
+run via singularity and docker on a local machine, allowing the
+workflows to be exercised without a cluster or Keoki. Jobs are
+executed locally by a single dispatcher process after a configurable
+queue latency, and their states are kept as JSON files in a state
+directory. Each call of a stand-in is appended to
+<state_dir>/calls.jsonl. Used by the test suite and by
+func_mriqc.benchmark.bench_orchestration of a source checkout, not
+installed with the package.
+
+write_fake_slurm : write fake sbatch, sacct, squeue executables
+write_fake_remote : write fake ssh, rsync executables
+write_fake_containers : write fake singularity, docker executables
+wait_idle : wait for all fake jobs to finish
+fake_sbatch : mimic sbatch
+fake_sacct : mimic sacct
+fake_squeue : mimic squeue
+fake_ssh : mimic ssh, executing remote commands locally
+fake_rsync : mimic rsync, copying locally
+fake_singularity : mimic MRIQC participant run via singularity
+fake_docker : mimic MRIQC group run via docker
+
+Example
+-------
+import stand_ins
+bin_dir = stand_ins.write_fake_slurm("/tmp/fake_slurm", latency=0.5)
+os.environ["PATH"] = f"{bin_dir}:{os.environ['PATH']}"
+job = submit.submit_job("sleep 2", "test", "/tmp/fake_slurm")
+submit.JobTracker([job], min_wait=0.1).wait_all()
+
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import fcntl
+import shlex
+import random
+import shutil
+import textwrap
+import threading
+import subprocess
+from datetime import datetime
+
+
+_TERMINAL = ["CANCELLED", "COMPLETED", "FAILED", "TIMEOUT", "OUT_OF_MEMORY"]
+_SHORT_OPTS = {
+    "-J": "job-name",
+    "-t": "time",
+    "-o": "output",
+    "-e": "error",
+    "-c": "cpus-per-task",
+    "-d": "dependency",
+    "-a": "array",
+}
+_FLAG_OPTS = ["parsable", "wait"]
+
+# Single letter ssh options taking an argument
+_SSH_ARG_OPTS = "BbcDEeFIiJLlmOopQRSWw"
+
+# Remote rsync location, e.g. user@host:/path
+_REMOTE_RE = re.compile(r"^[^/:]+:")
+
+# Names and ranges of image quality metrics written by fake MRIQC
+_IQMS = {
+    "anat": {
+        "cjv": (0.3, 0.6),
+        "cnr": (2.0, 4.0),
+        "efc": (0.4, 0.7),
+        "fber": (1e3, 1e5),
+        "fwhm_avg": (3.0, 4.5),
+        "inu_med": (0.6, 1.0),
+        "qi_1": (0.0, 0.01),
+        "snr_total": (8.0, 16.0),
+        "tpm_overlap_gm": (0.4, 0.6),
+        "wm2max": (0.4, 0.8),
+    },
+    "func": {
+        "aor": (0.0, 0.02),
+        "aqi": (0.002, 0.02),
+        "dvars_nstd": (20.0, 60.0),
+        "dvars_std": (1.0, 1.6),
+        "efc": (0.4, 0.6),
+        "fber": (1e3, 1e4),
+        "fd_mean": (0.05, 0.4),
+        "fd_perc": (0.0, 30.0),
+        "fwhm_avg": (2.0, 3.0),
+        "gcor": (0.0, 0.1),
+        "gsr_x": (-0.05, 0.05),
+        "gsr_y": (-0.05, 0.05),
+        "snr": (3.0, 7.0),
+        "tsnr": (20.0, 80.0),
+    },
+}
+
+
+def _write_exec(out_dir, cmd, **kwargs):
+    """Write executable calling stand-in of cmd, return bin directory."""
+    bin_dir = os.path.join(out_dir, "bin")
+    state_dir = os.path.join(out_dir, "state")
+    for h_dir in [bin_dir, state_dir]:
+        if not os.path.exists(h_dir):
+            os.makedirs(h_dir)
+
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    exec_path = os.path.join(bin_dir, cmd)
+    with open(exec_path, "w") as ep:
+        ep.write(
+            textwrap.dedent(
+                f"""\
+                #!{sys.executable}
+                import sys
+                sys.path.insert(0, "{src_dir}")
+                import stand_ins
+                sys.exit(
+                    stand_ins.fake_{cmd}(
+                        sys.argv[1:], "{state_dir}", **{kwargs!r}
+                    )
+                )
+                """
+            )
+        )
+    os.chmod(exec_path, 0o755)
+    return bin_dir
+
+
+def write_fake_slurm(out_dir, latency=0.0, max_running=None):
+    """Write fake sbatch, sacct, and squeue executables.
+
+    Parameters
+    ----------
+    out_dir : str, os.PathLike
+        Location for writing bin and state directories
+    latency : float, optional
+        Seconds each job waits in the fake queue before running
+    max_running : int, optional
+        Maximum number of simultaneously running jobs submitted
+        outside of a job, modelling cluster capacity. Jobs submitted
+        from within a job, e.g. child MRIQC jobs, are not limited
+        so that waiting parent jobs cannot starve them.
+
+    Returns
+    -------
+    str, os.PathLike
+        Location of bin directory holding fake executables
+
+    """
+    for cmd in ["sbatch", "sacct", "squeue"]:
+        bin_dir = _write_exec(
+            out_dir, cmd, latency=latency, max_running=max_running
+        )
+    return bin_dir
+
+
+def write_fake_remote(out_dir, connect_latency=0.0, file_latency=0.0):
+    """Write fake ssh and rsync executables.
+
+    Remote commands and locations are resolved on the local machine,
+    so Keoki is modelled by a local directory (see process.KEOKI_PROJ).
+    Multiplexed connections are modelled via the ControlPath socket,
+    only connections without an existing master pay connect_latency.
+
+    Parameters
+    ----------
+    out_dir : str, os.PathLike
+        Location for writing bin and state directories
+    connect_latency : float, optional
+        Seconds taken to establish a new SSH connection
+    file_latency : float, optional
+        Seconds taken by rsync for each transferred file
+
+    Returns
+    -------
+    str, os.PathLike
+        Location of bin directory holding fake executables
+
+    """
+    _ = _write_exec(out_dir, "ssh", connect_latency=connect_latency)
+    return _write_exec(
+        out_dir,
+        "rsync",
+        connect_latency=connect_latency,
+        file_latency=file_latency,
+    )
+
+
+def write_fake_containers(out_dir, mriqc_seconds=0.0, work_files=50):
+    """Write fake singularity and docker executables.
+
+    Participant runs write an HTML report and IQM JSON for each
+    rawdata image, figures, and work files resembling MRIQC output.
+    Group runs write group_<modality>.tsv and HTML reports from
+    participant IQM files.
+
+    Parameters
+    ----------
+    out_dir : str, os.PathLike
+        Location for writing bin and state directories
+    mriqc_seconds : float, optional
+        Seconds taken by each participant or group run
+    work_files : int, optional
+        Number of files written to the MRIQC work directory
+
+    Returns
+    -------
+    str, os.PathLike
+        Location of bin directory holding fake executables
+
+    """
+    _ = _write_exec(
+        out_dir,
+        "singularity",
+        mriqc_seconds=mriqc_seconds,
+        work_files=work_files,
+    )
+    return _write_exec(out_dir, "docker", mriqc_seconds=mriqc_seconds)
+
+
+def _log_call(state_dir, tool, start, **fields):
+    """Append record of stand-in call to calls.jsonl."""
+    rec = {"tool": tool, "seconds": time.time() - start, **fields}
+    with open(os.path.join(state_dir, "calls.jsonl"), "a") as cf:
+        fcntl.flock(cf, fcntl.LOCK_EX)
+        cf.write(json.dumps(rec) + "\n")
+        fcntl.flock(cf, fcntl.LOCK_UN)
+
+
+def _parse_opts(argv, opts):
+    """Parse sbatch style arguments into opts, return positionals."""
+    pos = []
+    it = iter(argv)
+    for tok in it:
+        if pos:
+            pos.append(tok)
+        elif tok.startswith("--"):
+            key, sep, val = tok[2:].partition("=")
+            if key in _FLAG_OPTS:
+                opts[key] = True
+            else:
+                opts[key] = val if sep else next(it)
+        elif tok in _SHORT_OPTS:
+            opts[_SHORT_OPTS[tok]] = next(it)
+        else:
+            pos.append(tok)
+    return pos
+
+
+def _read_json(json_path):
+    """Return content of JSON file."""
+    with open(json_path) as jf:
+        return json.load(jf)
+
+
+def _write_json(json_path, content):
+    """Atomically write content to JSON file."""
+    tmp_path = f"{json_path}.tmp{os.getpid()}_{threading.get_ident()}"
+    with open(tmp_path, "w") as jf:
+        json.dump(content, jf)
+    os.replace(tmp_path, json_path)
+
+
+def _next_id(state_dir):
+    """Return next job ID, safe for concurrent submissions."""
+    with open(os.path.join(state_dir, "counter.lock"), "a+") as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
+        lf.seek(0)
+        last_id = int(lf.read() or 1000)
+        lf.seek(0)
+        lf.truncate()
+        lf.write(str(last_id + 1))
+    return str(last_id + 1)
+
+
+def _job_cmd(opts, pos):
+    """Return command list of wrapped command or script."""
+    if "wrap" in opts:
+        return ["sh", "-c", opts["wrap"]]
+    with open(pos[0]) as sf:
+        first = sf.readline()
+    if first.startswith("#!"):
+        return shlex.split(first[2:]) + pos
+    return ["sh"] + pos
+
+
+def fake_sbatch(argv, state_dir, latency, max_running=None):
+    """Mimic sbatch, supporting options used by the submit module.
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments
+    state_dir : str, os.PathLike
+        Location of fake scheduler state
+    latency : float
+        Seconds each job waits in the fake queue
+    max_running : int, optional
+        Maximum number of simultaneously running jobs submitted
+        outside of a job
+
+    Returns
+    -------
+    int
+        Exit status, job exit status when --wait is used
+
+    """
+    start = time.time()
+    opts = {}
+    pos = _parse_opts(argv, opts)
+    if "wrap" not in opts:
+        with open(pos[0]) as sf:
+            directives = [
+                x.split(None, 1)[1].strip()
+                for x in sf
+                if x.startswith("#SBATCH")
+            ]
+        script_opts = {}
+        _parse_opts(" ".join(directives).split(), script_opts)
+        opts = {**script_opts, **opts}
+
+    # Determine tasks, write job records
+    job_id = _next_id(state_dir)
+    tasks, limit = [None], 1
+    if "array" in opts:
+        arr, _, lim = opts["array"].partition("%")
+        first, _, last = arr.partition("-")
+        tasks = list(range(int(first), int(last or first) + 1))
+        limit = int(lim) if lim else len(tasks)
+    for task in tasks:
+        rec_id = job_id if task is None else f"{job_id}_{task}"
+        _write_json(
+            os.path.join(state_dir, f"{rec_id}.json"),
+            {
+                "JobID": rec_id,
+                "JobName": opts.get("job-name", "sbatch"),
+                "State": "PENDING",
+                "ExitCode": "0:0",
+                "Submit": start,
+                "AllocCPUS": int(opts.get("cpus-per-task", 1)),
+                "ReqMem": opts.get("mem", "1G"),
+                "Timelimit": opts.get("time", "1:00:00"),
+            },
+        )
+
+    # Jobs run in the submission environment, the dispatcher only
+    # considers specs of jobs which are not waited on.
+    _write_json(
+        os.path.join(state_dir, f"{job_id}.spec"),
+        {
+            "cmd": _job_cmd(opts, pos),
+            "output": opts.get("output", "slurm-%j.out"),
+            "error": opts.get("error", opts.get("output", "slurm-%j.out")),
+            "dependency": opts.get("dependency"),
+            "cpus": opts.get("cpus-per-task", 1),
+            "tasks": tasks,
+            "limit": limit,
+            "submit": start,
+            "wait": bool(opts.get("wait")),
+            "nested": "SLURM_JOB_ID" in os.environ,
+            "env": dict(os.environ),
+        },
+    )
+    _log_call(state_dir, "sbatch", start, job_id=job_id, tasks=len(tasks))
+
+    # Execute job, sbatch reports the ID before waiting
+    if opts.get("wait"):
+        print(
+            job_id
+            if opts.get("parsable")
+            else f"Submitted batch job {job_id}",
+            flush=True,
+        )
+        return _run_job(state_dir, job_id, latency)
+    subprocess.Popen(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            state_dir,
+            str(latency),
+            str(max_running or 0),
+        ],
+        env=_job_env(os.environ),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    if opts.get("parsable"):
+        print(job_id)
+    else:
+        print(f"Submitted batch job {job_id}")
+    return 0
+
+
+def _job_env(env):
+    """Return copy of env able to import func_mriqc of this source tree."""
+    pkg_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    h_env = dict(env)
+    h_env["PYTHONPATH"] = os.pathsep.join(
+        [pkg_parent, h_env.get("PYTHONPATH", "")]
+    )
+    return h_env
+
+
+def _rec_ids(state_dir, job_id):
+    """Return record IDs of job, array task, or array job."""
+    if "_" in job_id:
+        return [job_id]
+    spec_path = os.path.join(state_dir, f"{job_id}.spec")
+    if not os.path.exists(spec_path):
+        return []
+    return [
+        job_id if x is None else f"{job_id}_{x}"
+        for x in _read_json(spec_path)["tasks"]
+    ]
+
+
+def _job_states(state_dir, job_id):
+    """Return {record_id: state} for job or array job."""
+    out_dict = {}
+    for rec_id in _rec_ids(state_dir, job_id):
+        try:
+            rec = _read_json(os.path.join(state_dir, f"{rec_id}.json"))
+        except FileNotFoundError:
+            continue
+        out_dict[rec_id] = rec["State"]
+    return out_dict
+
+
+def _deps_state(dependency, task, get_states):
+    """Return whether dependencies are satisfied, None while pending."""
+    if not dependency:
+        return True
+    dep_type, *dep_ids = dependency.split(":")
+    for dep_id in dep_ids:
+        if dep_type == "aftercorr" and task is not None:
+            dep_id = f"{dep_id}_{task}"
+        states = get_states(dep_id)
+        if not states or any(x not in _TERMINAL for x in states.values()):
+            return None
+        if dep_type != "afterany" and any(
+            x != "COMPLETED" for x in states.values()
+        ):
+            return False
+    return True
+
+
+def _deps_ok(state_dir, dependency, task):
+    """Wait for dependencies to finish, return whether satisfied."""
+    while True:
+        dep_ok = _deps_state(
+            dependency, task, lambda x: _job_states(state_dir, x)
+        )
+        if dep_ok is not None:
+            return dep_ok
+        time.sleep(0.05)
+
+
+def _cancel_task(state_dir, rec_id):
+    """Mark task as cancelled due to unsatisfiable dependency."""
+    rec_path = os.path.join(state_dir, f"{rec_id}.json")
+    rec = _read_json(rec_path)
+    rec.update({"State": "CANCELLED", "End": time.time()})
+    _write_json(rec_path, rec)
+
+
+def _exec_task(state_dir, job_id, spec, task):
+    """Execute single job or array task, return exit status."""
+    rec_id = job_id if task is None else f"{job_id}_{task}"
+    rec_path = os.path.join(state_dir, f"{rec_id}.json")
+    rec = _read_json(rec_path)
+    rec.update({"State": "RUNNING", "Start": time.time()})
+    _write_json(rec_path, rec)
+
+    # Setup environment, log paths
+    h_env = _job_env(spec.get("env", os.environ))
+    h_env["SLURM_JOB_ID"] = job_id
+    h_env["SLURM_CPUS_PER_TASK"] = str(spec["cpus"])
+    log_paths = []
+    for log_key in ["output", "error"]:
+        h_path = spec[log_key].replace("%A", job_id).replace("%j", job_id)
+        h_path = h_path.replace("%x", rec["JobName"])
+        if task is not None:
+            h_env["SLURM_ARRAY_JOB_ID"] = job_id
+            h_env["SLURM_ARRAY_TASK_ID"] = str(task)
+            h_path = h_path.replace("%a", str(task))
+        log_paths.append(h_path)
+
+    # Run, capture resource usage
+    with open(log_paths[0], "a") as out_f, open(log_paths[1], "a") as err_f:
+        h_sp = subprocess.Popen(
+            spec["cmd"], env=h_env, stdout=out_f, stderr=err_f
+        )
+        _, status, rusage = os.wait4(h_sp.pid, 0)
+    h_sp.returncode = os.waitstatus_to_exitcode(status)
+    rec.update(
+        {
+            "State": "COMPLETED" if h_sp.returncode == 0 else "FAILED",
+            "ExitCode": f"{max(h_sp.returncode, 0)}:0",
+            "End": time.time(),
+            "MaxRSS": rusage.ru_maxrss,
+            "TotalCPU": rusage.ru_utime + rusage.ru_stime,
+        }
+    )
+    _write_json(rec_path, rec)
+    return h_sp.returncode
+
+
+def _run_task(state_dir, job_id, spec, task, latency):
+    """Wait for dependencies and queue, execute task."""
+    rec_id = job_id if task is None else f"{job_id}_{task}"
+    if not _deps_ok(state_dir, spec["dependency"], task):
+        _cancel_task(state_dir, rec_id)
+        return 1
+    time.sleep(latency)
+    return _exec_task(state_dir, job_id, spec, task)
+
+
+def _run_job(state_dir, job_id, latency):
+    """Execute job or array job within the caller, return exit status."""
+    spec = _read_json(os.path.join(state_dir, f"{job_id}.spec"))
+    pool = []
+    status = {}
+    for task in spec["tasks"]:
+        while sum(x.is_alive() for x in pool) >= spec["limit"]:
+            time.sleep(0.05)
+        h_thread = threading.Thread(
+            target=lambda x: status.update(
+                {x: _run_task(state_dir, job_id, spec, x, latency)}
+            ),
+            args=(task,),
+        )
+        h_thread.start()
+        pool.append(h_thread)
+    for h_thread in pool:
+        h_thread.join()
+    return max(status.values())
+
+
+def _dispatch(state_dir, latency, max_running, poll=0.1, idle_exit=3.0):
+    """Run queued jobs as the single dispatcher of state_dir.
+
+    Jobs start once their dependencies are satisfied, they waited
+    latency seconds, and their array limit and max_running allow.
+    Returns immediately when another dispatcher is active, exits
+    once the queue was empty for idle_exit seconds.
+
+    """
+    known = set()
+    final = {}
+    dep_recs = {}
+    pending = []
+    running = {}
+
+    def _states(dep_id):
+        """Return states of dependency, avoiding reads of active jobs."""
+        if dep_id not in dep_recs:
+            dep_recs[dep_id] = _rec_ids(state_dir, dep_id)
+        rec_ids = dep_recs[dep_id]
+        if not rec_ids:
+            del dep_recs[dep_id]
+        if any(x in running or x in active for x in rec_ids):
+            return {x: "PENDING" for x in rec_ids}
+        out_dict = {}
+        for rec_id in rec_ids:
+            if rec_id not in final:
+                state = _read_json(os.path.join(state_dir, f"{rec_id}.json"))[
+                    "State"
+                ]
+                if state not in _TERMINAL:
+                    return {rec_id: state}
+                final[rec_id] = state
+            out_dict[rec_id] = final[rec_id]
+        return out_dict
+
+    def _scan():
+        """Queue pending tasks of new job specs."""
+        for spec_name in os.listdir(state_dir):
+            if not spec_name.endswith(".spec") or spec_name in known:
+                continue
+            known.add(spec_name)
+            spec = _read_json(os.path.join(state_dir, spec_name))
+            if spec.get("wait"):
+                continue
+            job_id = spec_name[:-5]
+            for task in spec["tasks"]:
+                rec_id = job_id if task is None else f"{job_id}_{task}"
+                rec = _read_json(os.path.join(state_dir, f"{rec_id}.json"))
+                if rec["State"] == "PENDING":
+                    pending.append((rec_id, job_id, spec, task))
+
+    lock_path = os.path.join(state_dir, "dispatch.lock")
+    with open(lock_path, "a") as lf:
+        while True:
+            try:
+                fcntl.flock(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            idle_since = time.time()
+            while True:
+                _scan()
+                active = {x[0] for x in pending}
+                for rec_id in [
+                    x for x, y in running.items() if not y[1].is_alive()
+                ]:
+                    del running[rec_id]
+                now = time.time()
+                waiting = []
+                for rec_id, job_id, spec, task in pending:
+                    dep_ok = _deps_state(spec["dependency"], task, _states)
+                    if dep_ok is False:
+                        _cancel_task(state_dir, rec_id)
+                        continue
+                    num_job = sum(x[0] == job_id for x in running.values())
+                    num_top = sum(not x[2] for x in running.values())
+                    if (
+                        dep_ok is None
+                        or now < spec["submit"] + latency
+                        or num_job >= spec["limit"]
+                        or (
+                            max_running
+                            and not spec["nested"]
+                            and num_top >= max_running
+                        )
+                    ):
+                        waiting.append((rec_id, job_id, spec, task))
+                        continue
+                    h_thread = threading.Thread(
+                        target=_exec_task, args=(state_dir, job_id, spec, task)
+                    )
+                    h_thread.start()
+                    running[rec_id] = (job_id, h_thread, spec["nested"])
+                pending = waiting
+                if pending or running:
+                    idle_since = now
+                elif now - idle_since > idle_exit:
+                    break
+                time.sleep(poll)
+
+            # Release, then pick up jobs submitted while exiting
+            fcntl.flock(lf, fcntl.LOCK_UN)
+            _scan()
+            if not pending:
+                return 0
+
+
+def wait_idle(state_dir, poll=0.2, timeout=None):
+    """Wait for all fake jobs to finish.
+
+    Parameters
+    ----------
+    state_dir : str, os.PathLike
+        Location of fake scheduler state
+    poll : float, optional
+        Seconds between checks
+    timeout : float, optional
+        Seconds after which TimeoutError is raised
+
+    Returns
+    -------
+    list
+        Job records
+
+    """
+    deadline = time.time() + timeout if timeout else None
+    final = {}
+    while True:
+        pending = 0
+        for json_name in os.listdir(state_dir):
+            if not json_name.endswith(".json") or json_name in final:
+                continue
+            try:
+                rec = _read_json(os.path.join(state_dir, json_name))
+            except (FileNotFoundError, ValueError):
+                pending += 1
+                continue
+            if rec["State"] in _TERMINAL:
+                final[json_name] = rec
+            else:
+                pending += 1
+        if not pending:
+            return list(final.values())
+        if deadline and time.time() > deadline:
+            raise TimeoutError(f"{pending} jobs unfinished in {state_dir}")
+        time.sleep(poll)
+
+
+def _fmt_time(seconds):
+    """Return seconds formatted as [D-]HH:MM:SS."""
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    h_str = time.strftime("%H:%M:%S", time.gmtime(seconds))
+    return f"{days}-{h_str}" if days else h_str
+
+
+def _fmt_field(rec, field):
+    """Return sacct formatted field of job record."""
+    if field in ["Submit", "Start", "End"]:
+        if field not in rec:
+            return "Unknown"
+        return datetime.fromtimestamp(rec[field]).strftime("%Y-%m-%dT%H:%M:%S")
+    if field == "Elapsed":
+        if "Start" not in rec:
+            return "00:00:00"
+        return _fmt_time(rec.get("End", time.time()) - rec["Start"])
+    if field == "TotalCPU":
+        return _fmt_time(rec.get("TotalCPU", 0))
+    if field == "MaxRSS":
+        return f"{rec['MaxRSS']}K" if "MaxRSS" in rec else ""
+    return str(rec.get(field, ""))
+
+
+def fake_sacct(argv, state_dir, latency, max_running=None):
+    """Mimic parsable sacct output for requested jobs and fields.
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, supports -j, -o, -n, -P, -X
+    state_dir : str, os.PathLike
+        Location of fake scheduler state
+    latency : float
+        Unused, for signature parity
+    max_running : int, optional
+        Unused, for signature parity
+
+    Returns
+    -------
+    int
+        Exit status
+
+    """
+    start = time.time()
+    job_ids, fields, header = [], ["JobID", "JobName", "State"], True
+    it = iter(argv)
+    for tok in it:
+        if tok in ["-j", "--jobs"]:
+            job_ids = next(it).split(",")
+        elif tok.startswith("--jobs="):
+            job_ids = tok.split("=", 1)[1].split(",")
+        elif tok in ["-o", "--format"]:
+            fields = next(it).split(",")
+        elif tok.startswith("--format="):
+            fields = tok.split("=", 1)[1].split(",")
+        elif tok in ["-n", "--noheader"]:
+            header = False
+
+    if header:
+        print("|".join(fields))
+    for job_id in job_ids:
+        for rec_id in sorted(_job_states(state_dir, job_id)):
+            rec = _read_json(os.path.join(state_dir, f"{rec_id}.json"))
+            print("|".join(_fmt_field(rec, x) for x in fields))
+    _log_call(state_dir, "sacct", start, jobs=len(job_ids))
+    return 0
+
+
+def fake_squeue(argv, state_dir, latency, max_running=None):
+    """Mimic squeue output of unfinished jobs.
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, supports -h, -o (%i, %j, %T), -j
+    state_dir : str, os.PathLike
+        Location of fake scheduler state
+    latency : float
+        Unused, for signature parity
+    max_running : int, optional
+        Unused, for signature parity
+
+    Returns
+    -------
+    int
+        Exit status
+
+    """
+    start = time.time()
+    job_ids, fmt = [], "%i %j %T"
+    it = iter(argv)
+    for tok in it:
+        if tok in ["-j", "--jobs"]:
+            job_ids = next(it).split(",")
+        elif tok in ["-o", "--format"]:
+            fmt = next(it)
+
+    for job_id in job_ids:
+        for rec_id, state in sorted(_job_states(state_dir, job_id).items()):
+            if state in _TERMINAL:
+                continue
+            rec = _read_json(os.path.join(state_dir, f"{rec_id}.json"))
+            print(
+                fmt.replace("%i", rec_id)
+                .replace("%j", rec["JobName"])
+                .replace("%T", state)
+            )
+    _log_call(state_dir, "squeue", start, jobs=len(job_ids))
+    return 0
+
+
+def _ssh_connect(ctl_path, connect_latency):
+    """Model connection setup, return whether a new one was made."""
+    if ctl_path and os.path.exists(ctl_path):
+        return False
+    time.sleep(connect_latency)
+    if ctl_path and os.path.isdir(os.path.dirname(ctl_path)):
+        open(ctl_path, "a").close()
+    return True
+
+
+def _parse_ssh(argv):
+    """Return ssh options, host, and remote command of arguments."""
+    opts = {}
+    it = iter(argv)
+    for tok in it:
+        if not tok.startswith("-") or tok == "-":
+            host = tok
+            break
+        flag = tok[1:]
+        for idx, char in enumerate(flag):
+            if char in _SSH_ARG_OPTS:
+                val = flag[idx:][1:] or next(it)
+                if char == "o":
+                    key, _, val = val.partition("=")
+                    opts[key] = val
+                else:
+                    opts[char] = val
+                break
+    else:
+        return opts, None, ""
+    return opts, host, " ".join(it)
+
+
+def fake_ssh(argv, state_dir, connect_latency=0.0):
+    """Mimic ssh, executing remote commands on the local machine.
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, supports -i, -o, -O
+    state_dir : str, os.PathLike
+        Location for appending call records
+    connect_latency : float, optional
+        Seconds taken to establish a new connection
+
+    Returns
+    -------
+    int
+        Exit status of remote command
+
+    """
+    start = time.time()
+    opts, _, remote_cmd = _parse_ssh(argv)
+    ctl_path = opts.get("ControlPath")
+    if "O" in opts:
+        if opts["O"] == "exit" and ctl_path and os.path.exists(ctl_path):
+            os.remove(ctl_path)
+        return 0
+
+    new_conn = _ssh_connect(ctl_path, connect_latency)
+    status = 0
+    if remote_cmd:
+        status = subprocess.run(["bash", "-c", remote_cmd]).returncode
+    _log_call(state_dir, "ssh", start, connect=new_conn, status=status)
+    return status
+
+
+def _rsync_copy(src, dst, update):
+    """Copy file or tree src to dst, return copied files and bytes."""
+    if os.path.isdir(src):
+        num_files = num_bytes = 0
+        os.makedirs(dst, exist_ok=True)
+        for name in sorted(os.listdir(src)):
+            h_files, h_bytes = _rsync_copy(
+                os.path.join(src, name), os.path.join(dst, name), update
+            )
+            num_files += h_files
+            num_bytes += h_bytes
+        return num_files, num_bytes
+
+    src_stat = os.stat(src)
+    if update and os.path.exists(dst):
+        dst_stat = os.stat(dst)
+        if dst_stat.st_mtime >= src_stat.st_mtime or (
+            dst_stat.st_size == src_stat.st_size
+            and int(dst_stat.st_mtime) == int(src_stat.st_mtime)
+        ):
+            return 0, 0
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.copy2(src, dst)
+    print(dst)
+    return 1, src_stat.st_size
+
+
+def fake_rsync(argv, state_dir, connect_latency=0.0, file_latency=0.0):
+    """Mimic rsync, resolving remote locations on the local machine.
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, supports -e, --files-from, -u, and
+        sources followed by a destination
+    state_dir : str, os.PathLike
+        Location for appending call records
+    connect_latency : float, optional
+        Seconds taken to establish a new SSH connection
+    file_latency : float, optional
+        Seconds taken for each transferred file
+
+    Returns
+    -------
+    int
+        Exit status, 23 when a source is missing
+
+    """
+    start = time.time()
+    rsh = files_from = None
+    update = False
+    pos = []
+    it = iter(argv)
+    for tok in it:
+        if tok == "-e":
+            rsh = next(it)
+        elif tok.startswith("--rsh=") or tok.startswith("--files-from="):
+            key, _, val = tok[2:].partition("=")
+            if key == "rsh":
+                rsh = val
+            else:
+                files_from = val
+        elif tok.startswith("--"):
+            continue
+        elif tok.startswith("-"):
+            update = update or "u" in tok
+        else:
+            pos.append(tok)
+    remote = any(_REMOTE_RE.match(x) for x in pos)
+    pos = [_REMOTE_RE.sub("", x) for x in pos]
+    src_list, dst = pos[:-1], pos[-1]
+
+    new_conn = False
+    if remote:
+        opts, _, _ = _parse_ssh(shlex.split(rsh or "ssh")[1:] + ["host"])
+        new_conn = _ssh_connect(opts.get("ControlPath"), connect_latency)
+
+    # Pair sources and destinations
+    pair_list = []
+    if files_from:
+        with open(files_from) as ff:
+            for line in ff:
+                rel = line.strip().rstrip("/")
+                if rel:
+                    pair_list.append(
+                        (
+                            os.path.join(src_list[0], rel),
+                            os.path.join(dst, rel),
+                        )
+                    )
+    else:
+        for src in src_list:
+            if src.endswith("/"):
+                pair_list.append((src, dst))
+            else:
+                pair_list.append(
+                    (src, os.path.join(dst, os.path.basename(src)))
+                )
+
+    status = num_files = num_bytes = 0
+    for src, h_dst in pair_list:
+        if not os.path.exists(src):
+            print(f"rsync: link_stat {src} failed", file=sys.stderr)
+            status = 23
+            continue
+        h_files, h_bytes = _rsync_copy(src, h_dst, update)
+        num_files += h_files
+        num_bytes += h_bytes
+    time.sleep(file_latency * num_files)
+    _log_call(
+        state_dir,
+        "rsync",
+        start,
+        connect=new_conn,
+        files=num_files,
+        bytes=num_bytes,
+        status=status,
+    )
+    return status
+
+
+def _write_iqms(json_path, stem, modality):
+    """Write reproducible IQM JSON of image stem."""
+    h_rand = random.Random(stem)
+    iqm_dict = {
+        x: round(h_rand.uniform(*y), 6) for x, y in _IQMS[modality].items()
+    }
+    iqm_dict["bids_meta"] = {"modality": stem.split("_")[-1]}
+    iqm_dict["provenance"] = {"software": "mriqc", "version": "23.1.0"}
+    os.makedirs(os.path.dirname(json_path), exist_ok=True)
+    with open(json_path, "w") as jf:
+        json.dump(iqm_dict, jf, indent=2)
+
+
+def _mriqc_participant(data_dir, out_dir, args, work_files):
+    """Write MRIQC-like participant output, return number of reports."""
+    opts = {}
+    it = iter(args)
+    for tok in it:
+        if tok.startswith("--") or tok == "-m":
+            key = tok.lstrip("-")
+            opts[key] = "" if key == "no-sub" else next(it)
+    subj = f"sub-{opts['participant_label']}"
+    sess = f"ses-{opts['session-id']}"
+
+    # Select images of requested modality, task, and run
+    stem_list = []
+    subj_raw = os.path.join(data_dir, subj, sess)
+    for modality, suff in [("anat", "T1w"), ("anat", "T2w"), ("func", "bold")]:
+        if opts.get("m", suff) != suff:
+            continue
+        for img_path in sorted(
+            glob.glob(f"{subj_raw}/{modality}/*_{suff}.nii.gz")
+        ):
+            stem = os.path.basename(img_path)[:-7]
+            if "task-id" in opts and f"task-{opts['task-id']}_" not in stem:
+                continue
+            if "run-id" in opts and not re.search(
+                rf"_run-0*{opts['run-id']}_", stem
+            ):
+                continue
+            stem_list.append((modality, stem))
+
+    # Write work, reports, IQMs, and figures
+    work_dir = os.path.join(opts.get("work", out_dir), "mriqc_wf")
+    os.makedirs(work_dir, exist_ok=True)
+    for idx in range(work_files):
+        with open(os.path.join(work_dir, f"node_{idx:04d}.pklz"), "wb") as wf:
+            wf.write(os.urandom(1024))
+    fig_dir = os.path.join(out_dir, subj, "figures")
+    os.makedirs(fig_dir, exist_ok=True)
+    for modality, stem in stem_list:
+        with open(os.path.join(out_dir, f"{stem}.html"), "w") as hf:
+            hf.write(f"<html><body>{stem}</body></html>\n")
+        _write_iqms(
+            os.path.join(out_dir, subj, sess, modality, f"{stem}.json"),
+            stem,
+            modality,
+        )
+        for fig in ["background", "zoomed"]:
+            with open(os.path.join(fig_dir, f"{stem}_{fig}.svg"), "w") as sf:
+                sf.write("<svg/>\n")
+    with open(os.path.join(out_dir, "dataset_description.json"), "w") as df:
+        json.dump({"Name": "MRIQC - MRI Quality Control"}, df)
+    return len(stem_list)
+
+
+def _mriqc_group(out_dir, args=()):
+    """Write MRIQC-like group TSV and HTML reports, of -m modalities."""
+    mod_list = []
+    for idx, tok in enumerate(args):
+        if tok in ["-m", "--modalities"]:
+            for mod in args[idx:][1:]:
+                if mod.startswith("-"):
+                    break
+                mod_list.append(mod)
+    for suff, modality in [("T1w", "anat"), ("T2w", "anat"), ("bold", "func")]:
+        if mod_list and suff not in mod_list:
+            continue
+        json_list = sorted(
+            glob.glob(f"{out_dir}/sub-*/ses-*/{modality}/*_{suff}.json")
+        )
+        if not json_list:
+            continue
+        col_list = sorted(_IQMS[modality])
+        with open(os.path.join(out_dir, f"group_{suff}.tsv"), "w") as tf:
+            tf.write("\t".join(["bids_name"] + col_list) + "\n")
+            for json_path in json_list:
+                iqm_dict = _read_json(json_path)
+                tf.write(
+                    "\t".join(
+                        [os.path.basename(json_path)[:-5]]
+                        + [str(iqm_dict.get(x, "")) for x in col_list]
+                    )
+                    + "\n"
+                )
+        with open(os.path.join(out_dir, f"group_{suff}.html"), "w") as hf:
+            hf.write(f"<html><body>group {suff}</body></html>\n")
+
+
+def _container_paths(args, bind_flags):
+    """Split container arguments, return binds and remaining args."""
+    binds = {}
+    rest = []
+    it = iter(args)
+    for tok in it:
+        if rest:
+            rest.append(tok)
+        elif tok in bind_flags:
+            host, _, cont = next(it).partition(":")
+            binds[cont.split(":")[0]] = host
+        elif tok.startswith("-"):
+            continue
+        else:
+            rest.append(tok)
+    return binds, rest
+
+
+def fake_singularity(argv, state_dir, mriqc_seconds=0.0, work_files=50):
+    """Mimic MRIQC participant runs via singularity.
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, supports "inspect --labels" and
+        "run" with --bind options of process._mriqc_cmd
+    state_dir : str, os.PathLike
+        Location for appending call records
+    mriqc_seconds : float, optional
+        Seconds taken by each run
+    work_files : int, optional
+        Number of files written to the MRIQC work directory
+
+    Returns
+    -------
+    int
+        Exit status
+
+    """
+    start = time.time()
+    if argv[0] == "inspect":
+        print("org.label-schema.version: 23.1.0")
+        return 0
+    binds, rest = _container_paths(argv[1:], ["--bind", "-B"])
+    _, data_dir, out_dir, level, *args = rest
+    data_dir = binds.get(data_dir, data_dir)
+    out_dir = binds.get(out_dir, out_dir)
+    time.sleep(mriqc_seconds)
+    if level == "group":
+        _mriqc_group(out_dir, args)
+        num_reports = 0
+    else:
+        num_reports = _mriqc_participant(data_dir, out_dir, args, work_files)
+    _log_call(state_dir, "singularity", start, reports=num_reports)
+    return 0 if level == "group" or num_reports else 1
+
+
+def fake_docker(argv, state_dir, mriqc_seconds=0.0):
+    """Mimic MRIQC group runs via docker.
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, supports "run" with -v options
+        of process.mriqc_group
+    state_dir : str, os.PathLike
+        Location for appending call records
+    mriqc_seconds : float, optional
+        Seconds taken by each run
+
+    Returns
+    -------
+    int
+        Exit status
+
+    """
+    start = time.time()
+    binds, rest = _container_paths(argv[1:], ["-v", "--volume"])
+    _, _, out_dir, level = rest[:4]
+    out_dir = binds.get(out_dir, out_dir)
+    time.sleep(mriqc_seconds)
+    if level != "group":
+        return 1
+    _mriqc_group(out_dir, rest[4:])
+    _log_call(state_dir, "docker", start)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(
+        _dispatch(sys.argv[1], float(sys.argv[2]), int(sys.argv[3]) or None)
+    )
@@ -0,0 +1,140 @@
+"""Tests of submit.JobTracker against the fake SLURM stand-ins."""
+
+import os
+import json
+import time
+import pytest
+from func_mriqc import submit
+
+
+def _calls(state_dir, tool):
+    """Return stand-in calls of tool."""
+    with open(os.path.join(state_dir, "calls.jsonl")) as cf:
+        return [x for x in map(json.loads, cf) if x["tool"] == tool]
+
+
+def test_submit_job(fake_slurm, tmp_path):
+    job = submit.submit_job("true", "test", str(tmp_path))
+    assert job.job_id.isdigit()
+    assert job.state == "PENDING"
+    with open(tmp_path / "submitted_jobs.tsv") as jf:
+        assert jf.read() == f"{job.job_id}\ttest\n"
+
+
+def test_submit_job_failure(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "sbatch").write_text(
+        "#!/bin/bash\necho 'sbatch: error: invalid partition' >&2\nexit 1\n"
+    )
+    os.chmod(bin_dir / "sbatch", 0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    with pytest.raises(RuntimeError, match="invalid partition"):
+        submit.submit_job("true", "test", str(tmp_path))
+
+
+def test_poll(fake_slurm, tmp_path):
+    job_ok = submit.submit_job("true", "ok", str(tmp_path))
+    job_fail = submit.submit_job("exit 3", "fail", str(tmp_path))
+    tracker = submit.JobTracker([job_ok, job_fail])
+    while tracker.pending:
+        _ = tracker.poll()
+        time.sleep(0.1)
+    assert job_ok.ok and job_ok.exit_code == "0:0"
+    assert job_fail.state == "FAILED" and not job_fail.ok
+    assert tracker.poll() == []
+
+
+def test_wait_any(fake_slurm, tmp_path):
+    job_fast = submit.submit_job("true", "fast", str(tmp_path))
+    job_slow = submit.submit_job("sleep 2", "slow", str(tmp_path))
+    tracker = submit.JobTracker([job_fast, job_slow], min_wait=0.1)
+    assert tracker.wait_any() == [job_fast]
+    assert tracker.wait_any() == [job_slow]
+    assert tracker.wait_any() == []
+
+
+def test_wait_any_timeout(fake_slurm, tmp_path):
+    job = submit.submit_job("sleep 2", "slow", str(tmp_path))
+    tracker = submit.JobTracker([job], min_wait=0.1)
+    assert tracker.wait_any(timeout=0.3) == []
+    assert tracker.wait_any() == [job]
+
+
+def test_wait_all(fake_slurm, tmp_path):
+    job_list = [
+        submit.submit_job(f"sleep 0.{x}", f"job{x}", str(tmp_path))
+        for x in range(4)
+    ]
+    tracker = submit.JobTracker(job_list, min_wait=0.1)
+    assert tracker.wait_all() == job_list
+    assert all(x.ok for x in job_list)
+
+
+def test_wait_all_timeout(fake_slurm, tmp_path):
+    job = submit.submit_job("sleep 2", "slow", str(tmp_path))
+    tracker = submit.JobTracker([job], min_wait=0.1)
+    with pytest.raises(TimeoutError, match="1 jobs unfinished"):
+        tracker.wait_all(timeout=0.3)
+    assert tracker.wait_all() == [job]
+
+
+def test_poll_chunks(fake_slurm):
+    # Jobs unknown to sacct are queried again via squeue
+    tracker = submit.JobTracker(
+        [submit.SbatchJob(str(x)) for x in range(9000, 10200)]
+    )
+    assert tracker.poll() == []
+    assert [x["jobs"] for x in _calls(fake_slurm, "sacct")] == [500, 500, 200]
+    assert [x["jobs"] for x in _calls(fake_slurm, "squeue")] == [
+        500,
+        500,
+        200,
+    ]
+
+
+def test_squeue_fallback(fake_slurm, tmp_path, monkeypatch):
+    job = submit.submit_job("sleep 1", "test", str(tmp_path))
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "sacct").write_text(
+        "#!/bin/bash\necho 'sacct: error: slurmdbd down' >&2\nexit 1\n"
+    )
+    os.chmod(bin_dir / "sacct", 0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    job.state = None
+    tracker = submit.JobTracker([job])
+    assert tracker.poll() == [job]
+    assert job.state in ["PENDING", "RUNNING"]
+    assert len(_calls(fake_slurm, "squeue")) == 1
+
+
+def test_backoff(monkeypatch):
+    wait_list = []
+    monkeypatch.setattr(submit.time, "sleep", wait_list.append)
+    tracker = submit.JobTracker(min_wait=1, max_wait=5, backoff=2)
+    for changed in [[], [], [], [], ["job"], []]:
+        tracker._sleep(changed, None)
+    assert wait_list == [2, 4, 5, 5, 1, 2]
+
+    # Waits are bounded by the deadline
+    wait_list.clear()
+    tracker._sleep([], time.monotonic() - 1)
+    assert wait_list == [0]
+
+
+def test_backoff_polls(fake_slurm, tmp_path, monkeypatch):
+    wait_list = []
+    real_sleep = time.sleep
+
+    def _sleep(seconds):
+        wait_list.append(seconds)
+        real_sleep(0.05)
+
+    monkeypatch.setattr(submit.time, "sleep", _sleep)
+    job = submit.submit_job("sleep 1", "test", str(tmp_path))
+    tracker = submit.JobTracker([job], min_wait=0.01, max_wait=0.1)
+    _ = tracker.wait_all()
+    assert len(wait_list) > 3
+    assert max(wait_list) == 0.1
+    assert all(x <= 0.1 for x in wait_list)